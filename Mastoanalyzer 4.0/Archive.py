@@ -0,0 +1,224 @@
+# Contains the archive of the raw API responses, used to reprocess a crawl offline (record/replay)
+import logging
+import os
+import json
+import gzip
+import time
+import threading
+from collections import defaultdict, deque
+from urllib.parse import urlsplit, parse_qsl
+import httpx
+import requests
+from requests.structures import CaseInsensitiveDict
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+INDEX_FILE = 'index.jsonl'
+# Headers not replayed: the rate limit and the clock at recording time, and the encoding of the body, which is stored decoded.
+NOT_REPLAYED_HEADERS = ('date', 'x-ratelimit-limit', 'x-ratelimit-remaining', 'x-ratelimit-reset',
+                        'content-encoding', 'content-length', 'transfer-encoding')
+# Statuses not replayed: the throttling of the server at recording time. Without their rate-limit headers they
+# would make the crawler wait the default 300 seconds; the retry that followed them is in the archive.
+NOT_REPLAYED_STATUSES = (429, 503)
+
+def request_key(url, params=None):
+    """
+    Builds the key a response is looked up with: the URL without query and the sorted query parameters.
+    The parameters already in the URL and the ones in `params` are merged, so the key does not depend on
+    how the client encoded the request.
+
+    Parameters:
+    - url (str): The URL of the request, possibly with a query string.
+    - params (dict): The query parameters not already in the URL; list values become repeated parameters.
+
+    Returns:
+    - tuple: (base_url, ((name, value), ...)).
+    """
+    parts = urlsplit(str(url))
+    pairs = parse_qsl(parts.query, keep_blank_values=True)
+    for name, value in (params or {}).items():
+        values = value if isinstance(value, (list, tuple)) else [value]
+        pairs.extend((name, str(v)) for v in values)
+    base_url = f"{parts.scheme}://{parts.netloc}{parts.path}"
+    return base_url, tuple(sorted(pairs))
+
+class ResponseArchive:
+    """
+    Append-only archive of the raw API responses. Every response is a gzip member appended to the
+    current segment file (segment-00001.gz, segment-00002.gz...), and a line of `index.jsonl` records
+    where it is (segment, offset, length) with its URL, parameters, timestamp, status and headers.
+    A new segment is started when the current one exceeds `segment_size` bytes.
+    """
+
+    def __init__(self, directory, segment_size=64 * 1024 * 1024):
+        """
+        Parameters:
+        - directory (str): The folder of the archive, created if missing. An existing archive is extended.
+        - segment_size (int): Size in bytes after which a new segment file is started.
+        """
+        self.directory = directory
+        self.segment_size = segment_size
+        self.lock = threading.Lock()  # The sync crawler and the async workers may record at the same time.
+        os.makedirs(directory, exist_ok=True)
+        segments = sorted(name for name in os.listdir(directory) if name.startswith('segment-'))
+        self.segment = int(segments[-1][8:13]) if segments else 1
+        self.segment_file = None
+        self.index_file = None
+
+    def segment_path(self, segment):
+        return os.path.join(self.directory, f"segment-{segment:05d}.gz")
+
+    def record(self, url, params, status, headers, body):
+        """
+        Appends a response to the archive.
+
+        Parameters:
+        - url (str): The URL of the request, possibly with a query string.
+        - params (dict): The query parameters not already in the URL.
+        - status (int): The HTTP status of the response.
+        - headers (dict-like): The headers of the response.
+        - body (bytes): The body of the response.
+        """
+        base_url, pairs = request_key(url, params)
+        member = gzip.compress(body)
+        with self.lock:
+            if self.segment_file is None:
+                self.segment_file = open(self.segment_path(self.segment), 'ab')
+                self.index_file = open(os.path.join(self.directory, INDEX_FILE), 'a', encoding='utf-8')
+            offset = self.segment_file.tell()
+            if offset >= self.segment_size:
+                self.segment_file.close()
+                self.segment += 1
+                self.segment_file = open(self.segment_path(self.segment), 'ab')
+                offset = 0
+            self.segment_file.write(member)
+            self.segment_file.flush()
+            entry = {
+                'url': base_url,
+                'params': pairs,
+                'ts': time.time(),
+                'status': status,
+                'headers': dict(headers),
+                'segment': self.segment,
+                'offset': offset,
+                'length': len(member),
+            }
+            # The index line is written after the body, so an entry always points to complete data.
+            self.index_file.write(json.dumps(entry) + '\n')
+            self.index_file.flush()
+
+    def record_requests(self, response):
+        """
+        Records a `requests` response (synchronous crawler).
+        """
+        self.record(response.url, None, response.status_code, response.headers, response.content)
+
+    async def record_httpx(self, response):
+        """
+        Records an httpx response. Meant as a 'response' event hook of an `httpx.AsyncClient`.
+        """
+        await response.aread()
+        self.record(response.request.url, None, response.status_code, response.headers, response.content)
+
+    def entries(self, url_prefix=None):
+        """
+        Reads the index of the archive, in recording order.
+
+        Parameters:
+        - url_prefix (str): If given, only the responses whose URL starts with it are returned.
+
+        Returns:
+        - list: The index entries (dict).
+        """
+        path = os.path.join(self.directory, INDEX_FILE)
+        if not os.path.exists(path):
+            return []
+        entries = []
+        with open(path, encoding='utf-8') as index_file:
+            for line in index_file:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    continue  # A line cut by a crash.
+                if url_prefix is None or entry['url'].startswith(url_prefix):
+                    entries.append(entry)
+        return entries
+
+    def read(self, entry):
+        """
+        Returns the body (bytes) of an index entry.
+        """
+        with open(self.segment_path(entry['segment']), 'rb') as segment_file:
+            segment_file.seek(entry['offset'])
+            return gzip.decompress(segment_file.read(entry['length']))
+
+    def close(self):
+        with self.lock:
+            if self.segment_file is not None:
+                self.segment_file.close()
+                self.index_file.close()
+                self.segment_file = None
+                self.index_file = None
+
+class ArchiveReplay:
+    """
+    Serves the archived responses in place of the server. The same request receives its recorded
+    responses in recording order (the last one is repeated when they run out), so the existing
+    parsing and database code runs on them at local speed, without using the rate limit.
+    The recorded 429 and 503 responses are skipped, so a replay never waits for a rate limit.
+    """
+
+    def __init__(self, archive, url_prefix=None):
+        """
+        Parameters:
+        - archive (ResponseArchive): The archive to replay.
+        - url_prefix (str): If given, only the responses whose URL starts with it are replayed.
+        """
+        self.archive = archive
+        self.responses = defaultdict(deque)
+        for entry in archive.entries(url_prefix):
+            if entry['status'] in NOT_REPLAYED_STATUSES:
+                continue
+            self.responses[(entry['url'], tuple(map(tuple, entry['params'])))].append(entry)
+        self.replayed = 0
+        self.missing = 0
+
+    def lookup(self, url, params=None):
+        """
+        Returns (status, headers, body) of the next recorded response of a request, or None if the request was never recorded.
+        """
+        recorded = self.responses.get(request_key(url, params))
+        if not recorded:
+            self.missing += 1
+            return None
+        entry = recorded.popleft() if len(recorded) > 1 else recorded[0]
+        headers = {name: value for name, value in entry['headers'].items() if name.lower() not in NOT_REPLAYED_HEADERS}
+        self.replayed += 1
+        return entry['status'], headers, self.archive.read(entry)
+
+    def get(self, url, params=None, **kwargs):
+        """
+        Drop-in replacement of `requests.get` for the synchronous crawler. A request that was never
+        recorded receives an empty page, so the crawl ends where the recorded one ended.
+        """
+        found = self.lookup(url, params)
+        status, headers, body = found if found else (200, {'Content-Type': 'application/json'}, b'[]')
+        response = requests.models.Response()
+        response.status_code = status
+        response.headers = CaseInsensitiveDict(headers)
+        response._content = body
+        response.url = requests.Request('GET', url, params=params).prepare().url
+        response.encoding = 'utf-8'
+        return response
+
+    def transport(self):
+        """
+        Returns an httpx transport serving the archived responses, for `httpx.AsyncClient(transport=...)`.
+        A request that was never recorded fails like a network error, so no user is deleted because of it.
+        """
+        def handler(request):
+            found = self.lookup(request.url)
+            if found is None:
+                raise httpx.ConnectError(f"{request.url} is not in the archive", request=request)
+            status, headers, body = found
+            return httpx.Response(status, headers=headers, content=body)
+        return httpx.MockTransport(handler)
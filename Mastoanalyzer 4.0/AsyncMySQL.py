@@ -0,0 +1,251 @@
+#query the table from the asynchronous fetch functions, through a shared aiomysql connection pool
+import logging
+import sys
+import os
+import aiomysql
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from credentials import host, user, password, database
+from MySQL import USER_COLUMNS, USER_UPDATE_COLUMNS, POST_COLUMNS, POST_UPDATE_COLUMNS, build_upsert_query, upsert_chunks, retryable
+from MySQL import KEYSET_FIRST_PAGE_QUERY, KEYSET_NEXT_PAGE_QUERY, LATEST_POST_ID_QUERY
+from BotProfile import update_bot_profile_async
+from PostingStats import unique_posts, create_posting_stats_table_async, existing_posts_async, update_posting_stats_async
+
+async def create_pool(minsize=1, maxsize=10):
+    """
+    Creates the pool of connections shared by the asynchronous fetch tasks.
+    Each task borrows a connection only for the time of a query, so the tasks never share one.
+    The connections are in autocommit mode: a read leaves no transaction open, so the pool keeps the
+    connection instead of closing it on release (aiomysql closes a connection released inside a
+    transaction). The writers open their transactions with `conn.begin()`.
+
+    Parameters:
+    - minsize (int): The number of connections opened immediately.
+    - maxsize (int): The maximum number of connections open at the same time.
+
+    Returns:
+    - aiomysql.Pool: The connection pool. Close it with `pool.close()` and `await pool.wait_closed()`.
+    """
+    return await aiomysql.create_pool(
+        host=host,
+        user=user,
+        password=password,
+        db=database,
+        minsize=minsize,
+        maxsize=maxsize,
+        autocommit=True
+    )
+
+async def del_user(url, db_pool):
+    """
+    Deletes a user record from the 'users' table based on the user's URL.
+
+    Parameters:
+    - url (str): The URL of the user to be deleted.
+    - db_pool (aiomysql.Pool): The pool of connections to the MySQL database.
+    """
+    # Extracts the user ID from the URL
+    IDuser = url.split('/')[6]
+
+    async with db_pool.acquire() as conn:
+        async with conn.cursor() as cursor:
+            await cursor.execute(
+            """
+                DELETE FROM users
+                WHERE user_id = %s;
+            """,
+            (IDuser,)
+            )
+        await conn.commit()
+
+async def in_transaction(db_pool, work, max_attempts=3):
+    """
+    Asynchronous version of `MySQL.in_transaction`: runs `await work(cursor)` in a transaction on one
+    connection of the pool and commits it, running it again after a deadlock or a lock wait timeout.
+
+    Returns:
+    - The result of `work`.
+    """
+    async with db_pool.acquire() as conn:
+        for attempt in range(1, max_attempts + 1):
+            await conn.begin()
+            try:
+                async with conn.cursor() as cursor:
+                    result = await work(cursor)
+                await conn.commit()
+                return result
+            except Exception as e:
+                await conn.rollback()
+                if not retryable(e) or attempt == max_attempts:
+                    raise
+                logging.warning(f"Transaction rolled back ({e}), running it again ({attempt + 1}/{max_attempts}).")
+
+async def upsert_rows(cursor, table, columns, update_columns, rows, chunk_size):
+    """
+    Asynchronous version of `MySQL.upsert_rows`: multi-row INSERT statements of `chunk_size` rows,
+    a failing chunk is written again row by row; nothing is committed.
+
+    Returns:
+    - int: The number of rows that could not be written.
+    """
+    failed = 0
+    for query, values, chunk in upsert_chunks(table, columns, update_columns, rows, chunk_size):
+        try:
+            await cursor.execute(query, values)
+        except Exception as e:
+            if retryable(e):
+                raise
+            logging.warning(f"Error in a chunk of {table}, writing it row by row: {e}")
+            single_row_query = build_upsert_query(table, columns, update_columns)
+            for row in chunk:
+                try:
+                    await cursor.execute(single_row_query, row)
+                except Exception as e:
+                    if retryable(e):
+                        raise
+                    failed += 1
+                    logging.error(f"Row of {table} not written: {e}")
+    return failed
+
+async def upsert_in_chunks(db_pool, table, columns, update_columns, rows, chunk_size):
+    """
+    Asynchronous version of `MySQL.upsert_in_chunks`: multi-row INSERT statements of `chunk_size` rows,
+    a failing chunk is written again row by row, all in one transaction.
+
+    Parameters:
+    - db_pool (aiomysql.Pool): The pool of connections to the MySQL database.
+    - table (str): The name of the table.
+    - columns (list): The columns written, in the order of the tuples.
+    - update_columns (list): The columns updated when the key already exists.
+    - rows (list): The tuples to write.
+    - chunk_size (int): The maximum number of rows in each statement.
+
+    Returns:
+    - int: The number of rows that could not be written.
+    """
+    rows = list(rows)
+    if not rows:
+        return 0
+
+    async def write(cursor):
+        return await upsert_rows(cursor, table, columns, update_columns, rows, chunk_size)
+    return await in_transaction(db_pool, write)
+
+async def write_posts(cursor, posts, chunk_size):
+    """
+    Asynchronous version of `MySQL.write_posts`: writes a batch of posts and counts the new ones in the
+    posting statistics, in the transaction of `cursor`.
+    """
+    existing = await existing_posts_async(cursor, list(posts))
+    added, recompute = [], {}
+    candidates = [post for post_id, post in posts.items() if post_id not in existing]
+    for query, values, chunk in upsert_chunks("posts", POST_COLUMNS, [], candidates, chunk_size):
+        try:
+            await cursor.execute(query, values)
+            added.extend(chunk)
+        except Exception as e:
+            if retryable(e):
+                raise
+            await upsert_rows(cursor, "posts", POST_COLUMNS, POST_UPDATE_COLUMNS, chunk, 1)
+            recompute.update((post[20], post[21]) for post in chunk)
+    await upsert_rows(cursor, "posts", POST_COLUMNS, POST_UPDATE_COLUMNS, [posts[post_id] for post_id in existing], chunk_size)
+    await update_posting_stats_async(cursor, added, recompute)
+
+async def create_bots_users_table_bulk(all_users, db_pool, chunk_size=500):
+    """
+    Inserts new user data into the 'users' table or updates existing records, in multi-row statements.
+
+    Parameters:
+    - all_users (list): A list of tuples containing user data (user_id, username, bot, url, followers, following, statuses, description).
+    - db_pool (aiomysql.Pool): The pool of connections to the MySQL database.
+    - chunk_size (int): The maximum number of users in each statement.
+    """
+    await upsert_in_chunks(db_pool, "users", USER_COLUMNS, USER_UPDATE_COLUMNS, all_users, chunk_size)
+    await update_bot_profile_async(db_pool, all_users=all_users)  # Bots seen for the first time enter the bot profile.
+
+async def create_post_per_user_bulk(db_pool, tupla_post, chunk_size=200):
+    """
+    Inserts a list of posts into the 'posts' table, or updates the existing ones, in multi-row statements.
+
+    Parameters:
+    - db_pool (aiomysql.Pool): The pool of connections to the MySQL database.
+    - tupla_post (list): A list of tuples, where each tuple contains the data for a single post.
+    - chunk_size (int): The maximum number of posts in each statement.
+    """
+    posts = unique_posts(tupla_post)
+    if not posts:
+        return
+    await create_posting_stats_table_async(db_pool)
+
+    async def write(cursor):
+        await write_posts(cursor, posts, chunk_size)
+    try:
+        await in_transaction(db_pool, write)  # Posts and posting statistics on one connection, in one transaction.
+    except Exception as e:
+        logging.error(f"Posts not written: {e}")
+
+async def get_latest_post_id(account_id, db_pool):
+    """
+    Retrieves the ID of the newest post stored for an account.
+
+    Parameters:
+    - account_id (str): The ID of the account.
+    - db_pool (aiomysql.Pool): The pool of connections to the MySQL database.
+
+    Returns:
+    - str: The ID of the newest stored post, or None if the account has no posts in the table.
+    """
+    async with db_pool.acquire() as conn:
+        async with conn.cursor() as cursor:
+            await cursor.execute(LATEST_POST_ID_QUERY, (account_id,))
+            row = await cursor.fetchone()
+    return str(row[0]) if row and row[0] is not None else None
+
+async def get_data_from_table(db_pool, table, offset, limit):
+    """
+    Retrieves a specified range of user data from a given table where the number of statuses is greater than 200.
+
+    Parameters:
+    - db_pool (aiomysql.Pool): The pool of connections to the MySQL database.
+    - table (str): The table name from which to fetch the data.
+    - offset (int): The offset for pagination, determining the starting point.
+    - limit (int): The number of records to retrieve.
+
+    Returns:
+    - list: A list of tuples containing user data (user_id, username, bot, url, followers, following, statuses, description).
+    """
+    async with db_pool.acquire() as conn:
+        async with conn.cursor() as cursor:
+            await cursor.execute(f"SELECT user_id, username, bot, url, followers, following, statuses, description FROM {table} WHERE statuses > 200 ORDER BY statuses DESC LIMIT {limit} OFFSET {offset}")
+            return await cursor.fetchall()
+
+async def iter_users_keyset(db_pool, batch_size=100, min_statuses=200):
+    """
+    Asynchronous version of `MySQL.iter_users_keyset`: streams the users with more than `min_statuses`
+    statuses in batches, with keyset pagination on (statuses, user_id). As there, a user whose statuses count
+    changes during the scan can be skipped or returned twice.
+
+    Parameters:
+    - db_pool (aiomysql.Pool): The pool of connections to the MySQL database.
+    - batch_size (int): The number of records in each batch.
+    - min_statuses (int): Only users with more statuses than this are returned.
+
+    Yields:
+    - list: A batch of tuples (user_id, username, bot, url, followers, following, statuses, description).
+    """
+    last_statuses, last_user_id = None, None
+    while True:
+        async with db_pool.acquire() as conn:
+            async with conn.cursor() as cursor:
+                if last_user_id is None:
+                    await cursor.execute(KEYSET_FIRST_PAGE_QUERY, (min_statuses, batch_size))
+                else:
+                    await cursor.execute(KEYSET_NEXT_PAGE_QUERY, (min_statuses, last_statuses, last_statuses, last_user_id, batch_size))
+                batch = await cursor.fetchall()
+
+        if not batch:
+            return
+        yield batch
+
+        if len(batch) < batch_size:  # Last page
+            return
+        last_statuses, last_user_id = batch[-1][6], batch[-1][0]  # Key of the last row seen
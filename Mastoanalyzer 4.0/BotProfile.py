@@ -0,0 +1,419 @@
+# Contains the bot reference profile: the bot medians used by find_bot, stored in a one-row table and updated on ingest
+import logging
+import json
+from bisect import insort
+from statistics import median
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+# The medians of the profile, in the order returned by `FindBot.median_calculator`.
+METRICS = ('followers', 'following', 'description', 'statuses', 'interval')
+# The metrics of the bot itself, counted when the bot is first ingested; the interval is counted later,
+# when the posting statistics of the bot first have two posts (see `add_bot_intervals`).
+USER_METRICS = METRICS[:4]
+
+CREATE_PROFILE_TABLE_QUERY = """
+    CREATE TABLE IF NOT EXISTS bot_profile (
+        id TINYINT PRIMARY KEY,
+        followers_median DOUBLE,
+        following_median DOUBLE,
+        description_median DOUBLE,
+        statuses_median DOUBLE,
+        interval_median DOUBLE,
+        bots INT NOT NULL DEFAULT 0,
+        state MEDIUMTEXT,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP
+    )
+"""
+# The bots already counted in the profile; interval_added is set once their posting interval is counted too.
+CREATE_MEMBERS_TABLE_QUERY = """
+    CREATE TABLE IF NOT EXISTS bot_profile_members (
+        user_id VARCHAR(255) PRIMARY KEY,
+        interval_added BOOLEAN NOT NULL DEFAULT FALSE
+    )
+"""
+INIT_PROFILE_QUERY = "INSERT IGNORE INTO bot_profile (id, bots) VALUES (1, 0)"
+LOAD_PROFILE_QUERY = """
+    SELECT followers_median, following_median, description_median, statuses_median, interval_median, bots
+    FROM bot_profile WHERE id = 1
+"""
+# Average posting interval of every bot, as `MySQL.INTERVALS_QUERY`: read only to rebuild the profile
+BOT_INTERVALS_QUERY = """
+    SELECT s.account_id, s.gap_sum / (s.posts - 1)
+    FROM posting_stats AS s
+    JOIN users AS u ON s.account_id = u.user_id
+    WHERE u.bot = 1 AND s.posts > 1
+"""
+# Average posting interval of some accounts, for the bots just added to the profile
+STATS_INTERVALS_QUERY = "SELECT account_id, gap_sum / (posts - 1) FROM posting_stats WHERE account_id IN ({ids}) AND posts > 1"
+# The bots among some accounts whose interval is not counted yet; the second one under the lock of the profile
+PENDING_INTERVALS_QUERY = "SELECT user_id FROM bot_profile_members WHERE user_id IN ({ids}) AND NOT interval_added"
+LOCK_PENDING_INTERVALS_QUERY = PENDING_INTERVALS_QUERY + " FOR UPDATE"
+MARK_INTERVALS_QUERY = "UPDATE bot_profile_members SET interval_added = TRUE WHERE user_id IN ({ids})"
+ADD_MEMBER_QUERY = "INSERT INTO bot_profile_members (user_id, interval_added) VALUES (%s, %s)"
+LOCK_PROFILE_QUERY = "SELECT state FROM bot_profile WHERE id = 1 FOR UPDATE"
+SAVE_PROFILE_QUERY = """
+    UPDATE bot_profile
+    SET followers_median = %s, following_median = %s, description_median = %s, statuses_median = %s,
+        interval_median = %s, bots = %s, state = %s
+    WHERE id = 1
+"""
+tables_created = False  # The tables are created once for each process.
+
+class P2Quantile:
+    """
+    Streaming estimate of a quantile with the P² algorithm (Jain and Chlamtac, 1985): five markers
+    whose heights follow the quantile, in constant memory and without storing the observations.
+    With five observations or fewer the value is exact.
+    """
+
+    def __init__(self, p=0.5, state=None):
+        """
+        Parameters:
+        - p (float): The quantile to estimate, 0.5 for the median.
+        - state (dict): A state returned by `to_state`, to continue a previous estimate.
+        """
+        self.p = p
+        self.count = 0
+        self.heights = []  # Marker heights; the sorted observations while count <= 5.
+        self.positions = []  # Actual marker positions (1-based).
+        self.desired = []  # Desired marker positions.
+        self.increments = [0, p / 2, p, (1 + p) / 2, 1]
+        if state:
+            self.p = state['p']
+            self.count = state['count']
+            self.heights = state['heights']
+            self.positions = state['positions']
+            self.desired = state['desired']
+            self.increments = [0, self.p / 2, self.p, (1 + self.p) / 2, 1]
+
+    def add(self, x):
+        """
+        Adds an observation.
+        """
+        x = float(x)
+        self.count += 1
+        if self.count <= 5:
+            insort(self.heights, x)
+            if self.count == 5:
+                p = self.p
+                self.positions = [1, 2, 3, 4, 5]
+                self.desired = [1, 1 + 2 * p, 1 + 4 * p, 3 + 2 * p, 5]
+            return
+
+        q, n = self.heights, self.positions
+        # Find the cell of the observation, stretching the extreme markers if needed.
+        if x < q[0]:
+            q[0] = x
+            k = 0
+        elif x >= q[4]:
+            q[4] = x
+            k = 3
+        else:
+            k = 0
+            while x >= q[k + 1]:
+                k += 1
+        for i in range(k + 1, 5):
+            n[i] += 1
+        for i in range(5):
+            self.desired[i] += self.increments[i]
+
+        # Move the middle markers towards their desired positions.
+        for i in (1, 2, 3):
+            d = self.desired[i] - n[i]
+            if (d >= 1 and n[i + 1] - n[i] > 1) or (d <= -1 and n[i - 1] - n[i] < -1):
+                d = 1 if d > 0 else -1
+                parabolic = q[i] + d / (n[i + 1] - n[i - 1]) * (
+                    (n[i] - n[i - 1] + d) * (q[i + 1] - q[i]) / (n[i + 1] - n[i])
+                    + (n[i + 1] - n[i] - d) * (q[i] - q[i - 1]) / (n[i] - n[i - 1])
+                )
+                if q[i - 1] < parabolic < q[i + 1]:
+                    q[i] = parabolic
+                else:
+                    q[i] = q[i] + d * (q[i + d] - q[i]) / (n[i + d] - n[i])
+                n[i] += d
+
+    def value(self):
+        """
+        Returns the estimated quantile, None without observations.
+        """
+        if self.count == 0:
+            return None
+        if self.count < 5:
+            if self.p == 0.5:
+                return median(self.heights)
+            return self.heights[round(self.p * (self.count - 1))]
+        return self.heights[2]
+
+    def to_state(self):
+        return {'p': self.p, 'count': self.count, 'heights': self.heights,
+                'positions': self.positions, 'desired': self.desired}
+
+class BotProfile:
+    """
+    The streaming medians of the bots: followers, following, description length, statuses and posting interval.
+    Each bot is counted once: its own metrics when it is first ingested, its average posting interval
+    when its posting statistics first have two posts.
+    """
+
+    def __init__(self, state=None):
+        """
+        Parameters:
+        - state (str): The JSON state stored in the 'bot_profile' table, None for an empty profile.
+        """
+        states = json.loads(state) if state else {}
+        self.estimators = {metric: P2Quantile(0.5, states.get(metric)) for metric in METRICS}
+
+    def add_bot(self, user_tuple):
+        """
+        Counts a bot, given as a user tuple (user_id, username, bot, url, followers, following, statuses, description).
+        """
+        self.estimators['followers'].add(user_tuple[4])
+        self.estimators['following'].add(user_tuple[5])
+        self.estimators['description'].add(len(user_tuple[7] or ''))
+        self.estimators['statuses'].add(user_tuple[6])
+
+    def add_interval(self, seconds):
+        """
+        Counts the average posting interval of a bot, in seconds.
+        """
+        self.estimators['interval'].add(seconds)
+
+    def medians(self):
+        """
+        Returns the medians, in the order of `METRICS`.
+        """
+        return tuple(self.estimators[metric].value() for metric in METRICS)
+
+    def bots(self):
+        return self.estimators['followers'].count
+
+    def to_state(self):
+        return json.dumps({metric: estimator.to_state() for metric, estimator in self.estimators.items()})
+
+    def save_params(self):
+        """
+        Returns the parameters of `SAVE_PROFILE_QUERY`.
+        """
+        return (*self.medians(), self.bots(), self.to_state())
+
+def placeholders(values):
+    return ', '.join(['%s'] * len(values))
+
+def create_bot_profile_tables(db_connection):
+    """
+    Creates the 'bot_profile' and 'bot_profile_members' tables if they do not exist.
+    """
+    global tables_created
+    if tables_created:
+        return
+    cursor = db_connection.cursor()
+    cursor.execute(CREATE_PROFILE_TABLE_QUERY)
+    cursor.execute(CREATE_MEMBERS_TABLE_QUERY)
+    cursor.execute(INIT_PROFILE_QUERY)
+    db_connection.commit()
+    cursor.close()
+    tables_created = True
+
+async def create_bot_profile_tables_async(db_pool):
+    """
+    Asynchronous version of `create_bot_profile_tables`.
+    """
+    global tables_created
+    if tables_created:
+        return
+    async with db_pool.acquire() as conn:
+        async with conn.cursor() as cursor:
+            await cursor.execute(CREATE_PROFILE_TABLE_QUERY)
+            await cursor.execute(CREATE_MEMBERS_TABLE_QUERY)
+            await cursor.execute(INIT_PROFILE_QUERY)
+            await conn.commit()
+    tables_created = True
+
+def load_bot_profile(db_connection):
+    """
+    Reads the stored bot medians with a single-row query.
+
+    Parameters:
+    - db_connection (MySQL Connection): The connection object to interact with the MySQL database.
+
+    Returns:
+    - tuple: The medians of followers, following, description length, statuses and posting interval,
+      or None if the profile is empty or incomplete (it must be rebuilt).
+    """
+    create_bot_profile_tables(db_connection)
+    cursor = db_connection.cursor()
+    cursor.execute(LOAD_PROFILE_QUERY)
+    row = cursor.fetchone()
+    cursor.close()
+    if not row or not row[5] or None in row[:5]:
+        return None
+    return row[:5]
+
+def save_rebuilt_profile(db_connection, bots, medians):
+    """
+    Replaces the stored profile with one built from all the bots.
+    The exact medians are stored; the streaming estimators are seeded with all the values and take over
+    with the next ingested bots and the next bots reaching two posts.
+
+    Parameters:
+    - db_connection (MySQL Connection): The connection object to interact with the MySQL database.
+    - bots (list): The bot rows of `get_all_bot` (dictionaries).
+    - medians (tuple): The exact medians, in the order of `METRICS`.
+    """
+    profile = BotProfile()
+    for bot in bots:
+        profile.add_bot((bot['user_id'], bot['username'], True, bot['url'], bot['followers'], bot['following'],
+                         bot['statuses'], bot['description']))
+
+    create_bot_profile_tables(db_connection)
+    cursor = db_connection.cursor()
+    cursor.execute(LOCK_PROFILE_QUERY)
+    cursor.fetchall()
+    cursor.execute(BOT_INTERVALS_QUERY)
+    intervals = dict(cursor.fetchall())
+    for interval in intervals.values():
+        profile.add_interval(interval)
+    cursor.execute("DELETE FROM bot_profile_members")
+    members = [(bot['user_id'], bot['user_id'] in intervals) for bot in bots]
+    if members:
+        cursor.executemany(ADD_MEMBER_QUERY, members)
+    cursor.execute(SAVE_PROFILE_QUERY, (*[float(value) for value in medians], profile.bots(), profile.to_state()))
+    db_connection.commit()
+    cursor.close()
+
+def update_bot_profile(db_connection, all_users=()):
+    """
+    Updates the stored profile with the bots ingested for the first time. Called by the bulk writers.
+    The profile row is locked only when the batch has bots that are not in the profile yet, so the
+    writers of batches without new bots do not wait for each other; under the lock the members are
+    read again, so concurrent writers never count a bot twice.
+
+    Parameters:
+    - db_connection (MySQL Connection): The connection object to interact with the MySQL database.
+    - all_users (list): The user tuples just written.
+    """
+    bots = {user[0]: user for user in all_users if user[2]}
+    if not bots:
+        return
+
+    create_bot_profile_tables(db_connection)
+    cursor = db_connection.cursor()
+    try:
+        ids = list(bots)
+        cursor.execute(f"SELECT user_id FROM bot_profile_members WHERE user_id IN ({placeholders(ids)})", ids)
+        new = len({row[0] for row in cursor.fetchall()}) < len(ids)
+        db_connection.commit()  # End the snapshot of this read, so the check under the lock sees the other writers.
+        if not new:
+            return  # Nothing new: no lock.
+        cursor.execute(LOCK_PROFILE_QUERY)
+        profile = BotProfile(cursor.fetchone()[0])
+        cursor.execute(f"SELECT user_id FROM bot_profile_members WHERE user_id IN ({placeholders(ids)})", ids)
+        known = {row[0] for row in cursor.fetchall()}
+        new_bots = [bots[user_id] for user_id in ids if user_id not in known]
+        if new_bots:
+            # Bots whose posts were stored before them: their interval is counted now.
+            new_ids = [bot[0] for bot in new_bots]
+            cursor.execute(STATS_INTERVALS_QUERY.format(ids=placeholders(new_ids)), new_ids)
+            intervals = dict(cursor.fetchall())
+            for bot in new_bots:
+                profile.add_bot(bot)
+                if bot[0] in intervals:
+                    profile.add_interval(intervals[bot[0]])
+            cursor.executemany(ADD_MEMBER_QUERY, [(bot[0], bot[0] in intervals) for bot in new_bots])
+            cursor.execute(SAVE_PROFILE_QUERY, profile.save_params())
+        db_connection.commit()
+    except Exception as e:
+        db_connection.rollback()
+        logging.error(f"Bot profile not updated: {e}")
+    finally:
+        cursor.close()
+
+async def update_bot_profile_async(db_pool, all_users=()):
+    """
+    Asynchronous version of `update_bot_profile`, for the writers of `AsyncMySQL`.
+
+    Parameters:
+    - db_pool (aiomysql.Pool): The pool of connections to the MySQL database.
+    - all_users (list): The user tuples just written.
+    """
+    bots = {user[0]: user for user in all_users if user[2]}
+    if not bots:
+        return
+
+    await create_bot_profile_tables_async(db_pool)
+    async with db_pool.acquire() as conn:
+        async with conn.cursor() as cursor:
+            try:
+                ids = list(bots)
+                await cursor.execute(f"SELECT user_id FROM bot_profile_members WHERE user_id IN ({placeholders(ids)})", ids)
+                if len({row[0] for row in await cursor.fetchall()}) == len(ids):
+                    return  # Nothing new: no lock.
+                await conn.begin()  # The pool is in autocommit mode: the lock must last until the commit.
+                await cursor.execute(LOCK_PROFILE_QUERY)
+                profile = BotProfile((await cursor.fetchone())[0])
+                await cursor.execute(f"SELECT user_id FROM bot_profile_members WHERE user_id IN ({placeholders(ids)})", ids)
+                known = {row[0] for row in await cursor.fetchall()}
+                new_bots = [bots[user_id] for user_id in ids if user_id not in known]
+                if new_bots:
+                    new_ids = [bot[0] for bot in new_bots]
+                    await cursor.execute(STATS_INTERVALS_QUERY.format(ids=placeholders(new_ids)), new_ids)
+                    intervals = dict(await cursor.fetchall())
+                    for bot in new_bots:
+                        profile.add_bot(bot)
+                        if bot[0] in intervals:
+                            profile.add_interval(intervals[bot[0]])
+                    await cursor.executemany(ADD_MEMBER_QUERY, [(bot[0], bot[0] in intervals) for bot in new_bots])
+                    await cursor.execute(SAVE_PROFILE_QUERY, profile.save_params())
+                await conn.commit()
+            except Exception as e:
+                await conn.rollback()
+                logging.error(f"Bot profile not updated: {e}")
+
+def add_bot_intervals(cursor, intervals):
+    """
+    Counts in the profile the average posting interval of the bots that do not have it counted yet.
+    Called by the posting-statistics writer, in its transaction, with the accounts it just updated:
+    the profile row is locked only when one of them is a bot still without its interval, so at most
+    once for each bot, and the members are read again under the lock, so no interval is counted twice.
+
+    Parameters:
+    - cursor (MySQL Cursor): A cursor of the writer's connection, inside its transaction.
+    - intervals (dict): account_id -> average posting interval in seconds, of the accounts with two posts or more.
+    """
+    ids = sorted(intervals)
+    if not ids:
+        return
+    cursor.execute(PENDING_INTERVALS_QUERY.format(ids=placeholders(ids)), ids)
+    if not cursor.fetchall():
+        return  # No bot waiting for its interval: no lock.
+    cursor.execute(LOCK_PROFILE_QUERY)
+    profile = BotProfile(cursor.fetchone()[0])
+    cursor.execute(LOCK_PENDING_INTERVALS_QUERY.format(ids=placeholders(ids)), ids)
+    pending = [row[0] for row in cursor.fetchall()]
+    if not pending:
+        return
+    for user_id in pending:
+        profile.add_interval(intervals[user_id])
+    cursor.execute(MARK_INTERVALS_QUERY.format(ids=placeholders(pending)), pending)
+    cursor.execute(SAVE_PROFILE_QUERY, profile.save_params())
+
+async def add_bot_intervals_async(cursor, intervals):
+    """
+    Asynchronous version of `add_bot_intervals`, for the writers of `AsyncMySQL`.
+    """
+    ids = sorted(intervals)
+    if not ids:
+        return
+    await cursor.execute(PENDING_INTERVALS_QUERY.format(ids=placeholders(ids)), ids)
+    if not await cursor.fetchall():
+        return  # No bot waiting for its interval: no lock.
+    await cursor.execute(LOCK_PROFILE_QUERY)
+    profile = BotProfile((await cursor.fetchone())[0])
+    await cursor.execute(LOCK_PENDING_INTERVALS_QUERY.format(ids=placeholders(ids)), ids)
+    pending = [row[0] for row in await cursor.fetchall()]
+    if not pending:
+        return
+    for user_id in pending:
+        profile.add_interval(intervals[user_id])
+    await cursor.execute(MARK_INTERVALS_QUERY.format(ids=placeholders(pending)), pending)
+    await cursor.execute(SAVE_PROFILE_QUERY, profile.save_params())
@@ -0,0 +1,302 @@
+# Contains the columnar export of the 'users' and 'posts' tables to Parquet files, read by the analyses without MySQL
+import logging
+import os
+import json
+import shutil
+from datetime import date, datetime
+import numpy as np
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+from MySQL import USER_COLUMNS, POST_COLUMNS, stream_query, project, iter_user, in_transaction
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+STATE_FILE = 'export_state.json'
+LAYOUT = 2  # Version of the layout of the export; an export of an older layout is written again from scratch
+# Both tables are partitioned by the date of the export (not of the crawl: a post is exported on the first
+# export after it is stored) and by the bot flag: users/export_date=2026-01-31/bot=0/part-00000.parquet
+PARTITIONING = ds.partitioning(pa.schema([('export_date', pa.string()), ('bot', pa.int8())]), flavor='hive')
+USER_TYPES = {'followers': pa.int64(), 'following': pa.int64(), 'statuses': pa.int64()}
+POST_TYPES = {
+    'created_at': pa.timestamp('s'),
+    'sensitive': pa.int8(), 'favourited': pa.int8(), 'reblogged': pa.int8(),
+    'muted': pa.int8(), 'bookmarked': pa.int8(), 'pinned': pa.int8(),
+    'replies_count': pa.int64(), 'reblogs_count': pa.int64(), 'favourites_count': pa.int64(),
+}
+# The other columns are strings; 'bot' is the partition column
+USER_SCHEMA = pa.schema([(column, USER_TYPES.get(column, pa.string())) for column in USER_COLUMNS if column != 'bot'])
+POST_SCHEMA = pa.schema([(column, POST_TYPES.get(column, pa.string())) for column in POST_COLUMNS])
+
+# Posts stored after the watermark and up to the horizon, with the bot flag of their author, in insertion order.
+# The post ids do not follow the insertion order (option 2 stores the older posts of an account after
+# the newer ones of the timeline), so the watermark is `insert_seq`, read from its unique index.
+# A post whose author is not stored (e.g. removed by `del_user`) is exported with bot = 0, not skipped.
+NEW_POSTS_QUERY = """
+    SELECT {columns}, COALESCE(u.bot, 0), p.insert_seq
+    FROM posts AS p
+    LEFT JOIN users AS u ON p.account_id = u.user_id
+    WHERE p.insert_seq > %s AND p.insert_seq <= %s
+    ORDER BY p.insert_seq
+    """
+# The insert_seq values are allocated at insert time but become visible at commit, so a writer may still
+# hold a post below the highest visible one. A locking read of the new range waits for those writers:
+# its maximum is a horizon below which every post is committed (COUNT keeps MAX from reading one row only).
+HORIZON_QUERY = "SELECT COUNT(*), MAX(insert_seq) FROM posts WHERE insert_seq > %s LOCK IN SHARE MODE"
+
+def load_state(directory):
+    """
+    Returns the state of the incremental export ({'layout': ..., 'last_insert_seq': ...}), empty before the first export.
+    """
+    path = os.path.join(directory, STATE_FILE)
+    if not os.path.exists(path):
+        return {}
+    with open(path, encoding='utf-8') as state_file:
+        return json.load(state_file)
+
+def save_state(directory, state):
+    """
+    Writes the state of the incremental export; the file is replaced at once, so a crash leaves the previous state.
+    """
+    path = os.path.join(directory, STATE_FILE)
+    with open(path + '.tmp', 'w', encoding='utf-8') as state_file:
+        json.dump(state, state_file)
+    os.replace(path + '.tmp', path)
+
+def to_arrow(rows, schema):
+    """
+    Converts a batch of rows (tuples in the order of `schema`) into an Arrow table.
+    The values are normalized to the column types: the ids may come back from MySQL as integers
+    and the flags as booleans.
+    """
+    arrays = []
+    for field, values in zip(schema, zip(*rows)):
+        if pa.types.is_string(field.type):
+            values = [None if value is None else str(value) for value in values]
+        elif pa.types.is_integer(field.type):
+            values = [None if value is None else int(value) for value in values]
+        elif pa.types.is_timestamp(field.type):
+            values = [datetime.fromisoformat(value) if isinstance(value, str) else value for value in values]
+        arrays.append(pa.array(values, type=field.type))
+    return pa.Table.from_arrays(arrays, schema=schema)
+
+def reset_old_layout(directory, state):
+    """
+    Deletes an export written with an older layout (partitioned by 'crawl_date', posts selected by
+    post_id, which skipped the posts stored after newer ones), so it is written again from scratch.
+
+    Returns:
+    - dict: The state to use, empty if the export was deleted.
+    """
+    if not state or state.get('layout') == LAYOUT:
+        return state
+    logging.info(f"The export in {directory} has an older layout, exporting everything again.")
+    for table in ('users', 'posts'):
+        shutil.rmtree(os.path.join(directory, table), ignore_errors=True)
+    return {}
+
+def write_partitions(root, export_date, rows, bots, schema, name):
+    """
+    Writes a batch of rows into the partitions of its export date, one file for each bot flag.
+
+    Parameters:
+    - root (str): The folder of the table.
+    - export_date (str): The export date partition, 'YYYY-MM-DD'.
+    - rows (list): The rows, in the order of `schema`.
+    - bots (list): The bot flag of each row.
+    - schema (pa.Schema): The schema of the table.
+    - name (str): The name of the file in each partition.
+    """
+    for bot in (0, 1):
+        partition_rows = [row for row, row_bot in zip(rows, bots) if int(row_bot) == bot]
+        if not partition_rows:
+            continue
+        partition = os.path.join(root, f"export_date={export_date}", f"bot={bot}")
+        os.makedirs(partition, exist_ok=True)
+        pq.write_table(to_arrow(partition_rows, schema), os.path.join(partition, name))
+
+def export_users(db_connection, directory, export_date=None, batch_size=50000):
+    """
+    Function Purpose:
+    Writes a snapshot of the 'users' table to directory/users, in the partitions of the export date.
+    The counters of the users change at every crawl, so each export is a full snapshot; exporting
+    twice on the same day replaces the snapshot of that day.
+
+    Parameters:
+    - db_connection (MySQL Connection): The connection object to interact with the MySQL database.
+    - directory (str): The folder of the export.
+    - export_date (str): The export date partition, 'YYYY-MM-DD'; today by default.
+    - batch_size (int): The number of users read and written at a time.
+
+    Returns:
+    - int: The number of users exported.
+    """
+    export_date = export_date or date.today().isoformat()
+    root = os.path.join(directory, 'users')
+    shutil.rmtree(os.path.join(root, f"export_date={export_date}"), ignore_errors=True)
+    columns = [field.name for field in USER_SCHEMA]
+    exported = 0
+    for part, batch in enumerate(iter_user(db_connection, columns=columns + ['bot'], batch_size=batch_size)):
+        write_partitions(root, export_date, [row[:-1] for row in batch], [row[-1] for row in batch],
+                         USER_SCHEMA, f"part-{part:05d}.parquet")
+        exported += len(batch)
+    logging.info(f"Exported {exported} users to {root} (export_date={export_date})")
+    return exported
+
+def export_posts(db_connection, directory, export_date=None, batch_size=50000):
+    """
+    Function Purpose:
+    Appends to directory/posts the posts stored after the last export, i.e. with an insert_seq greater
+    than the one saved in the state file, in the partitions of the export date. The export stops at
+    the horizon of `HORIZON_QUERY`, so a post committed late by a concurrent writer is never passed.
+    The state is saved after every batch, so an interrupted export resumes from the last written file.
+    A post is exported once, as it was when first exported: the later updates of its counters are not.
+
+    Parameters:
+    - db_connection (MySQL Connection): The connection object to interact with the MySQL database.
+    - directory (str): The folder of the export.
+    - export_date (str): The export date partition, 'YYYY-MM-DD'; today by default.
+    - batch_size (int): The number of posts read and written at a time.
+
+    Returns:
+    - int: The number of posts exported.
+    """
+    export_date = export_date or date.today().isoformat()
+    root = os.path.join(directory, 'posts')
+    state = reset_old_layout(directory, load_state(directory))
+    state['layout'] = LAYOUT
+    last_seq = int(state.get('last_insert_seq', 0))
+
+    def horizon(cursor):
+        cursor.execute(HORIZON_QUERY, (last_seq,))
+        return cursor.fetchone()[1]
+    horizon_seq = in_transaction(db_connection, horizon)  # The commit releases the shared locks at once.
+    if horizon_seq is None:
+        logging.info(f"No new posts to export to {root}")
+        return 0
+
+    query = NEW_POSTS_QUERY.format(columns=project(POST_COLUMNS, [('p', POST_COLUMNS)]))
+    exported = 0
+    for batch in stream_query(db_connection, query, (last_seq, horizon_seq), batch_size):
+        first_seq, last_seq = int(batch[0][-1]), int(batch[-1][-1])
+        write_partitions(root, export_date, [row[:-2] for row in batch], [row[-2] for row in batch],
+                         POST_SCHEMA, f"part-{first_seq}-{last_seq}.parquet")
+        exported += len(batch)
+        state['last_insert_seq'] = last_seq
+        save_state(directory, state)
+    logging.info(f"Exported {exported} new posts to {root} (export_date={export_date})")
+    return exported
+
+def export_tables(db_connection, directory, batch_size=50000):
+    """
+    Exports the snapshot of the users and the new posts.
+
+    Returns:
+    - tuple: The number of users and of posts exported.
+    """
+    os.makedirs(directory, exist_ok=True)
+    save_state(directory, {**reset_old_layout(directory, load_state(directory)), 'layout': LAYOUT})
+    users = export_users(db_connection, directory, batch_size=batch_size)
+    posts = export_posts(db_connection, directory, batch_size=batch_size)
+    return users, posts
+
+def column_arrays(table, columns):
+    """
+    Converts the columns of an Arrow table into NumPy arrays. A numeric column without nulls stored
+    in a single chunk is not copied; string columns become object arrays.
+
+    Returns:
+    - dict: The NumPy array of each column.
+    """
+    arrays = {}
+    for column in columns:
+        chunked = table.column(column)
+        array = chunked.chunk(0) if chunked.num_chunks == 1 else chunked.combine_chunks()
+        arrays[column] = array.to_numpy(zero_copy_only=False)
+    return arrays
+
+def read_table(directory, table, columns, bot=None, export_date=None):
+    """
+    Reads only the given columns of an exported table, optionally of one bot flag and one export date
+    (the other partitions are not opened).
+
+    Returns:
+    - dict: The NumPy array of each column.
+    """
+    root = os.path.join(directory, table)
+    if not os.path.isdir(root):
+        raise FileNotFoundError(f"No export of '{table}' in {directory}, run export_tables first.")
+    dataset = ds.dataset(root, format='parquet', partitioning=PARTITIONING)
+    conditions = []
+    if bot is not None:
+        conditions.append(ds.field('bot') == bot)
+    if export_date is not None:
+        conditions.append(ds.field('export_date') == export_date)
+    condition = None
+    for c in conditions:
+        condition = c if condition is None else condition & c
+    return column_arrays(dataset.to_table(columns=list(columns), filter=condition), columns)
+
+def latest_export_date(directory, table='users'):
+    """
+    Returns the most recent export date of a table, None if there is none.
+    """
+    root = os.path.join(directory, table)
+    dates = sorted(name.split('=', 1)[1] for name in os.listdir(root) if name.startswith('export_date=')) if os.path.isdir(root) else []
+    return dates[-1] if dates else None
+
+def read_users(directory, columns, bot=None, export_date=None):
+    """
+    Reads columns of the users from the export, by default from the latest snapshot.
+
+    Parameters:
+    - directory (str): The folder of the export.
+    - columns (list): The columns to read, from `USER_COLUMNS` ('bot' and 'export_date' included).
+    - bot (int): If given, only the users (0) or only the bots (1).
+    - export_date (str): The snapshot to read, 'YYYY-MM-DD'; the latest by default.
+
+    Returns:
+    - dict: The NumPy array of each column.
+    """
+    return read_table(directory, 'users', columns, bot, export_date or latest_export_date(directory, 'users'))
+
+def read_posts(directory, columns, bot=None):
+    """
+    Reads columns of all the exported posts.
+
+    Parameters:
+    - directory (str): The folder of the export.
+    - columns (list): The columns to read, from `POST_COLUMNS` ('bot' and 'export_date' included).
+    - bot (int): If given, only the posts of the users (0) or of the bots (1).
+
+    Returns:
+    - dict: The NumPy array of each column.
+    """
+    return read_table(directory, 'posts', columns, bot)
+
+def posting_intervals(directory, bot=None):
+    """
+    Average posting interval in seconds of every account, computed from the exported posts.
+    The average of the gaps between consecutive posts is (last - first) / (posts - 1), so only
+    the first and last post of each account are needed; accounts with a single post are left out,
+    as in `get_utenti_pubblicazione`.
+
+    Parameters:
+    - directory (str): The folder of the export.
+    - bot (int): If given, only the accounts of the users (0) or of the bots (1).
+
+    Returns:
+    - dict: The average posting interval in seconds, keyed by username.
+    """
+    posts = read_posts(directory, ['account_username', 'created_at'], bot)
+    if len(posts['created_at']) == 0:
+        return {}
+    usernames, inverse = np.unique(posts['account_username'].astype(str), return_inverse=True)
+    seconds = posts['created_at'].astype('datetime64[s]').astype(np.int64)
+    counts = np.bincount(inverse, minlength=len(usernames))
+    first = np.full(len(usernames), np.iinfo(np.int64).max)
+    last = np.full(len(usernames), np.iinfo(np.int64).min)
+    np.minimum.at(first, inverse, seconds)
+    np.maximum.at(last, inverse, seconds)
+    several = counts > 1
+    averages = (last[several] - first[several]) / (counts[several] - 1)
+    return dict(zip(usernames[several].tolist(), averages.tolist()))
@@ -7,14 +7,156 @@ import json
 import time
 import asyncio 
 import httpx
+from concurrent.futures import ProcessPoolExecutor, BrokenExecutor
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 from credentials import access_token, instance_url, host, user, password, database
-from Ausiliario import handle_http_error, time_to_sleep, format_content, format_datetime
-from MySQL import del_user, get_data_from_table, create_post_per_user, create_bots_users_table
+from Ausiliario import handle_http_error, format_content, format_datetime, format_datetimes
+from MySQL import create_bots_users_table_bulk
+from MySQL import create_checkpoint_table, get_checkpoint, save_checkpoint, del_checkpoint
 from requests.exceptions import ChunkedEncodingError, HTTPError
+from ProxyPool import ProxyPool
+from TokenPool import TokenPool
+import AsyncMySQL
 
-def get_timeline_posts(public_timeline_url, params, headers, db_connection):
+ACCOUNT_STATUSES_URL = "https://mastodon.social/api/v1/accounts/{user_id}/statuses"
+
+def parse_user(account):
+    """
+    Converts the account of a post returned by the API into the tuple written to the 'users' table.
+    Missing fields get default values (e.g., 'N/A', False, 0).
+
+    Parameters:
+    - account (dict): The account, as returned by the Mastodon API.
+
+    Returns:
+    - tuple: (user_id, username, bot, url, followers, following, statuses, description)
+    """
+    username = account.get('username', 'N/A')
+    user_id = account.get('id', 'N/A')
+    bot = account.get('bot', False)
+    url = account.get('url', 'N/A')
+    followers = account.get('followers_count', 0)
+    following = account.get('following_count', 0)
+    statuses = account.get('statuses_count', 0)
+    description = account.get('note', 'N/A')
+    description = format_content(description)
+    return (user_id, username, bot, url, followers, following, statuses, description)
+
+def parse_post(post, created_at=None):
+    """
+    Converts a post (status) returned by the API into the tuple written to the 'posts' table.
+    The creation time is a datetime, so the writers and the posting statistics use it without parsing it again.
+
+    Parameters:
+    - post (dict): The post, as returned by the Mastodon API.
+    - created_at (datetime, optional): The creation time, already converted by `format_datetimes`.
+
+    Returns:
+    - tuple: The post data, in the order of `MySQL.POST_COLUMNS`.
+    """
+    # Extract relevant fields from the post JSON.
+    post_id = post.get('id')
+    if created_at is None:
+        created_at = format_datetime(post.get('created_at'), as_datetime=True)
+    in_reply_to_id = post.get('in_reply_to_id')
+    in_reply_to_account_id = post.get('in_reply_to_account_id')
+    sensitive = post.get('sensitive', False)
+    spoiler_text = post.get('spoiler_text', '')
+    visibility = post.get('visibility', 'public')
+    language = post.get('language', '')
+    uri = post.get('uri')
+    url = post.get('url')
+    replies_count = post.get('replies_count', 0)
+    reblogs_count = post.get('reblogs_count', 0)
+    favourites_count = post.get('favourites_count', 0)
+    favourited = post.get('favourited', False)
+    reblogged = post.get('reblogged', False)
+    muted = post.get('muted', False)
+    bookmarked = post.get('bookmarked', False)
+    pinned = post.get('pinned', False)
+    content = format_content(post.get('content', ''))
+    media_attachments = post.get('media_attachments', [])
+
+    account = post.get('account', {})
+    account_id = account.get('id')
+    account_username = account.get('username')
+    account_display_name = account.get('display_name', '')
+    account_url = account.get('url')
+
+    reblog = post.get('reblog', {})
+    if reblog:
+        reblog_id = reblog.get('id')
+        reblog_content = reblog.get('content', '')[:65535]  # Truncate content if too long.
+        reblogged_from_account = reblog.get('account', {}).get('username')
+    else:
+        reblog_id = None
+        reblog_content = None
+        reblogged_from_account = None
+
+    return (
+        post_id, created_at, in_reply_to_id, in_reply_to_account_id, sensitive, spoiler_text, visibility, language,
+        uri, url, replies_count, reblogs_count, favourites_count, favourited, reblogged, muted, bookmarked, pinned,
+        content, json.dumps(media_attachments), account_id, account_username, account_display_name, account_url,
+        reblog_id, reblog_content, reblogged_from_account
+    )
+
+def parse_page(raw_page):
+    """
+    Converts a page of posts, as received from the API, into the tuples written to the 'posts' table.
+    It is a module-level function working on the raw bytes, so it can run in a worker process.
+
+    Parameters:
+    - raw_page (bytes): The body of the response, a JSON list of posts.
+
+    Returns:
+    - list: The post tuples, in the order of `MySQL.POST_COLUMNS`.
+    """
+    posts = json.loads(raw_page)
+    created_ats = format_datetimes([post.get('created_at') for post in posts], as_datetime=True)
+    return [parse_post(post, created_at) for post, created_at in zip(posts, created_ats)]
+
+def flush_dirty_users(dirty_users, written_users, db_connection):
+    """
+    Writes to the database only the users that are new or whose data changed since the last flush.
+
+    Parameters:
+    - dirty_users (dict): Users waiting to be written, keyed by user_id. Emptied after the flush.
+    - written_users (dict): Last tuple written for each user_id, updated after the flush.
+    - db_connection: The database connection object for storing processed user data.
+
+    Returns:
+    - int: The number of rows sent to the database.
+    """
+    if not dirty_users:
+        return 0
+
+    create_bots_users_table_bulk(list(dirty_users.values()), db_connection)
+    written_users.update(dirty_users)
+    rows = len(dirty_users)
+    dirty_users.clear()
+    return rows
+
+def checkpoint_key(public_timeline_url, params):
+    """
+    Builds the key identifying a timeline crawl: the timeline URL plus its tag set.
+
+    Parameters:
+    - public_timeline_url (str): The URL of the Mastodon timeline API.
+    - params (dict): Query parameters of the crawl; the 'any', 'all' and 'none' tag filters are part of the key.
+
+    Returns:
+    - str: The checkpoint key, e.g. "https://mastodon.social/api/v1/timelines/tag/politics|any=internet,science".
+    """
+    tag_filters = []
+    for name in ('any', 'all', 'none'):
+        tags = params.get(name)
+        if tags:
+            tag_filters.append(f"{name}={','.join(sorted(tags))}")
+    return '|'.join([public_timeline_url] + tag_filters)
+
+def get_timeline_posts(public_timeline_url, params, headers, db_connection, flush_size=200, flush_interval=30, resume=True, governor=None,
+                       archive=None, replay=None, token_pool=None):
     """
     Function Purpose:
     This function retrieves posts from a public Mastodon timeline API endpoint and processes them to extract user details.
@@ -25,6 +167,18 @@ def get_timeline_posts(public_timeline_url, params, headers, db_connection):
     - params (dict): Query parameters for the API requests (e.g., filters, pagination).
     - headers (dict): HTTP headers for the requests (e.g., authentication tokens, user-agent).
     - db_connection: The database connection object for storing processed user data.
+    - flush_size (int): Number of new or changed users that triggers a write to the database.
+    - flush_interval (int): Maximum number of seconds between two writes to the database.
+    - resume (bool): If True, the crawl resumes from the last committed page of a previous run (ignored in a replay).
+    - governor (RateLimitGovernor): Paces the requests from the rate-limit headers when no `token_pool` is given;
+      a new one is created if None.
+    - archive (ResponseArchive): If given, every raw response is recorded in it.
+    - replay (ArchiveReplay): If given, the responses come from an archive instead of the server,
+      so a recorded crawl can be parsed and written again offline. A replay starts from the beginning of the
+      recording and neither reads nor writes the checkpoint, which belongs to the live crawl.
+    - token_pool (TokenPool): If given, each request is sent with the token of the timeline's instance
+      that has the most rate-limit budget left, and paced on the bucket of that token; otherwise all the
+      requests use `headers` and share one bucket.
 
     Returns:
     - list of all_users (list): A list of tuples, where each tuple contains extracted user details.
@@ -37,57 +191,76 @@ def get_timeline_posts(public_timeline_url, params, headers, db_connection):
     - Handles paginated data using `max_id` to fetch posts beyond the initial set.
     - Processes posts to extract and format user details while ensuring robust error handling for missing or malformed fields.
     - Tracks server response times and logs them for performance monitoring.
-    - Implements rate-limit handling and optional sleep mechanisms to avoid exceeding API limits.
+    - Paces the requests with the X-RateLimit-* headers of each response, so the limit is never exceeded.
+    - Writes only new or changed users (the "dirty set"), flushed by size or by time.
+    - Checkpoints the `max_id` cursor with every flush, so a crash or Ctrl-C loses at most the unflushed pages.
     - Uses a session object for efficiency when making multiple requests.
     """
     logging.info(f"Fetching posts from URL: {public_timeline_url}")
     stop = 6000
     tempo_di_risposta = []  # The list contains all response times; used to generate the time efficiency chart.
     max_id = None  # To track the captured posts.
+    key = checkpoint_key(public_timeline_url, params)
+    checkpoints = replay is None  # A replay must not move or delete the resume point of the live crawl.
+    if checkpoints:
+        create_checkpoint_table(db_connection)
+    if resume and checkpoints:
+        max_id = get_checkpoint(key, db_connection)  # Resume from the last committed page, if any.
+        if max_id:
+            logging.info(f"Resuming crawl {key} from max_id {max_id}")
+    page_cursor = max_id  # Cursor of the next page, committed together with the users of the pages before it.
+    exhausted = False  # True when the timeline has no more posts.
     all_users = set()  # To create the table of all users in the timeline.
     session = requests.Session()  # Open a single session for 300 requests.
-    contatore = 0  # Counter to track the number of requests made.
+    if token_pool is None:
+        token_pool = TokenPool([], governor)  # No tokens: one bucket for the instance, with the token of `headers`.
+    http = replay if replay is not None else session  # Where the pages come from.
+    written_users = {}  # Last tuple written to the database for each user_id.
+    dirty_users = {}  # Users new or changed since the last flush, keyed by user_id.
+    rows_written = 0  # Rows sent to the database.
+    rows_skipped = 0  # Users seen again with unchanged data, not rewritten.
+    last_flush = time.time()
+    errors = 0  # Consecutive unexpected errors; the crawl stops after `max_errors` of them.
+    max_errors = 5
     while True:
+        token = None  # Bound before the request, for the error handlers.
         try:
-            session.headers.update(headers)  # Define session headers.
             params.update({'limit': 40})  # Number of posts per request.
             if max_id:
                 params['max_id'] = max_id  # Update the ID to navigate to the next page.
 
+            token = token_pool.acquire_blocking(public_timeline_url)  # The token with the most budget left, once it has a free slot.
+            request_headers = {**headers, **token_pool.headers(token)}
             start = time.time()  # To measure the server's response time.
-            response = requests.get(public_timeline_url, params=params)  # Request to the timeline.
+            response = http.get(public_timeline_url, params=params, headers=request_headers)  # Request to the timeline.
             end = time.time()  # Measure the end time for server response.
             diff = end - start  # Calculate the response time.
             diff = round(diff, 3)
             tempo_di_risposta.append(diff)
-            contatore += 1
+            if archive is not None:
+                archive.record_requests(response)
+            token_pool.update(token, response.headers)
+            response.raise_for_status()
             # Remaining rate limit
             rate_limit_remaining = int(response.headers.get('X-RateLimit-Remaining', 0))
 
             try:
                 posts = response.json()  # List of dictionaries representing posts.
             except json.JSONDecodeError:  # To handle errors like "Expecting value: line 2 column 5 (char 5)".
-                logging.error(f"Failed to decode JSON for URL {url}.")
+                logging.error(f"Failed to decode JSON for URL {public_timeline_url}.")
                 continue
 
             if not posts:  # If the request returns an empty response.
+                exhausted = True
                 break  # End the program execution.
 
             # Process each post
             for post in posts:
                 try:
                     # Since errors like "Expecting value: line 2 column 5 (char 5)" occasionally occur,
-                    # set default values (e.g., 'N/A', False, 0) in case fields are missing.
+                    # missing fields get default values (e.g., 'N/A', False, 0).
                     # This is enclosed in try-except to handle KeyError or TypeError.
-                    username = post['account'].get('username', 'N/A')
-                    user_id = post['account'].get('id', 'N/A')
-                    bot = post['account'].get('bot', False)
-                    url = post['account'].get('url', 'N/A')
-                    followers = post['account'].get('followers_count', 0)
-                    following = post['account'].get('following_count', 0)
-                    statuses = post['account'].get('statuses_count', 0)
-                    description = post['account'].get('note', 'N/A')
-                    description = format_content(description)
+                    user_tuple = parse_user(post['account'])
 
                 except KeyError as e:
                     logging.error(f"Field missing: {e}")
@@ -96,20 +269,27 @@ def get_timeline_posts(public_timeline_url, params, headers, db_connection):
                     logging.error(f"Error for post: {e}")
                     continue
 
+                user_id, url = user_tuple[0], user_tuple[3]
                 if 'bsky.brid.gy' in url:  # An ambiguous instance returning incorrect info.
                     continue
                 else:
-                    all_users.add((user_id, username, bot, url, followers, following, statuses, description))
-
-            create_bots_users_table(all_users, db_connection)
+                    all_users.add(user_tuple)
+                    if written_users.get(user_id) == user_tuple or dirty_users.get(user_id) == user_tuple:
+                        rows_skipped += 1  # Already written (or waiting) with the same counters.
+                    else:
+                        dirty_users[user_id] = user_tuple
+            page_cursor = posts[-1]['id']
+
+            # Flush the dirty set when it is big enough or when too much time has passed.
+            if len(dirty_users) >= flush_size or time.time() - last_flush >= flush_interval:
+                rows_written += flush_dirty_users(dirty_users, written_users, db_connection)
+                if checkpoints:
+                    save_checkpoint(key, page_cursor, db_connection)  # The users of this page are committed.
+                last_flush = time.time()
 
             # A mechanism to pause the program after collecting a certain number of users.
             if len(all_users) > stop:
                 break  # End program execution.
-            if contatore % 500 == 0:
-                contatore = 0
-                logging.info(f"500 requests reached, pausing until reset time.")
-                time_to_sleep()
 
             print(tempo_di_risposta)
             logging.info(f"Length of all_users: {len(all_users)}")
@@ -119,26 +299,39 @@ def get_timeline_posts(public_timeline_url, params, headers, db_connection):
 
             # Get the ID of the last post to move to the next page.
             max_id = posts[-1]['id']
+            errors = 0
 
         except requests.exceptions.HTTPError as e:
             status_code = handle_http_error(response)
-            logging.error(f"HTTP error {e} for user: {url}")
+            logging.error(f"HTTP error {e} for URL: {public_timeline_url}")
 
             if status_code in ['429', '503']:
-                time_to_sleep()
+                token_pool.block(token, response.headers)  # Wait for the reset of this token only.
                 continue
+            break  # Other HTTP errors will not go away by retrying.
 
         except Exception as err:
             logging.error(f"Other error occurred: {err}")
             logging.error(f"Failed to retrieve the response object.")
-            time_to_sleep()  # Automate with sleep time.
+            errors += 1
+            if errors >= max_errors:
+                logging.error(f"{errors} errors in a row, stopping the crawl of {public_timeline_url}.")
+                break
+            # Not a rate limit (429 and 503 go through the token pool above): a short backoff, without extra requests.
+            time.sleep(0 if replay is not None else min(2 ** errors, 60))
             continue
 
     session.close()  # Close the session.
+    rows_written += flush_dirty_users(dirty_users, written_users, db_connection)  # Write what is left.
+    if checkpoints and exhausted:
+        del_checkpoint(key, db_connection)  # Nothing left to resume, the next run starts from the newest posts.
+    elif checkpoints and page_cursor:
+        save_checkpoint(key, page_cursor, db_connection)
     logging.info(f"Total users fetched: {len(all_users)}")  # Unique users participating in the timeline.
+    logging.info(f"User rows written: {rows_written}, skipped (unchanged): {rows_skipped}")
     return list(all_users), tempo_di_risposta
 
-async def fetch_posts_async(url, statuses, db_connection, max_retries, proxy_list, client, current_proxy_index):
+async def fetch_posts_async(url, statuses, db_pool, max_retries, proxy_pool, since_id=None, executor=None, token_pool=None):
     """
     Function Purpose:
     This function retrieves posts from a specified Mastodon API endpoint for a given user.
@@ -147,127 +340,120 @@ async def fetch_posts_async(url, statuses, db_connection, max_retries, proxy_lis
     Parameters:
     - url (str): The API endpoint to fetch posts for a specific user.
     - statuses (int): Total number of statuses (posts) available for the user.
-    - db_connection: The database connection used to update or remove user data.
+    - db_pool (aiomysql.Pool): The pool of database connections used to remove user data.
     - max_retries (int): Maximum number of retries allowed for a request in case of failures.
-    - proxy_list (list): List of proxy servers to use for making requests.
-    - client (httpx.AsyncClient): The asynchronous HTTP client used for requests.
-    - current_proxy_index (int): Index of the currently used proxy in the proxy list.
+    - proxy_pool (ProxyPool): The pool of proxies; each request goes through the healthiest available one.
+    - since_id (str): ID of the newest post already stored for the user. If given, only newer posts
+      are requested (incremental mode); a user with nothing new costs a single request.
+    - executor (ProcessPoolExecutor): If given, each page is decoded and parsed in a worker process, so the event loop
+      keeps serving the other users meanwhile; if None, the posts are parsed here.
+    - token_pool (TokenPool): If given, the requests are authenticated with the token of the instance that has
+      the most rate-limit budget left, and paced on the buckets of the tokens instead of the ones of the proxies
+      (Mastodon limits authenticated requests per token, whatever the IP). If None, or without tokens for the
+      instance, the requests are anonymous and each proxy has its own bucket.
 
     Returns:
     - tupla_post (list of tuples): A list of tuples containing the extracted and formatted post data.
     - total_requests (int): Total number of requests made for fetching posts.
-    - current_proxy_index (int): Updated index of the proxy used after function execution.
     """
 
-    all_posts = []  # Container for all posts fetched for the user.
+    tupla_post = []  # Container for all posts fetched for the user, ready for the database.
+    loop = asyncio.get_running_loop()
     statuses_per_request = 40  # Number of posts fetched per request.
     params = {"limit": statuses_per_request}  # Parameters for the API request.
     n_richieste = 5  # Maximum number of requests per user.
     attempt = 0  # Counter for connection attempts.
     # Calculate the number of requests required based on available posts.
     total_requests = min((statuses // statuses_per_request) + (statuses % statuses_per_request > 0), n_richieste)
+    if since_id:
+        # Incremental mode: page forward from the newest stored post, stopping at the first short page.
+        params['min_id'] = since_id
+        total_requests = n_richieste
+    richieste_fatte = 0  # Requests actually made.
+    finito = False  # True when there are no more new posts to request.
 
-    proxy = proxy_list[current_proxy_index]
-    logging.info(f"Using proxy: {proxy}")
     for _ in range(total_requests):  # Loop to perform the required number of requests.
+        if finito:
+            break
         while attempt < max_retries:  # Retry in case of timeout or connection errors.
+            # Pick the token with the most budget left (if any), then the healthiest proxy; its client really routes through it.
+            token = await token_pool.acquire(url) if token_pool is not None else None
+            authenticated = token is not None and token_pool.token(token) is not None
+            proxy, client = await proxy_pool.acquire()
             try:
-                # Set the proxy for the client and make the request.
-                proxy = proxy_list[current_proxy_index]
-                client.proxies = {"http": proxy, "https": proxy}
-                response = await client.get(url, params=params, timeout=15)
+                start = time.time()
+                response = await client.get(url, params=params, headers=token_pool.headers(token) if authenticated else None, timeout=15)
+                latency = time.time() - start
+                if authenticated:
+                    token_pool.update(token, response.headers)  # The rate limit in the headers is the token's, not the proxy's.
+                rate_limit_headers = None if authenticated else response.headers
                 response.raise_for_status()  # Check for HTTP status (e.g., 200 OK).
-                posts = response.json()  # Extract posts from the response.
-
-                if not posts:  # If no posts are found for the user.
-                    del_user(url, db_connection)  # Remove user from the database.
-                    return [], 0, current_proxy_index  # Stop processing for this user.
-
-                all_posts.extend(posts)  # Append the fetched posts to the list.
-                params['max_id'] = int(posts[-1]['id']) - 1  # Update parameter for next request.
+                page = None
+                if executor is not None:
+                    try:  # The page is decoded in the worker too: the event loop only ships the raw bytes.
+                        page = await loop.run_in_executor(executor, parse_page, response.content)
+                    except BrokenExecutor as e:  # E.g. a worker process died: parse the page here.
+                        logging.error(f"Parse stage failed for {url}: {e}")
+                if page is None:
+                    page = parse_page(response.content)
+                proxy_pool.report_success(proxy, latency, rate_limit_headers)
+                richieste_fatte += 1
+
+                if since_id:
+                    tupla_post.extend(page)  # Posts newer than since_id, possibly none.
+                    if len(page) < statuses_per_request:
+                        finito = True  # Short page: the user has no more new posts.
+                    else:
+                        params['min_id'] = page[0][0]  # The newest post of the page.
+                    break  # Exit retry loop if successful.
+
+                if not page:  # If no posts are found for the user.
+                    await AsyncMySQL.del_user(url, db_pool)  # Remove user from the database.
+                    return [], 0  # Stop processing for this user.
+
+                tupla_post.extend(page)  # Append the fetched posts to the list.
+                params['max_id'] = int(page[-1][0]) - 1  # Update parameter for next request.
                 break  # Exit retry loop if successful.
 
             except httpx.HTTPStatusError as e:  # Handle HTTP errors (e.g., 429, 503).
                 status_code = handle_http_error(response)
+                if status_code == '429' and authenticated:  # The token is exhausted, the proxy is fine.
+                    token_pool.block(token, response.headers)
+                    proxy_pool.report_success(proxy, latency)
+                    logging.info(f"{token} - Error HTTP {e}. Retrying with another token.")
+                    continue  # Retry with a different token.
                 if status_code == '429':  # If rate limit is exceeded.
-                    current_proxy_index = (current_proxy_index + 1) % len(proxy_list)
-                    logging.info(f"{proxy} - Error HTTP {e}. Changed proxy to {proxy_list[current_proxy_index]}")
+                    proxy_pool.report_failure(proxy, 429, response.headers)
+                    logging.info(f"{proxy} - Error HTTP {e}. Retrying with another proxy.")
                     continue  # Retry with a different proxy.
 
-                del_user(url, db_connection)  # Remove user if fetching fails.
+                proxy_pool.report_success(proxy, latency, rate_limit_headers)  # The proxy worked, the user did not.
+                await AsyncMySQL.del_user(url, db_pool)  # Remove user if fetching fails.
                 break  # Exit retry loop.
 
             except (httpx.ProxyError, httpx.NetworkError) as e:  # Handle proxy or network errors.
-                current_proxy_index = (current_proxy_index + 1) % len(proxy_list)
-                logging.error(f"{proxy} - Network/Proxy error: {e}. Changed proxy to {proxy_list[current_proxy_index]}")
+                proxy_pool.report_failure(proxy)
+                attempt += 1
+                logging.error(f"{proxy} - Network/Proxy error: {e}. Retrying with another proxy.")
                 continue  # Retry with a different proxy.
 
             except httpx.TimeoutException as e:  # Handle timeout errors.
+                proxy_pool.report_failure(proxy)
                 logging.warning(f"{proxy} - Timeout at attempt {attempt + 1} for {url}: {e}")
                 attempt += 1
-                if attempt < max_retries:
-                    continue  # Retry the same request.
-                else:
-                    current_proxy_index = (current_proxy_index + 1) % len(proxy_list)
-                    logging.error(f"Connection failed for {url} after {max_retries} attempts. Changed proxy.")
-                    continue
+                if attempt >= max_retries:
+                    logging.error(f"Connection failed for {url} after {max_retries} attempts.")
+                continue
 
             except Exception as e:  # Handle any other unexpected errors.
                 logging.error(f"{proxy} - Unknown error for {url}: {e}")
-                return [], 0, current_proxy_index
-
-    # Format and structure the retrieved data for database insertion.
-    tupla_post = []
-    for post in all_posts:
-        # Extract relevant fields from the post JSON.
-        post_id = post.get('id')
-        created_at = format_datetime(post.get('created_at'))
-        in_reply_to_id = post.get('in_reply_to_id')
-        in_reply_to_account_id = post.get('in_reply_to_account_id')
-        sensitive = post.get('sensitive', False)
-        spoiler_text = post.get('spoiler_text', '')
-        visibility = post.get('visibility', 'public')
-        language = post.get('language', '')
-        uri = post.get('uri')
-        url = post.get('url')
-        replies_count = post.get('replies_count', 0)
-        reblogs_count = post.get('reblogs_count', 0)
-        favourites_count = post.get('favourites_count', 0)
-        favourited = post.get('favourited', False)
-        reblogged = post.get('reblogged', False)
-        muted = post.get('muted', False)
-        bookmarked = post.get('bookmarked', False)
-        pinned = post.get('pinned', False)
-        content = format_content(post.get('content', ''))
-        media_attachments = post.get('media_attachments', [])
-
-        account = post.get('account', {})
-        account_id = account.get('id')
-        account_username = account.get('username')
-        account_display_name = account.get('display_name', '')
-        account_url = account.get('url')
-
-        reblog = post.get('reblog', {})
-        if reblog:
-            reblog_id = reblog.get('id')
-            reblog_content = reblog.get('content', '')[:65535]  # Truncate content if too long.
-            reblogged_from_account = reblog.get('account', {}).get('username')
-        else:
-            reblog_id = None
-            reblog_content = None
-            reblogged_from_account = None
+                return [], 0
 
-        # Append extracted data to the result list.
-        tupla_post.append((
-            post_id, created_at, in_reply_to_id, in_reply_to_account_id, sensitive, spoiler_text, visibility, language,
-            uri, url, replies_count, reblogs_count, favourites_count, favourited, reblogged, muted, bookmarked, pinned,
-            content, json.dumps(media_attachments), account_id, account_username, account_display_name, account_url,
-            reblog_id, reblog_content, reblogged_from_account
-        ))
+    if since_id:
+        total_requests = richieste_fatte
+    return tupla_post, total_requests  # Return structured data and the number of requests.
 
-    return tupla_post, total_requests, current_proxy_index  # Return structured data and updated proxy index.
-
-async def async_debug(users, db_connection, proxy_list):
+async def async_debug(users, db_pool, proxy_list, statuses_url=ACCOUNT_STATUSES_URL, token_pool=None):
     """
     Function Purpose:
     This function serves as an asynchronous task to query user information concurrently. 
@@ -275,8 +461,10 @@ async def async_debug(users, db_connection, proxy_list):
     
     Parameters:
     - users: List of user records containing user data (ID, username, etc.).
-    - db_connection: Database connection for storing user post data.
+    - db_pool (aiomysql.Pool): Pool of database connections for storing user post data.
     - proxy_list: List of proxies for balancing requests and avoiding rate limits.
+    - statuses_url (str): The URL of the statuses of an account, with a {user_id} placeholder.
+    - token_pool (TokenPool): The access tokens of the requests, None for anonymous requests.
 
     Returns:
     - tempo_di_risposta: A list of response times for each request.
@@ -287,13 +475,7 @@ async def async_debug(users, db_connection, proxy_list):
         - Calls `fetch_posts` to retrieve posts and `create_post_per_user` to insert the data into the database.
     """
 
-    clients = []
-    for proxy in proxy_list:
-        # Create an asynchronous HTTP client for each proxy.
-        client = httpx.AsyncClient(proxies={"http://": proxy, "https://": proxy})
-        clients.append(client)
-
-    current_proxy_index = 0  # Start with the first proxy in the list.
+    proxy_pool = ProxyPool(proxy_list)  # One client for each proxy, with health tracking.
     i = 0  # Counter for the total number of requests made so far.
     u = 0  # Counter for the total number of users queried so far.
     max_retries = 3  # Number of retries allowed in case of an error.
@@ -301,28 +483,311 @@ async def async_debug(users, db_connection, proxy_list):
 
     logging.info("Querying users...")
     for user in users:
-        client = clients[current_proxy_index]
         # Decompose the user record into individual fields.
         user_id, username, is_bot, url, followers, following, statuses, description = user
         # Construct the URL to fetch posts for the user.
-        url = f"https://mastodon.social/api/v1/accounts/{user_id}/statuses"
+        url = statuses_url.format(user_id=user_id)
 
         start = time.time()  # Start measuring the time for data retrieval.
         # Perform an asynchronous request to fetch posts for the user.
-        users_posts, total_requests, number_proxy = await fetch_posts_async(
-            url, statuses, db_connection, max_retries, proxy_list, client, current_proxy_index
+        users_posts, total_requests = await fetch_posts_async(
+            url, statuses, db_pool, max_retries, proxy_pool, token_pool=token_pool
         )
-        current_proxy_index = number_proxy  # Update the current proxy index.
         end = time.time()  # End time measurement.
         diff = round(end - start, 3)  # Calculate the response time.
         tempo_di_risposta.append(diff)  # Add the response time to the list.
         # logging.info(f"Response time for {url}: {diff} seconds")
 
         # Add the fetched posts to the database table.
-        create_post_per_user(db_connection, users_posts)
+        await AsyncMySQL.create_post_per_user_bulk(db_pool, users_posts)
 
         i += total_requests  # Increment the total requests counter.
         u += 1  # Increment the total users queried counter.
-        logging.info(f"{proxy_list[current_proxy_index]} - Users queried so far: {u}, request time: {diff}")
+        logging.info(f"Users queried so far: {u}, request time: {diff}")
 
+    await proxy_pool.aclose()
+    logging.info(f"Proxy health: {proxy_pool.summary()}")
     return tempo_di_risposta  # Return the list of response times.
+
+
+async def fetch_user_worker(queue, db_pool, proxy_pool, max_retries, tempo_di_risposta, incremental=False, executor=None,
+                            statuses_url=ACCOUNT_STATUSES_URL, token_pool=None):
+    """
+    Function Purpose:
+    A single worker of the pool: takes users from the shared queue until it receives None,
+    fetches their posts through the proxy pool and stores them in the database.
+    An error on a user is logged and the worker goes on with the next one, so the queue never stops draining.
+
+    Parameters:
+    - queue (asyncio.Queue): Shared queue of user records, None marks the end of the work.
+    - db_pool (aiomysql.Pool): Pool of database connections for storing user post data.
+    - proxy_pool (ProxyPool): Pool of proxies shared by all the workers.
+    - max_retries (int): Maximum number of retries allowed for a request in case of failures.
+    - tempo_di_risposta (list): Shared list where the response time of each user is appended.
+    - incremental (bool): If True, only the posts newer than the newest stored one are requested.
+    - executor (ProcessPoolExecutor): The process pool parsing the pages, shared by all the workers.
+    - statuses_url (str): The URL of the statuses of an account, with a {user_id} placeholder.
+    - token_pool (TokenPool): The access tokens shared by all the workers, None for anonymous requests.
+
+    Returns:
+    - int: The number of users queried by this worker.
+    """
+    u = 0  # Counter for the users queried by this worker.
+    while True:
+        user = await queue.get()
+        if user is None:  # No more users to query.
+            queue.task_done()
+            return u
+
+        start = time.time()
+        try:
+            user_id, username, is_bot, url, followers, following, statuses, description = user
+            url = statuses_url.format(user_id=user_id)
+            since_id = await AsyncMySQL.get_latest_post_id(user_id, db_pool) if incremental else None
+            users_posts, total_requests = await fetch_posts_async(
+                url, statuses, db_pool, max_retries, proxy_pool, since_id, executor, token_pool
+            )
+            await AsyncMySQL.create_post_per_user_bulk(db_pool, users_posts)
+        except Exception:
+            logging.exception(f"Error while querying user {user[:2]}, skipping it.")
+            continue
+        finally:
+            queue.task_done()
+        diff = round(time.time() - start, 3)
+        tempo_di_risposta.append(diff)
+        u += 1
+        logging.info(f"User {username} queried with {total_requests} requests, request time: {diff}")
+
+async def async_worker_pool(users, db_pool, proxy_list, concurrency=10, incremental=False, parse_workers=None, archive=None, replay=None,
+                            statuses_url=ACCOUNT_STATUSES_URL, token_pool=None):
+    """
+    Function Purpose:
+    Queries the posts of many users with a bounded number of users in flight at the same time.
+    A producer fills a shared asyncio queue with the users, and `concurrency` workers consume it,
+    each request going through the healthiest proxy of the shared pool.
+
+    Parameters:
+    - users (iterable or async iterable): User records (user_id, username, bot, url, followers, following, statuses, description),
+      for example the rows returned by `get_data_from_table`.
+    - db_pool (aiomysql.Pool): Pool of database connections for storing user post data.
+    - proxy_list (list): List of proxies shared by all the workers.
+    - concurrency (int): Maximum number of users queried at the same time.
+    - incremental (bool): If True, only the posts newer than the newest stored one are requested for each user.
+    - parse_workers (int): Number of processes decoding and parsing the pages (json, format_content...) while the
+      workers keep fetching; None uses one per CPU, 0 parses on the event loop.
+    - archive (ResponseArchive): If given, every raw response is recorded in it.
+    - replay (ArchiveReplay): If given, the responses come from an archive instead of the server.
+    - statuses_url (str): The URL of the statuses of an account, with a {user_id} placeholder
+      (e.g. the one of `fake_mastodon.py` for the benchmarks).
+    - token_pool (TokenPool): If given, the requests are authenticated and spread over its tokens,
+      see `fetch_posts_async`.
+
+    Returns:
+    - tempo_di_risposta: A list of response times, one for each user.
+    """
+    proxy_pool = ProxyPool(proxy_list, archive=archive, replay=replay)  # One client for each proxy, with health tracking.
+    executor = ProcessPoolExecutor(max_workers=parse_workers) if parse_workers != 0 else None
+    queue = asyncio.Queue(maxsize=concurrency * 2)  # Bounded, so the producer never runs too far ahead.
+    max_retries = 3  # Number of retries allowed in case of an error.
+    tempo_di_risposta = []  # List to store all response times.
+
+    async def producer():
+        if hasattr(users, '__aiter__'):
+            async for user in users:
+                await queue.put(user)
+        else:
+            for user in users:
+                await queue.put(user)
+        for _ in range(concurrency):
+            await queue.put(None)  # One stop signal for each worker.
+
+    logging.info(f"Querying users with {concurrency} workers...")
+    workers = [
+        asyncio.create_task(fetch_user_worker(queue, db_pool, proxy_pool, max_retries, tempo_di_risposta, incremental, executor,
+                                            statuses_url, token_pool))
+        for _ in range(concurrency)
+    ]
+    producer_task = asyncio.create_task(producer())
+    try:
+        # If the producer fails, the workers would wait for users forever: the error stops them all.
+        queried = (await asyncio.gather(producer_task, *workers))[1:]
+    finally:
+        for task in [producer_task, *workers]:
+            task.cancel()  # No effect on the tasks that are done.
+        await asyncio.gather(producer_task, *workers, return_exceptions=True)
+        await proxy_pool.aclose()
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)  # Every parse was awaited: nothing to wait for here.
+
+    logging.info(f"Users queried by the pool: {sum(queried)}")
+    for health in proxy_pool.summary():
+        logging.info(f"Proxy {health['proxy']}: {health['requests']} requests, success rate {health['success_rate']}, "
+                     f"p50 {health['p50']} s, p95 {health['p95']} s, {health['rate_limited']} x 429")
+    if token_pool is not None:
+        for health in token_pool.summary():
+            logging.info(f"Token {health['token']}: {health['requests']} requests, {health['remaining']} left in the window")
+    return tempo_di_risposta
+
+async def crawl_tag(tag_group, client, headers, token_pool, shared, max_requests, min_yield, window, max_retries=5):
+    """
+    Function Purpose:
+    Paginates the timeline of one tag group with its own `max_id` cursor and stop condition.
+    The users are deduplicated in memory against the ones seen by all the other tag groups.
+
+    Parameters:
+    - tag_group (str or list): A tag, or a list of tags whose first one is the timeline and
+      the others are added with 'any'.
+    - client (httpx.AsyncClient): The HTTP client shared by the tag groups.
+    - headers (dict): HTTP headers for the requests (authentication token).
+    - token_pool (TokenPool): Picks the token of each request and paces the requests; all the tag groups share its buckets.
+    - shared (dict): State shared by the tag groups: 'seen' (user_id -> user tuple), 'dirty' (users to write)
+      and 'stop' (set when enough users were collected).
+    - max_requests (int): Maximum number of requests for this tag group.
+    - min_yield (float): The tag group stops when its new users per request, over the last `window`
+      requests, fall below this value.
+    - window (int): Number of requests the yield is measured on.
+    - max_retries (int): Consecutive retries, with exponential backoff, of a request that timed out or got a 5xx,
+      before the tag group is stopped by the error.
+
+    Returns:
+    - dict: The stats of the tag group: requests, posts, new users and yield (new users per request).
+    """
+    tags = [tag_group] if isinstance(tag_group, str) else list(tag_group)
+    name = '+'.join(tags)
+    url = f"{instance_url}/api/v1/timelines/tag/{tags[0]}"
+    params = {'limit': 40}
+    if len(tags) > 1:
+        params['any[]'] = tags[1:]
+    stats = {'tag': name, 'requests': 0, 'posts': 0, 'new_users': 0, 'stopped_by': 'max_requests'}
+    recent_new_users = []  # New users of the last `window` requests.
+    failures = 0  # Consecutive transient failures of the current request.
+
+    while stats['requests'] < max_requests:
+        if shared['stop']:
+            stats['stopped_by'] = 'enough users'
+            break
+        token = await token_pool.acquire(url)
+        try:
+            response = await client.get(url, params=params, headers={**headers, **token_pool.headers(token)}, timeout=15)
+            token_pool.update(token, response.headers)
+            if response.status_code == 429:
+                token_pool.block(token, response.headers)
+                continue
+            response.raise_for_status()
+            posts = response.json()
+        except (httpx.HTTPError, json.JSONDecodeError) as e:
+            transient = isinstance(e, (httpx.TimeoutException, httpx.NetworkError)) or (
+                isinstance(e, httpx.HTTPStatusError) and e.response.status_code >= 500
+            )
+            if transient and failures < max_retries:
+                failures += 1
+                delay = 2 ** failures
+                logging.warning(f"#{name} - request failed: {e}. Retry {failures}/{max_retries} in {delay} s.")
+                await asyncio.sleep(delay)
+                continue
+            logging.error(f"#{name} - request failed: {e}")
+            stats['stopped_by'] = 'error'
+            break
+        failures = 0
+        stats['requests'] += 1
+
+        if not posts:
+            stats['stopped_by'] = 'end of timeline'
+            break
+        stats['posts'] += len(posts)
+
+        new_users = 0
+        for post in posts:
+            account = post.get('account')
+            if not account or 'bsky.brid.gy' in account.get('url', ''):  # An ambiguous instance returning incorrect info.
+                continue
+            user_tuple = parse_user(account)
+            user_id = user_tuple[0]
+            if user_id not in shared['seen']:
+                new_users += 1
+            if shared['seen'].get(user_id) != user_tuple:
+                shared['seen'][user_id] = user_tuple
+                shared['dirty'][user_id] = user_tuple
+        stats['new_users'] += new_users
+
+        recent_new_users.append(new_users)
+        recent_new_users = recent_new_users[-window:]
+        if len(recent_new_users) == window and sum(recent_new_users) / window < min_yield:
+            stats['stopped_by'] = 'low yield'
+            break
+
+        params['max_id'] = posts[-1]['id']  # Cursor of this tag group only.
+
+    stats['yield'] = round(stats['new_users'] / stats['requests'], 2) if stats['requests'] else 0
+    return stats
+
+async def crawl_tags(tag_groups, headers, db_pool, stop=6000, max_requests=300, min_yield=1, window=5, flush_size=200, flush_interval=30,
+                     token_pool=None, max_retries=5):
+    """
+    Function Purpose:
+    Crawls the timelines of several tags (or tag groups) concurrently, each one with its own cursor
+    and stop condition, and writes the users deduplicated across all the tags.
+    The per-tag yield (new users per request) is logged, so low-yield tags can be dropped.
+
+    Parameters:
+    - tag_groups (list): Tags or tag groups, e.g. ['politics', ['science', 'technology']].
+    - headers (dict): HTTP headers for the requests (authentication token).
+    - db_pool (aiomysql.Pool): The pool of connections to the MySQL database.
+    - stop (int): The crawl stops when this many unique users were collected.
+    - max_requests (int): Maximum number of requests for each tag group.
+    - min_yield (float): Minimum new users per request before a tag group is dropped.
+    - window (int): Number of requests the yield is measured on.
+    - flush_size (int): Number of new or changed users that triggers a write to the database.
+    - flush_interval (int): Maximum number of seconds between two writes to the database.
+    - token_pool (TokenPool): If given, the requests are spread over its tokens; otherwise all of them use `headers`
+      and share one bucket.
+    - max_retries (int): Retries of a request that timed out or got a 5xx, see `crawl_tag`.
+
+    Returns:
+    - list of all_users (list): The unique users collected, as (user_id, username, bot, url, followers, following, statuses, description).
+    - stats (list): The stats of each tag group, see `crawl_tag`.
+    """
+    shared = {'seen': {}, 'dirty': {}, 'stop': False}
+    if token_pool is None:
+        token_pool = TokenPool([])  # No tokens: one bucket for the instance, with the token of `headers`.
+
+    async def flush():
+        users = list(shared['dirty'].values())
+        shared['dirty'] = {}
+        await AsyncMySQL.create_bots_users_table_bulk(users, db_pool)
+
+    async def flusher():
+        # Writes the dirty users by size or by time, and raises the stop flag.
+        last_flush = time.time()
+        while True:
+            await asyncio.sleep(1)
+            if len(shared['seen']) >= stop:
+                shared['stop'] = True
+            if len(shared['dirty']) >= flush_size or time.time() - last_flush >= flush_interval:
+                try:
+                    await flush()
+                except Exception:
+                    logging.exception("Users flush failed, stopping the crawl.")
+                    shared['stop'] = True  # The tag groups stop at their next request.
+                    raise
+                last_flush = time.time()
+
+    async with httpx.AsyncClient() as client:
+        flusher_task = asyncio.create_task(flusher())
+        try:
+            stats = await asyncio.gather(*[
+                crawl_tag(tag_group, client, headers, token_pool, shared, max_requests, min_yield, window, max_retries)
+                for tag_group in tag_groups
+            ])
+        finally:
+            flusher_task.cancel()
+            await asyncio.gather(flusher_task, return_exceptions=True)
+            await flush()  # Write what is left.
+    if not flusher_task.cancelled() and flusher_task.exception() is not None:
+        raise flusher_task.exception()
+
+    for tag_stats in sorted(stats, key=lambda x: x['yield'], reverse=True):
+        logging.info(f"#{tag_stats['tag']}: {tag_stats['requests']} requests, {tag_stats['new_users']} new users, "
+                     f"yield {tag_stats['yield']} users/request, stopped by {tag_stats['stopped_by']}")
+    logging.info(f"Total users fetched: {len(shared['seen'])}")
+    return list(shared['seen'].values()), stats
@@ -1,4 +1,6 @@
-from MySQL import get_all_bot, get_user_no_bot, get_bot_pubblicazione, get_pubblicazione, post_per_user
+from MySQL import get_all_bot, get_user_no_bot, get_bot_pubblicazione, get_pubblicazione, get_utenti_pubblicazione, post_per_user
+from BotProfile import load_bot_profile, save_rebuilt_profile
+from Export import read_users, posting_intervals
 import mysql.connector
 import logging
 import numpy as np
@@ -7,17 +9,33 @@ import time
 import re
 from datetime import datetime
 
-def median_calculator(db_connection):
+# Rules shared by the per-user checks and by the vectorized scoring
+TOLLERANZA = 10  # tolerance around the bot medians, in percent
+TOLLERANZA_ERS = 20  # tolerance around the bot median of followers, in percent
+OUTLIER_STATUSES = 80000  # threshold based on calculated graphs
+LINK_PATTERN = r"(https?://[^\s]+|www\.[^\s]+)"  # a link in the description, https... or www...
+
+def median_calculator(db_connection, rebuild=False):
     """
     Calculates the median values for various user metrics such as followers, following, 
     description length, statuses, and average publication intervals for bots in the database.
     
+    The medians are read from the single row of the 'bot_profile' table, kept up to date by the writers
+    as bots are ingested and as their posting statistics reach two posts. They are computed from all
+    the bots (and stored) only when the profile is empty or when `rebuild` is True.
+    
     Parameters:
     - db_connection (MySQL Connection): The connection object to interact with the MySQL database.
+    - rebuild (bool): If True, the medians are computed again from all the bots and their posts.
     
     Returns:
     - tuple: The median values for followers, following, description length, statuses, and average posting interval.
     """
+    if not rebuild:
+        medians = load_bot_profile(db_connection)
+        if medians is not None:
+            return medians
+
     bots = get_all_bot(db_connection)
     followers = []
     following = []
@@ -35,6 +53,9 @@ def median_calculator(db_connection):
         timePubBot.append(x['intervallo_medio_secondi'])
 
     ers_median, ing_median, desc_median, statuses_median, fr_median = median(followers), median(following), median(description), median(statuses), median(timePubBot)
+
+    # Store the profile, so the next calls read it with a single query.
+    save_rebuilt_profile(db_connection, bots, (ers_median, ing_median, desc_median, statuses_median, fr_median))
     return ers_median, ing_median, desc_median, statuses_median, fr_median
 
 def check_ersing(followers, following, ers_median, ing_median):
@@ -51,8 +72,8 @@ def check_ersing(followers, following, ers_median, ing_median):
     Returns:
     - bool: True if the user's metrics are within the tolerance range of bot medians, False otherwise.
     """
-    tolleranza = 10 
-    tolleranzaErs = 20
+    tolleranza = TOLLERANZA
+    tolleranzaErs = TOLLERANZA_ERS
     # tolerance limits, around 10%
     ers_lower_bound = ers_median * (1 - tolleranzaErs / 100)
     ers_upper_bound = ers_median * (1 + tolleranzaErs / 100)
@@ -75,13 +96,12 @@ def check_descriptionLength(description, desc_median):
     Returns:
     - bool: True if the description length is within tolerance or if it contains a link, False otherwise.
     """
-    tolleranza = 10 
+    tolleranza = TOLLERANZA
     # tolerance limits, around 10%
     lower_bound = desc_median * (1 - tolleranza / 100)
     upper_bound = desc_median * (1 + tolleranza / 100)
     # checks if the description contains a link
-    link_pattern = r"(https?://[^\s]+|www\.[^\s]+)"  # checks if there is https... or www...
-    bool = re.search(link_pattern, description) is not None
+    bool = re.search(LINK_PATTERN, description) is not None  # checks if there is https... or www...
 
     if lower_bound <= len(description) <= upper_bound or bool is True:
         return True
@@ -100,7 +120,7 @@ def check_statuses(statuses, statuses_median):
     Returns:
     - bool: True if the number of statuses is within tolerance, False otherwise.
     """
-    tolleranza = 10 
+    tolleranza = TOLLERANZA
     # tolerance limits, around 10%
     lower_bound = statuses_median * (1 - tolleranza / 100)
     upper_bound = statuses_median * (1 + tolleranza / 100)
@@ -119,13 +139,25 @@ def check_outlier(statuses):
     Returns:
     - bool: True if the number of statuses is considered an outlier, False otherwise.
     """
-    x = 80000  # threshold based on calculated graphs
+    x = OUTLIER_STATUSES  # threshold based on calculated graphs
     if statuses > x:
         return True
     else:
         return False
 
-def check_intervalPosting(user, fr_median, db_connection):
+def load_intervals(db_connection):
+    """
+    Loads the average posting interval of every non-bot user with a single grouped query.
+    
+    Parameters:
+    - db_connection (MySQL Connection): The connection object to interact with the MySQL database.
+    
+    Returns:
+    - dict: The average posting interval in seconds, keyed by username.
+    """
+    return {x['account_username']: x['intervallo_medio_secondi'] for x in get_utenti_pubblicazione(db_connection)}
+
+def check_intervalPosting(user, fr_median, db_connection, intervals=None):
     """
     Checks if the posting interval for a user is within acceptable tolerance limits 
     compared to the median posting interval of bots.
@@ -134,12 +166,17 @@ def check_intervalPosting(user, fr_median, db_connection):
     - user (str): The username of the user.
     - fr_median (float): The median posting interval for bots.
     - db_connection (MySQL Connection): The connection object to interact with the MySQL database.
+    - intervals (dict): The posting intervals loaded by `load_intervals`. If given, the check is a
+      dictionary lookup; otherwise the user's interval is queried from the database.
     
     Returns:
     - bool: True if the user's posting interval is within tolerance, False otherwise.
     """
     timePubUser = []
-    timePubUserQuery = get_pubblicazione(user, db_connection)  # fetches the user's posting interval from the database
+    if intervals is not None:
+        timePubUserQuery = [{'intervallo_medio_secondi': intervals[user]}] if user in intervals else []
+    else:
+        timePubUserQuery = get_pubblicazione(user, db_connection)  # fetches the user's posting interval from the database
     if len(timePubUserQuery) == 0:  # in case no posts are in the table
         timePubUser.append(0)  # as median needs a non-empty list
     else:
@@ -147,7 +184,7 @@ def check_intervalPosting(user, fr_median, db_connection):
             timePubUser.append(x['intervallo_medio_secondi'])
 
     user_fr_median = median(timePubUser)
-    tolleranza = 10 
+    tolleranza = TOLLERANZA
     # tolerance limits, around 10%
     lower_bound = float(fr_median) * (1 - tolleranza / 100)
     upper_bound = float(fr_median) * (1 + tolleranza / 100)
@@ -156,7 +193,7 @@ def check_intervalPosting(user, fr_median, db_connection):
     else:
         return False
 
-def find_bot(db_connection):
+def find_bot(db_connection, preload_intervals=True, rebuild_profile=False):
     """
     Identifies users who may be bots based on several criteria such as followers, following, 
     description length, status count, and posting frequency. Users are flagged as bots if 
@@ -164,20 +201,24 @@ def find_bot(db_connection):
     
     Parameters:
     - db_connection (MySQL Connection): The connection object to interact with the MySQL database.
+    - preload_intervals (bool): If True, the posting intervals of all users are loaded with one query
+      up front; otherwise they are queried user by user.
+    - rebuild_profile (bool): If True, the bot medians are computed again from all the bots instead of read from 'bot_profile'.
     
     Returns:
     - tuple: A list of suspicious users (username, URL) and the count of suspicious users.
     """
+    start = time.time()
     no_bots = get_user_no_bot(db_connection)
-    ers_median, ing_median, desc_median, statuses_median, fr_median = median_calculator(db_connection)
+    ers_median, ing_median, desc_median, statuses_median, fr_median = median_calculator(db_connection, rebuild_profile)
+    intervals = load_intervals(db_connection) if preload_intervals else None
     user_sospetti = []
     for nb in no_bots: 
-        start = time.time()
         ersing = check_ersing(nb['followers'], nb['following'], ers_median, ing_median)
         desc = check_descriptionLength(nb['description'], desc_median)
         statuses = check_statuses(nb['statuses'], statuses_median)
         outlier = check_outlier(nb['statuses'])
-        interval = check_intervalPosting(nb['username'], fr_median, db_connection)
+        interval = check_intervalPosting(nb['username'], fr_median, db_connection, intervals)
 
         check_finale = [ersing, desc, statuses, interval]
         print(check_finale)
@@ -187,6 +228,119 @@ def find_bot(db_connection):
     debug(start)
     return user_sospetti, len(user_sospetti)
 
+def in_band(values, median_value, tolleranza):
+    """
+    Vectorized tolerance band: True where median * (1 - t%) <= value <= median * (1 + t%).
+    The bounds are computed exactly as in the per-user checks.
+    
+    Parameters:
+    - values (np.ndarray): The values to check.
+    - median_value (float): The bot median.
+    - tolleranza (int): The tolerance, in percent.
+    
+    Returns:
+    - np.ndarray: A boolean mask.
+    """
+    lower_bound = median_value * (1 - tolleranza / 100)
+    upper_bound = median_value * (1 + tolleranza / 100)
+    return (lower_bound <= values) & (values <= upper_bound)
+
+def score_users_vectorized(followers, following, statuses, description_length, has_link, interval, medians):
+    """
+    Evaluates every rule of `find_bot` as array operations, for all the users at once.
+    
+    Parameters:
+    - followers, following, statuses, description_length (np.ndarray): The metrics of the users.
+    - has_link (np.ndarray): True where the description contains a link.
+    - interval (np.ndarray): The average posting interval in seconds, 0 for users without posts.
+    - medians (tuple): The bot medians returned by `median_calculator`.
+    
+    Returns:
+    - dict: One boolean mask for each rule ('ersing', 'desc', 'statuses', 'interval', 'outlier')
+      and the resulting 'suspicious' mask.
+    """
+    ers_median, ing_median, desc_median, statuses_median, fr_median = medians
+    masks = {
+        'ersing': in_band(followers, ers_median, TOLLERANZA_ERS) | in_band(following, ing_median, TOLLERANZA),
+        'desc': in_band(description_length, desc_median, TOLLERANZA) | has_link,
+        'statuses': in_band(statuses, statuses_median, TOLLERANZA),
+        'interval': in_band(interval, float(fr_median), TOLLERANZA),
+        'outlier': statuses > OUTLIER_STATUSES,
+    }
+    true_count = masks['ersing'].astype(np.int8) + masks['desc'] + masks['statuses'] + masks['interval']
+    masks['suspicious'] = (true_count >= 2) | masks['outlier']
+    return masks
+
+def find_bot_vectorized(db_connection, rebuild_profile=False):
+    """
+    Vectorized version of `find_bot`: loads the metrics of the non-bot users into NumPy arrays
+    and evaluates all the rules at once. The suspicious users are the same as `find_bot`.
+    
+    Parameters:
+    - db_connection (MySQL Connection): The connection object to interact with the MySQL database.
+    - rebuild_profile (bool): If True, the bot medians are computed again from all the bots instead of read from 'bot_profile'.
+    
+    Returns:
+    - tuple: A list of suspicious users (username, URL), the count of suspicious users,
+      and the dictionary of per-rule boolean masks (aligned with the users of `get_user_no_bot`).
+    """
+    start = time.time()
+    no_bots = get_user_no_bot(db_connection)
+    medians = median_calculator(db_connection, rebuild_profile)
+    intervals = load_intervals(db_connection)
+    n = len(no_bots)
+    link_pattern = re.compile(LINK_PATTERN)
+
+    followers = np.fromiter((nb['followers'] for nb in no_bots), dtype=np.float64, count=n)
+    following = np.fromiter((nb['following'] for nb in no_bots), dtype=np.float64, count=n)
+    statuses = np.fromiter((nb['statuses'] for nb in no_bots), dtype=np.float64, count=n)
+    description_length = np.fromiter((len(nb['description']) for nb in no_bots), dtype=np.float64, count=n)
+    has_link = np.fromiter((link_pattern.search(nb['description']) is not None for nb in no_bots), dtype=bool, count=n)
+    interval = np.fromiter((float(intervals.get(nb['username'], 0)) for nb in no_bots), dtype=np.float64, count=n)
+
+    masks = score_users_vectorized(followers, following, statuses, description_length, has_link, interval, medians)
+    user_sospetti = [(no_bots[i]['username'], no_bots[i]['url']) for i in np.flatnonzero(masks['suspicious'])]
+    debug(start)
+    return user_sospetti, len(user_sospetti), masks
+
+def find_bot_parquet(directory, db_connection, rebuild_profile=False):
+    """
+    Version of `find_bot_vectorized` that reads the users and the posting intervals from the Parquet
+    export (see Export.py) instead of MySQL; only the bot medians are read from the database.
+    
+    Parameters:
+    - directory (str): The folder of the export.
+    - db_connection (MySQL Connection): The connection object to interact with the MySQL database.
+    - rebuild_profile (bool): If True, the bot medians are computed again from all the bots instead of read from 'bot_profile'.
+    
+    Returns:
+    - tuple: A list of suspicious users (username, URL), the count of suspicious users,
+      and the dictionary of per-rule boolean masks (aligned with the users ordered by statuses, as `get_user_no_bot`).
+    """
+    start = time.time()
+    users = read_users(directory, ['username', 'url', 'followers', 'following', 'statuses', 'description'], bot=0)
+    medians = median_calculator(db_connection, rebuild_profile)
+    intervals = posting_intervals(directory, bot=0)
+    link_pattern = re.compile(LINK_PATTERN)
+
+    # Same users and order as `get_user_no_bot`
+    selected = np.flatnonzero(users['statuses'] > 200)
+    selected = selected[np.argsort(-users['statuses'][selected], kind='stable')]
+    usernames, urls, descriptions = users['username'][selected], users['url'][selected], users['description'][selected]
+    n = len(selected)
+
+    followers = users['followers'][selected].astype(np.float64)
+    following = users['following'][selected].astype(np.float64)
+    statuses = users['statuses'][selected].astype(np.float64)
+    description_length = np.fromiter((len(d) for d in descriptions), dtype=np.float64, count=n)
+    has_link = np.fromiter((link_pattern.search(d) is not None for d in descriptions), dtype=bool, count=n)
+    interval = np.fromiter((intervals.get(u, 0.0) for u in usernames), dtype=np.float64, count=n)
+
+    masks = score_users_vectorized(followers, following, statuses, description_length, has_link, interval, medians)
+    user_sospetti = [(usernames[i], urls[i]) for i in np.flatnonzero(masks['suspicious'])]
+    debug(start)
+    return user_sospetti, len(user_sospetti), masks
+
 def debug(start): 
     """
     Logs the start and end time of the bot detection process, and the duration it took.
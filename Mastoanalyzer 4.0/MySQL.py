@@ -1,8 +1,202 @@
 #query the table
+import logging
 import asyncio
 import httpx
-import aiomysql
 import mysql.connector
+from BotProfile import update_bot_profile
+from PostingStats import unique_posts, existing_posts, update_posting_stats, create_posting_stats_table
+
+# Columns of the 'users' and 'posts' tables written by the fetch functions, in the order of the tuples
+USER_COLUMNS = ['user_id', 'username', 'bot', 'url', 'followers', 'following', 'statuses', 'description']
+USER_UPDATE_COLUMNS = ['bot', 'url', 'followers', 'following', 'statuses', 'description']
+POST_COLUMNS = [
+    'post_id', 'created_at', 'in_reply_to_id', 'in_reply_to_account_id', 'sensitive', 'spoiler_text',
+    'visibility', 'language', 'uri', 'url', 'replies_count', 'reblogs_count', 'favourites_count',
+    'favourited', 'reblogged', 'muted', 'bookmarked', 'pinned', 'content', 'media_attachments',
+    'account_id', 'account_username', 'account_display_name', 'account_url', 'reblog_id',
+    'reblog_content', 'reblogged_from_account'
+]
+POST_UPDATE_COLUMNS = [column for column in POST_COLUMNS if column not in ('post_id', 'account_id')]
+
+# Keyset pagination of the users with many statuses, on (statuses DESC, user_id DESC): both columns in the same
+# direction, so the (statuses) index, whose suffix is the primary key user_id, is read backwards without a filesort.
+# `statuses <= %s` bounds the range scan; the row comparison only filters the users tied with the last one.
+KEYSET_FIRST_PAGE_QUERY = """
+    SELECT user_id, username, bot, url, followers, following, statuses, description
+    FROM users
+    WHERE statuses > %s
+    ORDER BY statuses DESC, user_id DESC
+    LIMIT %s
+    """
+KEYSET_NEXT_PAGE_QUERY = """
+    SELECT user_id, username, bot, url, followers, following, statuses, description
+    FROM users
+    WHERE statuses > %s
+    AND statuses <= %s AND (statuses, user_id) < (%s, %s)
+    ORDER BY statuses DESC, user_id DESC
+    LIMIT %s
+    """
+LATEST_POST_ID_QUERY = """
+    SELECT MAX(CAST(post_id AS UNSIGNED))
+    FROM posts
+    WHERE account_id = %s
+    """
+# Average posting interval of the accounts, a lookup in 'posting_stats': the gaps between consecutive posts
+# sum to gap_sum, so their mean is gap_sum / (posts - 1), as AVG(TIMESTAMPDIFF(SECOND, LAG(created_at), created_at))
+INTERVALS_QUERY = """
+    SELECT s.account_username, s.gap_sum / (s.posts - 1) AS intervallo_medio_secondi
+    FROM posting_stats AS s
+    JOIN users AS u ON s.account_id = u.user_id
+    WHERE u.bot = %s AND s.posts > 1
+    """
+USER_INTERVAL_QUERY = """
+    SELECT s.account_username, s.gap_sum / (s.posts - 1) AS intervallo_medio_secondi
+    FROM posting_stats AS s
+    JOIN users AS u ON s.account_id = u.user_id
+    WHERE u.bot = 0 AND s.account_username = %s AND s.posts > 1
+    """
+
+def build_upsert_query(table, columns, update_columns, n_rows=1):
+    """
+    Builds an INSERT ... ON DUPLICATE KEY UPDATE query for `n_rows` rows.
+    
+    Parameters:
+    - table (str): The name of the table.
+    - columns (list): The columns written, in the order of the tuples.
+    - update_columns (list): The columns updated when the key already exists; if empty, a plain INSERT
+      that fails on an existing key.
+    - n_rows (int): The number of rows in the VALUES clause.
+    
+    Returns:
+    - str: The query, with one %s placeholder for each value.
+    """
+    row = "(" + ", ".join(["%s"] * len(columns)) + ")"
+    query = f"INSERT INTO {table} (" + ", ".join(f"`{c}`" for c in columns) + ") VALUES " + ", ".join([row] * n_rows)
+    if update_columns:
+        query += " ON DUPLICATE KEY UPDATE " + ", ".join(f"`{c}` = VALUES(`{c}`)" for c in update_columns)
+    return query
+
+def upsert_chunks(table, columns, update_columns, rows, chunk_size):
+    """
+    Splits rows into the multi-row statements of `upsert_in_chunks` (shared with `AsyncMySQL.upsert_in_chunks`).
+
+    Yields:
+    - tuple: (query, values, chunk) of each statement; `chunk` holds its rows, to write them one by one if it fails.
+    """
+    rows = list(rows)
+    for i in range(0, len(rows), chunk_size):
+        chunk = rows[i:i + chunk_size]
+        yield build_upsert_query(table, columns, update_columns, len(chunk)), [value for row in chunk for value in row], chunk
+
+# Errors after which the transaction is worth running again: lock wait timeout and deadlock
+# (a deadlock rolls back the whole transaction)
+RETRY_ERRNOS = (1205, 1213)
+
+def retryable(e):
+    """
+    Returns True if a database error (of mysql.connector or aiomysql) is a lock wait timeout or a deadlock.
+    """
+    errno = getattr(e, 'errno', None)
+    if errno is None and e.args and isinstance(e.args[0], int):
+        errno = e.args[0]  # aiomysql (PyMySQL) errors carry the code in args.
+    return errno in RETRY_ERRNOS
+
+def in_transaction(db_connection, work, max_attempts=3):
+    """
+    Runs `work(cursor)` in a transaction and commits it. After a deadlock or a lock wait timeout the
+    transaction is rolled back and run again, up to `max_attempts` times; other errors are raised.
+
+    Returns:
+    - The result of `work`.
+    """
+    for attempt in range(1, max_attempts + 1):
+        cursor = db_connection.cursor()
+        try:
+            result = work(cursor)
+            db_connection.commit()
+            return result
+        except Exception as e:
+            db_connection.rollback()
+            if not retryable(e) or attempt == max_attempts:
+                raise
+            logging.warning(f"Transaction rolled back ({e}), running it again ({attempt + 1}/{max_attempts}).")
+        finally:
+            cursor.close()
+
+def upsert_rows(cursor, table, columns, update_columns, rows, chunk_size):
+    """
+    Writes rows with multi-row INSERT statements of `chunk_size` rows each, without committing. If a chunk
+    fails, only that chunk is written again row by row, so a bad row does not drop the others.
+    Deadlocks and lock wait timeouts are raised, for `in_transaction` to run the transaction again.
+    
+    Parameters:
+    - cursor (MySQL Cursor): A cursor of the connection.
+    - table (str): The name of the table.
+    - columns (list): The columns written, in the order of the tuples.
+    - update_columns (list): The columns updated when the key already exists.
+    - rows (list): The tuples to write.
+    - chunk_size (int): The maximum number of rows in each statement.
+    
+    Returns:
+    - int: The number of rows that could not be written.
+    """
+    failed = 0
+    for query, values, chunk in upsert_chunks(table, columns, update_columns, rows, chunk_size):
+        try:
+            cursor.execute(query, values)
+        except Exception as e:
+            if retryable(e):
+                raise
+            logging.warning(f"Error in a chunk of {table}, writing it row by row: {e}")
+            single_row_query = build_upsert_query(table, columns, update_columns)
+            for row in chunk:
+                try:
+                    cursor.execute(single_row_query, row)
+                except Exception as e:
+                    if retryable(e):
+                        raise
+                    failed += 1
+                    logging.error(f"Row of {table} not written: {e}")
+    return failed
+
+def upsert_in_chunks(db_connection, table, columns, update_columns, rows, chunk_size):
+    """
+    Writes rows with multi-row INSERT statements of `chunk_size` rows each (see `upsert_rows`), in one transaction.
+    
+    Returns:
+    - int: The number of rows that could not be written.
+    """
+    rows = list(rows)
+    return in_transaction(db_connection, lambda cursor: upsert_rows(cursor, table, columns, update_columns, rows, chunk_size))
+
+def write_posts(cursor, posts, chunk_size):
+    """
+    Function Purpose:
+    Writes a batch of posts and counts the new ones in the posting statistics, in the transaction of `cursor`.
+    The posts not stored yet are written with plain INSERT statements: when one succeeds, all its posts
+    are new. When one fails (a concurrent writer has just stored one of its posts, or a post is bad),
+    its posts are upserted one by one and their accounts are computed again. The stored posts are
+    upserted, to refresh their counters.
+
+    Parameters:
+    - cursor (MySQL Cursor): A cursor of the writer's connection.
+    - posts (dict): The post tuples of the batch, keyed by post_id (see `unique_posts`).
+    - chunk_size (int): The maximum number of posts in each statement.
+    """
+    existing = existing_posts(cursor, list(posts))
+    added, recompute = [], {}
+    candidates = [post for post_id, post in posts.items() if post_id not in existing]
+    for query, values, chunk in upsert_chunks("posts", POST_COLUMNS, [], candidates, chunk_size):
+        try:
+            cursor.execute(query, values)
+            added.extend(chunk)
+        except Exception as e:
+            if retryable(e):
+                raise
+            upsert_rows(cursor, "posts", POST_COLUMNS, POST_UPDATE_COLUMNS, chunk, 1)
+            recompute.update((post[20], post[21]) for post in chunk)
+    upsert_rows(cursor, "posts", POST_COLUMNS, POST_UPDATE_COLUMNS, [posts[post_id] for post_id in existing], chunk_size)
+    update_posting_stats(cursor, added, recompute)
 
 def get_user(db_connection):
     """
@@ -41,10 +235,92 @@ def get_user_posts(db_connection):
     cursor.execute(query)
     return cursor.fetchall()
 
+def stream_query(db_connection, query, params=(), batch_size=10000):
+    """
+    Runs a query with an unbuffered cursor, so the rows stay on the server until they are read,
+    and yields them in batches. The connection cannot run other queries until the generator is
+    exhausted or closed.
+
+    Parameters:
+    - db_connection (MySQL Connection): The connection object to interact with the MySQL database.
+    - query (str): The query.
+    - params (tuple): The parameters of the query.
+    - batch_size (int): The number of rows in each batch.
+
+    Yields:
+    - list: A batch of at most `batch_size` tuples.
+    """
+    cursor = db_connection.cursor(buffered=False)
+    try:
+        cursor.execute(query, params)
+        while True:
+            batch = cursor.fetchmany(batch_size)
+            if not batch:
+                return
+            yield batch
+    finally:
+        if db_connection.unread_result:
+            db_connection.consume_results()  # The generator was closed early: discard the rest.
+        cursor.close()
+
+def project(columns, tables):
+    """
+    Builds the select list of a projection, checking each column against the known ones.
+
+    Parameters:
+    - columns (list): The column names.
+    - tables (list): (alias, columns) pairs; a column is taken from the first table that has it.
+
+    Returns:
+    - str: The select list, e.g. "u.bot, p.replies_count".
+    """
+    selected = []
+    for column in columns:
+        for alias, table_columns in tables:
+            if column in table_columns:
+                selected.append(f"{alias}.{column}" if alias else column)
+                break
+        else:
+            raise ValueError(f"Unknown column: {column}")
+    return ', '.join(selected)
+
+def iter_user(db_connection, columns=USER_COLUMNS, batch_size=10000):
+    """
+    Streaming version of `get_user`: yields the users in batches, reading only the given columns.
+
+    Parameters:
+    - db_connection (MySQL Connection): The connection object to interact with the MySQL database.
+    - columns (list): The columns to read, from `USER_COLUMNS`.
+    - batch_size (int): The number of rows in each batch.
+
+    Yields:
+    - list: A batch of tuples, with the values in the order of `columns`.
+    """
+    query = f"SELECT {project(columns, [('', USER_COLUMNS)])} FROM users"
+    yield from stream_query(db_connection, query, batch_size=batch_size)
+
+def iter_user_posts(db_connection, columns=('bot', 'replies_count', 'reblogs_count', 'favourites_count'), batch_size=10000):
+    """
+    Streaming version of `get_user_posts`: yields the posts joined with their users in batches,
+    reading only the given columns.
+
+    Parameters:
+    - db_connection (MySQL Connection): The connection object to interact with the MySQL database.
+    - columns (list): The columns to read, from `POST_COLUMNS` or `USER_COLUMNS` (posts first).
+    - batch_size (int): The number of rows in each batch.
+
+    Yields:
+    - list: A batch of tuples, with the values in the order of `columns`.
+    """
+    select = project(columns, [('p', POST_COLUMNS), ('u', USER_COLUMNS)])
+    query = f"SELECT {select} FROM posts AS p JOIN users AS u ON p.account_id = u.user_id"
+    yield from stream_query(db_connection, query, batch_size=batch_size)
+
 def get_utenti_pubblicazione(db_connection):
     """
-    Retrieves the average posting interval (in seconds) for each non-bot user in the 'mastodon.posts' table.
-    It calculates the time difference between consecutive posts for each user.
+    Retrieves the average posting interval (in seconds) for each non-bot user, i.e. the mean time
+    difference between consecutive posts. The interval is read from the 'posting_stats' table,
+    kept up to date by the writers, instead of comparing all the posts of the users.
     
     Parameters:
     - db_connection (MySQL Connection): The connection object to interact with the MySQL database.
@@ -53,36 +329,13 @@ def get_utenti_pubblicazione(db_connection):
     - list: A list of dictionaries, where each dictionary contains a username and their average posting interval.
     """
     cursor = db_connection.cursor(dictionary=True)
-    query = """ 
-    WITH differenze_temporali AS (
-    SELECT
-        account_username,
-        created_at,
-        LAG(created_at) OVER (PARTITION BY account_username ORDER BY created_at) AS post_precedente
-    FROM mastodon.posts AS p
-    JOIN mastodon.users AS u ON p.account_id = u.user_id
-    WHERE u.bot = 0
-    ORDER BY account_username ASC
-    ), q AS (
-    SELECT
-        account_username,
-        AVG(TIMESTAMPDIFF(SECOND, post_precedente, created_at)) AS intervallo_medio_secondi
-    FROM
-        differenze_temporali
-    WHERE
-        post_precedente IS NOT NULL
-    GROUP BY
-        account_username
-    )
-    SELECT * FROM q
-    """
-    cursor.execute(query)
+    cursor.execute(INTERVALS_QUERY, (0,))
     return cursor.fetchall()
 
 def get_bot_pubblicazione(db_connection):
     """
-    Retrieves the average posting interval (in seconds) for each bot user in the 'mastodon.posts' table.
-    It calculates the time difference between consecutive posts for each bot.
+    Retrieves the average posting interval (in seconds) for each bot user, i.e. the mean time
+    difference between consecutive posts, from the 'posting_stats' table.
     
     Parameters:
     - db_connection (MySQL Connection): The connection object to interact with the MySQL database.
@@ -91,30 +344,7 @@ def get_bot_pubblicazione(db_connection):
     - list: A list of dictionaries, where each dictionary contains a bot username and their average posting interval.
     """
     cursor = db_connection.cursor(dictionary=True)
-    query = """ 
-    WITH differenze_temporali AS (
-    SELECT
-        account_username,
-        created_at,
-        LAG(created_at) OVER (PARTITION BY account_username ORDER BY created_at) AS post_precedente
-    FROM mastodon.posts AS p
-    JOIN mastodon.users AS u ON p.account_id = u.user_id
-    WHERE u.bot = 1
-    ORDER BY account_username ASC
-    ), q AS (
-    SELECT
-        account_username,
-        AVG(TIMESTAMPDIFF(SECOND, post_precedente, created_at)) AS intervallo_medio_secondi
-    FROM
-        differenze_temporali
-    WHERE
-        post_precedente IS NOT NULL
-    GROUP BY
-        account_username
-    )
-    SELECT * FROM q
-    """
-    cursor.execute(query)
+    cursor.execute(INTERVALS_QUERY, (1,))
     return cursor.fetchall()
 
 def del_user(url, db_connection):
@@ -170,6 +400,79 @@ def create_bots_users_table(all_users, db_connection):
     db_connection.commit() 
     cursor.close()
 
+def create_checkpoint_table(db_connection):
+    """
+    Creates the 'crawl_checkpoints' table, if it does not exist yet. It stores the pagination cursor (max_id)
+    of each timeline crawl, so an interrupted crawl can resume from the last committed page.
+    
+    Parameters:
+    - db_connection (MySQL Connection): The connection object to interact with the MySQL database.
+    """
+    cursor = db_connection.cursor()
+    cursor.execute(
+    """
+    CREATE TABLE IF NOT EXISTS crawl_checkpoints (
+        checkpoint_key VARCHAR(512) NOT NULL PRIMARY KEY,
+        max_id VARCHAR(64) NOT NULL,
+        updated_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP
+    )
+    """
+    )
+    db_connection.commit()
+    cursor.close()
+
+def get_checkpoint(checkpoint_key, db_connection):
+    """
+    Retrieves the saved pagination cursor of a timeline crawl.
+    
+    Parameters:
+    - checkpoint_key (str): The key of the crawl (timeline URL plus tag set).
+    - db_connection (MySQL Connection): The connection object to interact with the MySQL database.
+    
+    Returns:
+    - str: The max_id to resume from, or None if the crawl has no checkpoint.
+    """
+    cursor = db_connection.cursor()
+    cursor.execute("SELECT max_id FROM crawl_checkpoints WHERE checkpoint_key = %s", (checkpoint_key,))
+    row = cursor.fetchone()
+    cursor.close()
+    return row[0] if row else None
+
+def save_checkpoint(checkpoint_key, max_id, db_connection):
+    """
+    Saves (or moves forward) the pagination cursor of a timeline crawl.
+    
+    Parameters:
+    - checkpoint_key (str): The key of the crawl (timeline URL plus tag set).
+    - max_id (str): The max_id of the next page to fetch.
+    - db_connection (MySQL Connection): The connection object to interact with the MySQL database.
+    """
+    cursor = db_connection.cursor()
+    cursor.execute(
+    """
+    INSERT INTO crawl_checkpoints (checkpoint_key, max_id)
+    VALUES (%s, %s)
+    ON DUPLICATE KEY UPDATE
+        max_id = VALUES(max_id)
+    """,
+    (checkpoint_key, max_id)
+    )
+    db_connection.commit()
+    cursor.close()
+
+def del_checkpoint(checkpoint_key, db_connection):
+    """
+    Deletes the checkpoint of a timeline crawl, so the next run starts again from the newest posts.
+    
+    Parameters:
+    - checkpoint_key (str): The key of the crawl (timeline URL plus tag set).
+    - db_connection (MySQL Connection): The connection object to interact with the MySQL database.
+    """
+    cursor = db_connection.cursor()
+    cursor.execute("DELETE FROM crawl_checkpoints WHERE checkpoint_key = %s", (checkpoint_key,))
+    db_connection.commit()
+    cursor.close()
+
 def get_data_from_table(db_connection, table, offset, limit):
     """
     Retrieves a specified range of user data from a given table where the number of statuses is greater than 200.
@@ -187,6 +490,72 @@ def get_data_from_table(db_connection, table, offset, limit):
     cursor.execute(f"SELECT user_id, username, bot, url, followers, following, statuses, description FROM {table} WHERE statuses > 200 ORDER BY statuses DESC LIMIT {limit} OFFSET {offset}")
     return cursor.fetchall()
 
+def iter_users_keyset(db_connection, batch_size=100, min_statuses=200):
+    """
+    Streams the users with more than `min_statuses` statuses, ordered by statuses in descending order,
+    in batches of `batch_size`. Uses keyset pagination on (statuses, user_id) instead of LIMIT/OFFSET,
+    so every page costs the same and rows inserted or deleted during the scan do not shift the pages.
+    Only rows whose key does not change are returned exactly once: a user whose statuses count is updated
+    during the scan moves in the order, so it can be skipped or returned twice.
+    
+    Parameters:
+    - db_connection (MySQL Connection): The connection object to interact with the MySQL database.
+    - batch_size (int): The number of records in each batch.
+    - min_statuses (int): Only users with more statuses than this are returned.
+    
+    Yields:
+    - list: A batch of tuples (user_id, username, bot, url, followers, following, statuses, description).
+    """
+    last_statuses, last_user_id = None, None
+    while True:
+        cursor = db_connection.cursor()
+        if last_user_id is None:
+            cursor.execute(KEYSET_FIRST_PAGE_QUERY, (min_statuses, batch_size))
+        else:
+            cursor.execute(KEYSET_NEXT_PAGE_QUERY, (min_statuses, last_statuses, last_statuses, last_user_id, batch_size))
+        batch = cursor.fetchall()
+        cursor.close()
+
+        if not batch:
+            return
+        yield batch
+
+        if len(batch) < batch_size:  # Last page
+            return
+        last_statuses, last_user_id = batch[-1][6], batch[-1][0]  # Key of the last row seen
+
+def create_bots_users_table_bulk(all_users, db_connection, chunk_size=500):
+    """
+    Same as `create_bots_users_table`, but sends multi-row INSERT statements of `chunk_size` users each.
+    
+    Parameters:
+    - all_users (list): A list of tuples containing user data (user_id, username, bot, url, followers, following, statuses, description).
+    - db_connection (MySQL Connection): The connection object to interact with the MySQL database.
+    - chunk_size (int): The maximum number of users in each statement.
+    """
+    upsert_in_chunks(db_connection, "users", USER_COLUMNS, USER_UPDATE_COLUMNS, all_users, chunk_size)
+    update_bot_profile(db_connection, all_users=all_users)  # Bots seen for the first time enter the bot profile.
+
+def create_post_per_user_bulk(db_connection, tupla_post, chunk_size=200):
+    """
+    Same as `create_post_per_user`, but sends multi-row INSERT statements of `chunk_size` posts each.
+    A failing chunk is written again row by row, so only the bad posts are lost. The posts and the
+    posting statistics of their accounts are written in one transaction (see `write_posts`).
+    
+    Parameters:
+    - db_connection (MySQL Connection): The connection object to interact with the MySQL database.
+    - tupla_post (list): A list of tuples, where each tuple contains the data for a single post.
+    - chunk_size (int): The maximum number of posts in each statement.
+    """
+    posts = unique_posts(tupla_post)
+    if not posts:
+        return
+    create_posting_stats_table(db_connection)
+    try:
+        in_transaction(db_connection, lambda cursor: write_posts(cursor, posts, chunk_size))
+    except Exception as e:
+        logging.error(f"Posts not written: {e}")
+
 def create_post_per_user(db_connection, tupla_post):
     """
     Inserts a list of posts into the 'posts' table in the database. If a post already exists (duplicate key), 
@@ -196,82 +565,110 @@ def create_post_per_user(db_connection, tupla_post):
     - db_connection (MySQL Connection): The connection object to interact with the MySQL database.
     - tupla_post (list): A list of tuples, where each tuple contains the data for a single post.
     """
-    cursor = db_connection.cursor()
+    create_posting_stats_table(db_connection)
 
-    for tupla in tupla_post:
-        try:
-            cursor.execute(
-            """
-            INSERT INTO posts (
-            post_id, 
-            created_at, 
-            in_reply_to_id, 
-            in_reply_to_account_id, 
-            `sensitive`, 
-            `spoiler_text`, 
-            `visibility`, 
-            `language`, 
-            uri, 
-            url, 
-            replies_count, 
-            reblogs_count, 
-            favourites_count, 
-            favourited, 
-            reblogged, 
-            muted, 
-            bookmarked, 
-            pinned, 
-            content, 
-            media_attachments, 
-            account_id, 
-            account_username, 
-            account_display_name, 
-            account_url, 
-            reblog_id, 
-            reblog_content, 
-            reblogged_from_account
-            ) VALUES (
-                %s, %s, %s, %s, 
-                %s, %s, %s, %s, %s, 
-                %s, %s, %s, %s, 
-                %s, %s, %s, %s, %s, 
-                %s, %s, %s, %s, 
-                %s, %s, %s, %s, 
-                %s
-            ) ON DUPLICATE KEY UPDATE
-                `created_at` = VALUES(`created_at`),
-                `in_reply_to_id` = VALUES(`in_reply_to_id`),
-                `in_reply_to_account_id` = VALUES(`in_reply_to_account_id`),
-                `sensitive` = VALUES(`sensitive`),
-                `spoiler_text` = VALUES(`spoiler_text`),
-                `visibility` = VALUES(`visibility`),
-                `language` = VALUES(`language`),
-                uri = VALUES(uri),
-                url = VALUES(url),
-                replies_count = VALUES(replies_count),
-                reblogs_count = VALUES(reblogs_count),
-                favourites_count = VALUES(favourites_count),
-                favourited = VALUES(favourited),
-                reblogged = VALUES(reblogged),
-                muted = VALUES(muted),
-                bookmarked = VALUES(bookmarked),
-                pinned = VALUES(pinned),
-                content = VALUES(content),
-                media_attachments = VALUES(media_attachments),
-                account_username = VALUES(account_username),
-                account_display_name = VALUES(account_display_name),
-                account_url = VALUES(account_url),
-                reblog_id = VALUES(reblog_id),
-                reblog_content = VALUES(reblog_content),
-                reblogged_from_account = VALUES(reblogged_from_account);
-            """, 
-            tupla 
-            )
-        except Exception as e:
-            print(f"Error: {e}")
+    def write(cursor):
+        # The affected rows of each statement tell the new posts, counted in the same transaction.
+        added = []
+        for tupla in tupla_post:
+            try:
+                cursor.execute(
+                """
+                INSERT INTO posts (
+                post_id, 
+                created_at, 
+                in_reply_to_id, 
+                in_reply_to_account_id, 
+                `sensitive`, 
+                `spoiler_text`, 
+                `visibility`, 
+                `language`, 
+                uri, 
+                url, 
+                replies_count, 
+                reblogs_count, 
+                favourites_count, 
+                favourited, 
+                reblogged, 
+                muted, 
+                bookmarked, 
+                pinned, 
+                content, 
+                media_attachments, 
+                account_id, 
+                account_username, 
+                account_display_name, 
+                account_url, 
+                reblog_id, 
+                reblog_content, 
+                reblogged_from_account
+                ) VALUES (
+                    %s, %s, %s, %s, 
+                    %s, %s, %s, %s, %s, 
+                    %s, %s, %s, %s, 
+                    %s, %s, %s, %s, %s, 
+                    %s, %s, %s, %s, 
+                    %s, %s, %s, %s, 
+                    %s
+                ) ON DUPLICATE KEY UPDATE
+                    `created_at` = VALUES(`created_at`),
+                    `in_reply_to_id` = VALUES(`in_reply_to_id`),
+                    `in_reply_to_account_id` = VALUES(`in_reply_to_account_id`),
+                    `sensitive` = VALUES(`sensitive`),
+                    `spoiler_text` = VALUES(`spoiler_text`),
+                    `visibility` = VALUES(`visibility`),
+                    `language` = VALUES(`language`),
+                    uri = VALUES(uri),
+                    url = VALUES(url),
+                    replies_count = VALUES(replies_count),
+                    reblogs_count = VALUES(reblogs_count),
+                    favourites_count = VALUES(favourites_count),
+                    favourited = VALUES(favourited),
+                    reblogged = VALUES(reblogged),
+                    muted = VALUES(muted),
+                    bookmarked = VALUES(bookmarked),
+                    pinned = VALUES(pinned),
+                    content = VALUES(content),
+                    media_attachments = VALUES(media_attachments),
+                    account_username = VALUES(account_username),
+                    account_display_name = VALUES(account_display_name),
+                    account_url = VALUES(account_url),
+                    reblog_id = VALUES(reblog_id),
+                    reblog_content = VALUES(reblog_content),
+                    reblogged_from_account = VALUES(reblogged_from_account);
+                """, 
+                tupla 
+                )
+                if cursor.rowcount == 1:
+                    added.append(tupla)  # 1 = inserted, 2 = updated, 0 = unchanged
+            except Exception as e:
+                if retryable(e):
+                    raise
+                print(f"Error: {e}")
 
-    db_connection.commit()
+        update_posting_stats(cursor, added)
+
+    try:
+        in_transaction(db_connection, write)
+    except Exception as e:
+        logging.error(f"Posts not written: {e}")
+
+def get_latest_post_id(account_id, db_connection):
+    """
+    Retrieves the ID of the newest post stored for an account.
+    
+    Parameters:
+    - account_id (str): The ID of the account.
+    - db_connection (MySQL Connection): The connection object to interact with the MySQL database.
+    
+    Returns:
+    - str: The ID of the newest stored post, or None if the account has no posts in the table.
+    """
+    cursor = db_connection.cursor()
+    cursor.execute(LATEST_POST_ID_QUERY, (account_id,))
+    row = cursor.fetchone()
     cursor.close()
+    return str(row[0]) if row and row[0] is not None else None
 
 def get_all_user(db_connection):
     """
@@ -311,6 +708,36 @@ def get_all_bot(db_connection):
     cursor.execute(query)
     return cursor.fetchall()
 
+def iter_all_user(db_connection, columns=USER_COLUMNS, batch_size=10000):
+    """
+    Streaming version of `get_all_user`: yields the non-bot users in batches, reading only the given columns.
+
+    Parameters:
+    - db_connection (MySQL Connection): The connection object to interact with the MySQL database.
+    - columns (list): The columns to read, from `USER_COLUMNS`.
+    - batch_size (int): The number of rows in each batch.
+
+    Yields:
+    - list: A batch of tuples, with the values in the order of `columns`.
+    """
+    query = f"SELECT {project(columns, [('', USER_COLUMNS)])} FROM users WHERE bot = 0"
+    yield from stream_query(db_connection, query, batch_size=batch_size)
+
+def iter_all_bot(db_connection, columns=USER_COLUMNS, batch_size=10000):
+    """
+    Streaming version of `get_all_bot`: yields the bot users in batches, reading only the given columns.
+
+    Parameters:
+    - db_connection (MySQL Connection): The connection object to interact with the MySQL database.
+    - columns (list): The columns to read, from `USER_COLUMNS`.
+    - batch_size (int): The number of rows in each batch.
+
+    Yields:
+    - list: A batch of tuples, with the values in the order of `columns`.
+    """
+    query = f"SELECT {project(columns, [('', USER_COLUMNS)])} FROM users WHERE bot = 1"
+    yield from stream_query(db_connection, query, batch_size=batch_size)
+
 def get_user_no_bot(db_connection):
     """
     Retrieves non-bot users from the 'users' table who have more than 200 statuses, 
@@ -335,7 +762,7 @@ def get_user_no_bot(db_connection):
 
 def get_pubblicazione(user, db_connection):
     """
-    Retrieves the average posting interval (in seconds) for a specific non-bot user based on their posting history.
+    Retrieves the average posting interval (in seconds) for a specific non-bot user, from the 'posting_stats' table.
     
     Parameters:
     - user (str): The username of the user whose posting interval is to be calculated.
@@ -345,29 +772,8 @@ def get_pubblicazione(user, db_connection):
     - list: A list containing the user's average posting interval in seconds.
     """
     cursor = db_connection.cursor(dictionary=True)
-    query = """ 
-    WITH differenze_temporali AS (
-        SELECT
-            account_username,
-            created_at,
-            LAG(created_at) OVER (PARTITION BY account_username ORDER BY created_at) AS post_precedente
-        FROM mastodon.posts AS p
-        JOIN mastodon.users AS u ON p.account_id = u.user_id
-        WHERE u.bot = 0 AND u.username = %s
-        ORDER BY account_username ASC
-    ),
-    q AS (
-        SELECT
-            account_username,
-            AVG(TIMESTAMPDIFF(SECOND, post_precedente, created_at)) AS intervallo_medio_secondi
-        FROM differenze_temporali
-        WHERE post_precedente IS NOT NULL
-        GROUP BY account_username
-    )
-    SELECT * FROM q
-    """
     try: 
-        cursor.execute(query, (user,))
+        cursor.execute(USER_INTERVAL_QUERY, (user,))
         result = cursor.fetchall()
         return result
     except Exception as e:
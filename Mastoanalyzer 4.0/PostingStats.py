@@ -0,0 +1,319 @@
+# Contains the posting statistics of every account (posts, first/last post, sum and histogram of the gaps), updated on ingest
+import logging
+import json
+from BotProfile import create_bot_profile_tables, create_bot_profile_tables_async, add_bot_intervals, add_bot_intervals_async
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+# Gap histogram: bucket 0 counts the gaps of 0 seconds, bucket i the gaps from 2^(i-1) to 2^i - 1 seconds
+# (1s, 2-3s, 4-7s... the last bucket also takes the longer gaps).
+HISTOGRAM_BUCKETS = 32
+
+CREATE_STATS_TABLE_QUERY = """
+    CREATE TABLE IF NOT EXISTS posting_stats (
+        account_id VARCHAR(255) NOT NULL PRIMARY KEY,
+        account_username VARCHAR(255),
+        posts INT NOT NULL DEFAULT 0,
+        first_created_at DATETIME,
+        last_created_at DATETIME,
+        gap_sum BIGINT NOT NULL DEFAULT 0,
+        gap_histogram VARCHAR(1024),
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+        INDEX idx_posting_stats_username (account_username)
+    )
+"""
+STATS_COLUMNS = ['account_id', 'account_username', 'posts', 'first_created_at', 'last_created_at', 'gap_sum', 'gap_histogram']
+SAVE_STATS_QUERY = f"""
+    INSERT INTO posting_stats ({', '.join(STATS_COLUMNS)})
+    VALUES ({', '.join(['%s'] * len(STATS_COLUMNS))})
+    ON DUPLICATE KEY UPDATE
+        {', '.join(f'{column} = VALUES({column})' for column in STATS_COLUMNS[1:])}
+"""
+# The whole posting history of an account, read from the (account_id, created_at) index
+ACCOUNT_TIMES_QUERY = "SELECT created_at FROM posts WHERE account_id = %s ORDER BY created_at"
+# The same, as a locking read: it sees the posts committed after the start of the transaction
+ACCOUNT_TIMES_LOCKING_QUERY = ACCOUNT_TIMES_QUERY + " LOCK IN SHARE MODE"
+LOCK_STATS_QUERY = f"SELECT {', '.join(STATS_COLUMNS)} FROM posting_stats WHERE account_id IN ({{ids}}) ORDER BY account_id FOR UPDATE"
+ALL_TIMES_QUERY = "SELECT account_id, account_username, created_at FROM posts ORDER BY account_id, created_at"
+tables_created = False  # The table is created once for each process.
+
+def placeholders(values):
+    return ', '.join(['%s'] * len(values))
+
+def new_stats(account_username=None):
+    """
+    Returns the statistics of an account without posts.
+    """
+    return {'account_username': account_username, 'posts': 0, 'first': None, 'last': None,
+            'gap_sum': 0, 'histogram': [0] * HISTOGRAM_BUCKETS}
+
+def row_to_stats(row):
+    """
+    Converts a row of 'posting_stats' (in the order of `STATS_COLUMNS`) into statistics.
+    """
+    histogram = json.loads(row[6]) if row[6] else [0] * HISTOGRAM_BUCKETS
+    return {'account_username': row[1], 'posts': row[2], 'first': row[3], 'last': row[4],
+            'gap_sum': int(row[5]), 'histogram': histogram}
+
+def stats_params(account_id, stats):
+    """
+    Returns the parameters of `SAVE_STATS_QUERY`.
+    """
+    return (account_id, stats['account_username'], stats['posts'], stats['first'], stats['last'],
+            stats['gap_sum'], json.dumps(stats['histogram']))
+
+def gap_bucket(seconds):
+    return min(int(seconds).bit_length(), HISTOGRAM_BUCKETS - 1)
+
+def add_times(stats, times):
+    """
+    Adds the creation times of new posts to the statistics of an account. The gaps change only at the
+    edges of the stored history, so posts newer than the last one (incremental crawl) or older than
+    the first one (pages read from the newest to the oldest) are added without reading the old posts.
+
+    Parameters:
+    - stats (dict): The statistics of the account, updated in place.
+    - times (list): The creation times (datetime) of the new posts, sorted.
+
+    Returns:
+    - bool: False if a new post falls inside the stored history: the statistics are left unchanged
+      and must be computed again from all the posts of the account.
+    """
+    if not times:
+        return True
+    if stats['posts'] == 0:
+        sequence = times
+        stats['first'], stats['last'] = times[0], times[-1]
+    elif times[0] >= stats['last']:
+        sequence = [stats['last']] + times
+        stats['last'] = times[-1]
+    elif times[-1] <= stats['first']:
+        sequence = times + [stats['first']]
+        stats['first'] = times[0]
+    else:
+        return False
+    for previous, current in zip(sequence, sequence[1:]):
+        gap = int((current - previous).total_seconds())  # Whole seconds, as TIMESTAMPDIFF(SECOND, ...)
+        stats['gap_sum'] += gap
+        stats['histogram'][gap_bucket(gap)] += 1
+    stats['posts'] += len(times)
+    return True
+
+def average_interval(stats):
+    """
+    Returns the average gap in seconds between consecutive posts, None with fewer than two posts.
+    The sum of the gaps telescopes to last - first, so the average is exact without storing them.
+    """
+    return stats['gap_sum'] / (stats['posts'] - 1) if stats['posts'] > 1 else None
+
+def group_times(tupla_post):
+    """
+    Groups the creation times of a batch of post tuples (in the order of `MySQL.POST_COLUMNS`) by account.
+    The times are the datetimes built by `FetchAll.parse_post`, so nothing is parsed here.
+
+    Returns:
+    - dict: account_id -> (account_username, sorted creation times).
+    """
+    groups = {}
+    for post in tupla_post:
+        groups.setdefault(post[20], (post[21], []))[1].append(post[1])
+    for username, times in groups.values():
+        times.sort()
+    return groups
+
+def unique_posts(tupla_post):
+    """
+    Deduplicates a batch of post tuples by post_id (the last one wins, as in the upsert).
+    """
+    return {str(post[0]): post for post in tupla_post}
+
+def create_posting_stats_table(db_connection):
+    """
+    Creates the 'posting_stats' table if it does not exist, and the bot profile tables its writer updates.
+    """
+    global tables_created
+    if tables_created:
+        return
+    cursor = db_connection.cursor()
+    cursor.execute(CREATE_STATS_TABLE_QUERY)
+    db_connection.commit()
+    cursor.close()
+    create_bot_profile_tables(db_connection)
+    tables_created = True
+
+def existing_posts(cursor, post_ids):
+    """
+    Returns the post_ids of a batch that are already in the 'posts' table. Called by the writers before
+    the insert of the batch, in its transaction: only the others can be new posts.
+
+    Parameters:
+    - cursor (MySQL Cursor): A cursor of the writer's connection.
+    - post_ids (list): The post_ids of the batch.
+
+    Returns:
+    - set: The stored post_ids, as strings.
+    """
+    existing = set()
+    for i in range(0, len(post_ids), 1000):
+        chunk = post_ids[i:i + 1000]
+        cursor.execute(f"SELECT post_id FROM posts WHERE post_id IN ({placeholders(chunk)})", chunk)
+        existing.update(str(row[0]) for row in cursor.fetchall())
+    return existing
+
+def update_posting_stats(cursor, added, recompute=None):
+    """
+    Adds the posts just inserted to the statistics of their accounts, in the transaction of the insert.
+    The rows of the accounts are locked (in account order, so two writers never wait for each other
+    in a circle), and the inserted posts stay locked until the commit: a writer storing the same post
+    waits for it and finds it stored, so a post is counted once. An account without statistics, whose
+    new posts fall inside its stored history, or in `recompute`, is computed again from all its posts,
+    read with a locking read so the posts committed by the other writers are counted too.
+    The bots among the accounts that reach two posts get their posting interval counted in the bot profile.
+
+    Parameters:
+    - cursor (MySQL Cursor): A cursor of the writer's connection, inside its transaction.
+    - added (list): The post tuples inserted by this transaction.
+    - recompute (dict): account_id -> account_username of the accounts whose new posts are not known exactly.
+    """
+    groups = group_times(added)
+    recompute = recompute or {}
+    ids = sorted(set(groups) | set(recompute))
+    if not ids:
+        return
+    cursor.execute(LOCK_STATS_QUERY.format(ids=placeholders(ids)), ids)
+    stored = {row[0]: row_to_stats(row) for row in cursor.fetchall()}
+    rows = []
+    intervals = {}  # Average posting interval of the accounts with two posts or more, for the bot profile.
+    for account_id in ids:
+        username, times = groups.get(account_id, (recompute.get(account_id), []))
+        stats = stored.get(account_id)
+        if account_id in recompute or stats is None or not add_times(stats, times):
+            cursor.execute(ACCOUNT_TIMES_LOCKING_QUERY, (account_id,))
+            stats = new_stats()
+            add_times(stats, [row[0] for row in cursor.fetchall()])
+        stats['account_username'] = username
+        rows.append(stats_params(account_id, stats))
+        if stats['posts'] > 1:
+            intervals[account_id] = average_interval(stats)
+    cursor.executemany(SAVE_STATS_QUERY, rows)
+    add_bot_intervals(cursor, intervals)
+
+def rebuild_posting_stats(db_connection, batch_size=10000):
+    """
+    Function Purpose:
+    Computes the statistics of every account again from all the posts, with a single ordered scan.
+    Used to fill the table for the posts written before it existed.
+
+    Parameters:
+    - db_connection (MySQL Connection): The connection object to interact with the MySQL database.
+    - batch_size (int): The number of posts read at a time.
+
+    Returns:
+    - int: The number of accounts.
+    """
+    create_posting_stats_table(db_connection)
+    all_stats = {}
+    current, times = None, []
+    cursor = db_connection.cursor(buffered=False)  # Only the statistics of the accounts are kept in memory.
+    cursor.execute(ALL_TIMES_QUERY)
+    while True:
+        batch = cursor.fetchmany(batch_size)
+        for account_id, username, created_at in batch:
+            if account_id != current:
+                if current is not None:
+                    add_times(all_stats[current], times)
+                current, times = account_id, []
+                all_stats[account_id] = new_stats(username)
+            times.append(created_at)
+        if not batch:
+            break
+    if current is not None:
+        add_times(all_stats[current], times)
+    cursor.close()
+
+    cursor = db_connection.cursor()
+    rows = [stats_params(account_id, stats) for account_id, stats in all_stats.items()]
+    for i in range(0, len(rows), 1000):
+        cursor.executemany(SAVE_STATS_QUERY, rows[i:i + 1000])
+    db_connection.commit()
+    cursor.close()
+    logging.info(f"Posting statistics rebuilt for {len(rows)} accounts")
+    return len(rows)
+
+def get_posting_stats(account_id, db_connection):
+    """
+    Reads the statistics of an account.
+
+    Parameters:
+    - account_id (str): The ID of the account.
+    - db_connection (MySQL Connection): The connection object to interact with the MySQL database.
+
+    Returns:
+    - dict: posts, first and last post, gap_sum, histogram and average interval in seconds; None if the account has no posts.
+    """
+    create_posting_stats_table(db_connection)
+    cursor = db_connection.cursor()
+    cursor.execute(f"SELECT {', '.join(STATS_COLUMNS)} FROM posting_stats WHERE account_id = %s", (account_id,))
+    row = cursor.fetchone()
+    cursor.close()
+    if row is None:
+        return None
+    stats = row_to_stats(row)
+    stats['average_interval'] = average_interval(stats)
+    return stats
+
+async def create_posting_stats_table_async(db_pool):
+    """
+    Asynchronous version of `create_posting_stats_table`. The writers call it before opening their
+    transaction: a CREATE TABLE would commit it.
+    """
+    global tables_created
+    if tables_created:
+        return
+    async with db_pool.acquire() as conn:
+        async with conn.cursor() as cursor:
+            await cursor.execute(CREATE_STATS_TABLE_QUERY)
+    await create_bot_profile_tables_async(db_pool)
+    tables_created = True
+
+async def existing_posts_async(cursor, post_ids):
+    """
+    Asynchronous version of `existing_posts`, for the writers of `AsyncMySQL`.
+    """
+    existing = set()
+    for i in range(0, len(post_ids), 1000):
+        chunk = post_ids[i:i + 1000]
+        await cursor.execute(f"SELECT post_id FROM posts WHERE post_id IN ({placeholders(chunk)})", chunk)
+        existing.update(str(row[0]) for row in await cursor.fetchall())
+    return existing
+
+async def update_posting_stats_async(cursor, added, recompute=None):
+    """
+    Asynchronous version of `update_posting_stats`, for the writers of `AsyncMySQL`.
+
+    Parameters:
+    - cursor (aiomysql Cursor): A cursor of the writer's connection, inside its transaction.
+    - added (list): The post tuples inserted by this transaction.
+    - recompute (dict): account_id -> account_username of the accounts whose new posts are not known exactly.
+    """
+    groups = group_times(added)
+    recompute = recompute or {}
+    ids = sorted(set(groups) | set(recompute))
+    if not ids:
+        return
+    await cursor.execute(LOCK_STATS_QUERY.format(ids=placeholders(ids)), ids)
+    stored = {row[0]: row_to_stats(row) for row in await cursor.fetchall()}
+    rows = []
+    intervals = {}  # Average posting interval of the accounts with two posts or more, for the bot profile.
+    for account_id in ids:
+        username, times = groups.get(account_id, (recompute.get(account_id), []))
+        stats = stored.get(account_id)
+        if account_id in recompute or stats is None or not add_times(stats, times):
+            await cursor.execute(ACCOUNT_TIMES_LOCKING_QUERY, (account_id,))
+            stats = new_stats()
+            add_times(stats, [row[0] for row in await cursor.fetchall()])
+        stats['account_username'] = username
+        rows.append(stats_params(account_id, stats))
+        if stats['posts'] > 1:
+            intervals[account_id] = average_interval(stats)
+    await cursor.executemany(SAVE_STATS_QUERY, rows)
+    await add_bot_intervals_async(cursor, intervals)
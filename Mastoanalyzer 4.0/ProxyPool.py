@@ -0,0 +1,162 @@
+# Contains the proxy pool used by the asynchronous fetch functions
+import logging
+import time
+import asyncio
+import httpx
+from collections import deque
+from statistics import quantiles
+from RateLimit import RateLimitGovernor
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+class ProxyPool:
+    """
+    Owns one httpx.AsyncClient for each proxy, so every request really goes through the proxy it
+    was assigned to, and keeps the health of each proxy: success rate, p50/p95 latency and number of 429.
+
+    For each request, `acquire` picks, among the healthy proxies that are not cooling down, the one whose
+    rate-limit bucket frees a slot first; proxies that are free at the same time take turns, so the
+    throughput grows with the number of proxies. A failing proxy is put on cooldown with exponential backoff (base, 2*base, 4*base...
+    up to `max_cooldown` seconds); the backoff restarts after a success.
+    """
+
+    def __init__(self, proxy_list, base_cooldown=5, max_cooldown=600, latency_window=100, archive=None, replay=None,
+                 min_success_rate=0.5):
+        """
+        Parameters:
+        - proxy_list (list): The proxy URLs. An empty list means a single direct connection (no proxy).
+        - base_cooldown (int): Seconds of cooldown after the first failure.
+        - max_cooldown (int): Maximum seconds of cooldown.
+        - latency_window (int): Number of recent latencies the percentiles are computed on.
+        - archive (ResponseArchive): If given, every raw response is recorded in it.
+        - replay (ArchiveReplay): If given, the responses come from an archive instead of the server (no proxies).
+        - min_success_rate (float): Proxies below this success rate are used only when no other proxy is available.
+        """
+        self.proxies = list(proxy_list) if replay is None else []
+        self.proxies = self.proxies or [None]
+        self.base_cooldown = base_cooldown
+        self.max_cooldown = max_cooldown
+        self.min_success_rate = min_success_rate
+        self.governor = RateLimitGovernor()  # One rate-limit bucket for each proxy.
+        self.clients = {}
+        self.stats = {}
+        options = {}
+        if archive is not None:
+            options['event_hooks'] = {'response': [archive.record_httpx]}
+        if replay is not None:
+            options['transport'] = replay.transport()
+        for proxy in self.proxies:
+            if proxy is None:
+                self.clients[proxy] = httpx.AsyncClient(**options)
+            else:
+                self.clients[proxy] = httpx.AsyncClient(proxy=proxy, **options)
+            self.stats[proxy] = {
+                'requests': 0,
+                'successes': 0,
+                'rate_limited': 0,
+                'consecutive_failures': 0,
+                'cooldown_until': 0.0,
+                'last_used': 0.0,
+                'latencies': deque(maxlen=latency_window),
+            }
+
+    def success_rate(self, proxy):
+        """
+        Returns the share of successful requests of a proxy (an unused proxy counts as healthy).
+        """
+        stats = self.stats[proxy]
+        return (stats['successes'] + 1) / (stats['requests'] + 1)
+
+    def latency(self, proxy, percentile=50):
+        """
+        Returns the p50 (or p95) latency in seconds of the recent requests of a proxy, 0 if unknown.
+        """
+        latencies = self.stats[proxy]['latencies']
+        if len(latencies) < 2:
+            return latencies[0] if latencies else 0.0
+        return quantiles(latencies, n=100, method='inclusive')[percentile - 1]
+
+    async def acquire(self):
+        """
+        Picks the available proxy whose rate-limit bucket frees a slot first (the least recently used
+        among the ones free at the same time) and waits for that slot. The health only filters:
+        proxies below `min_success_rate` are skipped while a healthier one is available.
+        If every proxy is cooling down, waits for the first one to come back.
+
+        Returns:
+        - tuple: (proxy, client) to use for the request.
+        """
+        while True:
+            now = time.time()
+            available = [proxy for proxy in self.proxies if self.stats[proxy]['cooldown_until'] <= now]
+            if available:
+                healthy = [proxy for proxy in available if self.success_rate(proxy) >= self.min_success_rate]
+                proxy = min(healthy or available,
+                            key=lambda proxy: (self.governor.next_slot(proxy, now), self.stats[proxy]['last_used']))
+                self.stats[proxy]['last_used'] = now
+                await self.governor.acquire(proxy)
+                return proxy, self.clients[proxy]
+            wait = min(self.stats[proxy]['cooldown_until'] for proxy in self.proxies) - now
+            logging.info(f"All proxies are cooling down, waiting {round(wait, 1)} seconds.")
+            await asyncio.sleep(wait)
+
+    def report_success(self, proxy, latency, headers=None):
+        """
+        Records a successful request of a proxy.
+
+        Parameters:
+        - proxy (str): The proxy used.
+        - latency (float): The response time in seconds.
+        - headers (dict-like): The headers of the response, for the rate-limit bucket.
+        """
+        stats = self.stats[proxy]
+        stats['requests'] += 1
+        stats['successes'] += 1
+        stats['consecutive_failures'] = 0
+        stats['latencies'].append(latency)
+        if headers is not None:
+            self.governor.update(proxy, headers)
+
+    def report_failure(self, proxy, status_code=None, headers=None):
+        """
+        Records a failed request of a proxy and puts it on cooldown with exponential backoff.
+        After a 429 the cooldown lasts at least until the reset of the proxy's rate limit.
+
+        Parameters:
+        - proxy (str): The proxy used.
+        - status_code (int): The HTTP status of the response, None for network errors and timeouts.
+        - headers (dict-like): The headers of the response, if any.
+        """
+        stats = self.stats[proxy]
+        stats['requests'] += 1
+        stats['consecutive_failures'] += 1
+        cooldown = min(self.base_cooldown * 2 ** (stats['consecutive_failures'] - 1), self.max_cooldown)
+        stats['cooldown_until'] = time.time() + cooldown
+        if status_code == 429:
+            stats['rate_limited'] += 1
+            self.governor.block(proxy, headers)
+            reset = self.governor.buckets[proxy]['reset']
+            stats['cooldown_until'] = max(stats['cooldown_until'], reset)
+        logging.info(f"{proxy} - failure ({status_code}), cooling down for {round(stats['cooldown_until'] - time.time(), 1)} seconds.")
+
+    def summary(self):
+        """
+        Returns the health of every proxy: requests, success rate, p50/p95 latency and number of 429.
+        """
+        return [
+            {
+                'proxy': proxy,
+                'requests': self.stats[proxy]['requests'],
+                'success_rate': round(self.success_rate(proxy), 3),
+                'p50': round(self.latency(proxy, 50), 3),
+                'p95': round(self.latency(proxy, 95), 3),
+                'rate_limited': self.stats[proxy]['rate_limited'],
+            }
+            for proxy in self.proxies
+        ]
+
+    async def aclose(self):
+        """
+        Closes the clients of all the proxies.
+        """
+        for client in self.clients.values():
+            await client.aclose()
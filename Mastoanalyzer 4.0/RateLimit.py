@@ -0,0 +1,152 @@
+# Contains the rate-limit governor shared by the fetch functions
+import logging
+import time
+import asyncio
+from email.utils import parsedate_to_datetime
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+from Ausiliario import parse_datetime
+
+class RateLimitGovernor:
+    """
+    Paces the requests of each rate-limit bucket (a token, a proxy, a token/proxy pair...) so that
+    the bucket never runs out and the server never answers 429.
+
+    The state of every bucket is read from the headers of each response:
+    - X-RateLimit-Limit: requests allowed in the window.
+    - X-RateLimit-Remaining: requests left in the window.
+    - X-RateLimit-Reset: when the window resets (ISO 8601, server clock).
+    - Date: the server clock, used to correct the skew between the server and the local clock.
+
+    The remaining requests are spread evenly until the reset, so only the bucket that is running
+    out waits, while the others keep going.
+    """
+
+    def __init__(self, reserve=1, default_wait=300):
+        """
+        Parameters:
+        - reserve (int): Requests kept aside in every window, never used by the pacing.
+        - default_wait (int): Seconds to wait after a 429 when the response has no reset header.
+        """
+        self.reserve = reserve
+        self.default_wait = default_wait
+        self.buckets = {}  # key -> state of the bucket
+
+    def update(self, key, headers):
+        """
+        Updates the state of a bucket from the headers of a response.
+
+        Parameters:
+        - key: The bucket the response belongs to.
+        - headers (dict-like): The headers of the response.
+        """
+        remaining = headers.get('X-RateLimit-Remaining')
+        reset = headers.get('X-RateLimit-Reset')
+        if remaining is None or reset is None:
+            return
+
+        now = time.time()
+        skew = 0.0  # Server clock minus local clock, in seconds.
+        date = headers.get('Date')
+        if date:
+            try:
+                skew = parsedate_to_datetime(date).timestamp() - now
+            except (TypeError, ValueError):
+                skew = 0.0
+
+        try:
+            reset_server = parse_datetime(reset).timestamp()
+            remaining = int(remaining)
+            limit = int(headers.get('X-RateLimit-Limit', remaining))
+        except ValueError:
+            logging.warning(f"Unreadable rate-limit headers for {key}: {remaining}, {reset}")
+            return
+
+        bucket = self.buckets.setdefault(key, {'next_slot': now})
+        bucket['limit'] = limit
+        bucket['remaining'] = remaining
+        bucket['reset'] = reset_server - skew  # Reset time on the local clock.
+
+    def block(self, key, headers=None):
+        """
+        Marks a bucket as exhausted after a 429, until its reset (or `default_wait` seconds if unknown).
+
+        Parameters:
+        - key: The bucket that received the 429.
+        - headers (dict-like): The headers of the 429 response, if any.
+        """
+        if headers is not None:
+            self.update(key, headers)
+        bucket = self.buckets.setdefault(key, {'next_slot': time.time()})
+        if bucket.get('reset', 0) <= time.time():
+            bucket['reset'] = time.time() + self.default_wait
+        bucket.setdefault('limit', 0)  # Unknown limit: no pacing after the reset.
+        bucket['remaining'] = 0
+        logging.info(f"Rate limit reached for {key}, waiting {round(bucket['reset'] - time.time(), 1)} seconds.")
+
+    def remaining(self, key):
+        """
+        Returns the requests left in the current window of a bucket (None if the bucket is unknown).
+        """
+        bucket = self.buckets.get(key)
+        if bucket is None or 'remaining' not in bucket:
+            return None
+        if bucket['reset'] <= time.time():
+            return bucket['limit']  # The window has reset since the last response.
+        return bucket['remaining']
+
+    def next_slot(self, key, now=None):
+        """
+        Returns when (local clock) the next request of a bucket could be sent, without booking it.
+        """
+        now = time.time() if now is None else now
+        bucket = self.buckets.get(key)
+        if bucket is None or 'remaining' not in bucket or bucket['reset'] <= now:
+            return now
+        if bucket['remaining'] - self.reserve <= 0:
+            return bucket['reset']
+        return max(now, bucket['next_slot'])
+
+    def _reserve(self, key):
+        """
+        Books the next request slot of a bucket and returns how many seconds to wait before using it.
+        """
+        now = time.time()
+        bucket = self.buckets.get(key)
+        if bucket is None or 'remaining' not in bucket:
+            return 0.0  # Nothing known yet, the first response will tell.
+
+        if bucket['reset'] <= now:
+            # The window has reset: assume a full budget until the next response says otherwise.
+            bucket['remaining'] = bucket['limit']
+            bucket['next_slot'] = now
+            return 0.0
+
+        usable = bucket['remaining'] - self.reserve
+        if usable <= 0:
+            # Bucket exhausted: wait for the reset, then start a new window.
+            wait = bucket['reset'] - now
+            bucket['next_slot'] = bucket['reset']
+            return wait
+
+        # Spread the usable requests evenly until the reset.
+        interval = (bucket['reset'] - now) / usable
+        slot = max(now, bucket['next_slot'])
+        bucket['next_slot'] = slot + interval
+        bucket['remaining'] -= 1
+        return slot - now
+
+    async def acquire(self, key):
+        """
+        Waits (without blocking the event loop) until a request can be sent on a bucket.
+        """
+        wait = self._reserve(key)
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+    def acquire_blocking(self, key):
+        """
+        Same as `acquire`, for synchronous code.
+        """
+        wait = self._reserve(key)
+        if wait > 0:
+            time.sleep(wait)
@@ -0,0 +1,170 @@
+# Contains the schema of the database as versioned migrations, applied in order and recorded in 'schema_version'
+import logging
+from MySQL import create_checkpoint_table
+from BotProfile import create_bot_profile_tables
+from PostingStats import create_posting_stats_table, rebuild_posting_stats
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+CREATE_VERSION_TABLE_QUERY = """
+    CREATE TABLE IF NOT EXISTS schema_version (
+        version INT NOT NULL PRIMARY KEY,
+        description VARCHAR(255) NOT NULL,
+        applied_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+    )
+    """
+# The tables of the fetch functions, in the order of MySQL.USER_COLUMNS and MySQL.POST_COLUMNS.
+# IF NOT EXISTS: a database created before the migrations keeps its tables and gets the later versions.
+CREATE_USERS_TABLE_QUERY = """
+    CREATE TABLE IF NOT EXISTS users (
+        user_id VARCHAR(255) NOT NULL PRIMARY KEY,
+        username VARCHAR(255) NOT NULL,
+        bot BOOLEAN NOT NULL DEFAULT FALSE,
+        url VARCHAR(512),
+        followers INT NOT NULL DEFAULT 0,
+        following INT NOT NULL DEFAULT 0,
+        statuses INT NOT NULL DEFAULT 0,
+        description TEXT
+    ) CHARACTER SET utf8mb4
+    """
+CREATE_POSTS_TABLE_QUERY = """
+    CREATE TABLE IF NOT EXISTS posts (
+        post_id VARCHAR(255) NOT NULL PRIMARY KEY,
+        created_at DATETIME NOT NULL,
+        in_reply_to_id VARCHAR(255),
+        in_reply_to_account_id VARCHAR(255),
+        sensitive BOOLEAN NOT NULL DEFAULT FALSE,
+        spoiler_text TEXT,
+        visibility VARCHAR(32),
+        language VARCHAR(16),
+        uri VARCHAR(512),
+        url VARCHAR(512),
+        replies_count INT NOT NULL DEFAULT 0,
+        reblogs_count INT NOT NULL DEFAULT 0,
+        favourites_count INT NOT NULL DEFAULT 0,
+        favourited BOOLEAN NOT NULL DEFAULT FALSE,
+        reblogged BOOLEAN NOT NULL DEFAULT FALSE,
+        muted BOOLEAN NOT NULL DEFAULT FALSE,
+        bookmarked BOOLEAN NOT NULL DEFAULT FALSE,
+        pinned BOOLEAN NOT NULL DEFAULT FALSE,
+        content MEDIUMTEXT,
+        media_attachments MEDIUMTEXT,
+        account_id VARCHAR(255) NOT NULL,
+        account_username VARCHAR(255),
+        account_display_name VARCHAR(255),
+        account_url VARCHAR(512),
+        reblog_id VARCHAR(255),
+        reblog_content TEXT,
+        reblogged_from_account VARCHAR(255)
+    ) CHARACTER SET utf8mb4
+    """
+# Indexes of the hot queries (InnoDB appends the primary key to every secondary index):
+# - posts (account_id, created_at): the join with users and LATEST_POST_ID_QUERY, answered from the index alone;
+# - posts (account_username, created_at, account_id): `post_per_user` and the interval CTEs, whose window
+#   (PARTITION BY account_username ORDER BY created_at) and join are read from the index without touching the rows;
+# - users (bot, statuses): `get_user_no_bot`, `get_all_user` and `get_all_bot` (bot = ?, statuses > 200 ORDER BY statuses DESC);
+# - users (statuses): the keyset pagination of `iter_users_keyset` on (statuses DESC, user_id DESC), read backwards.
+HOT_PATH_INDEXES = [
+    ('posts', 'idx_posts_account_created', ['account_id', 'created_at']),
+    ('posts', 'idx_posts_username_created', ['account_username', 'created_at', 'account_id']),
+    ('users', 'idx_users_bot_statuses', ['bot', 'statuses']),
+    ('users', 'idx_users_statuses', ['statuses']),
+]
+INDEX_EXISTS_QUERY = """
+    SELECT COUNT(*) FROM information_schema.statistics
+    WHERE table_schema = DATABASE() AND table_name = %s AND index_name = %s
+    """
+
+# Insertion order of the posts, the watermark of the incremental Parquet export (see Export.py):
+# AUTO_INCREMENT numbers the existing rows too, and the upserts of a stored post do not change it
+COLUMN_EXISTS_QUERY = """
+    SELECT COUNT(*) FROM information_schema.columns
+    WHERE table_schema = DATABASE() AND table_name = %s AND column_name = %s
+    """
+ADD_INSERT_SEQ_QUERY = """
+    ALTER TABLE posts
+    ADD COLUMN insert_seq BIGINT UNSIGNED NOT NULL AUTO_INCREMENT,
+    ADD UNIQUE KEY idx_posts_insert_seq (insert_seq)
+    """
+
+def create_hot_path_indexes(db_connection):
+    """
+    Creates the indexes of `HOT_PATH_INDEXES` that do not exist yet (MySQL has no CREATE INDEX IF NOT EXISTS).
+    """
+    cursor = db_connection.cursor()
+    for table, name, columns in HOT_PATH_INDEXES:
+        cursor.execute(INDEX_EXISTS_QUERY, (table, name))
+        if cursor.fetchone()[0]:
+            continue
+        logging.info(f"Creating index {name} on {table} ({', '.join(columns)})")
+        cursor.execute(f"CREATE INDEX {name} ON {table} ({', '.join(columns)})")
+    cursor.close()
+
+def add_insert_seq(db_connection):
+    """
+    Adds the `insert_seq` column to 'posts', if it does not exist yet.
+    """
+    cursor = db_connection.cursor()
+    cursor.execute(COLUMN_EXISTS_QUERY, ('posts', 'insert_seq'))
+    if not cursor.fetchone()[0]:
+        logging.info("Numbering the posts in insertion order (insert_seq)")
+        cursor.execute(ADD_INSERT_SEQ_QUERY)
+    cursor.close()
+
+# Every migration is (version, description, steps); a step is a query or a function of the connection.
+# Never change a released migration: add a new version instead.
+MIGRATIONS = [
+    (1, "users and posts tables", [CREATE_USERS_TABLE_QUERY, CREATE_POSTS_TABLE_QUERY]),
+    (2, "crawl checkpoints and bot profile tables", [create_checkpoint_table, create_bot_profile_tables]),
+    (3, "hot-path indexes of posts and users", [create_hot_path_indexes]),
+    (4, "posting statistics of the accounts", [create_posting_stats_table, rebuild_posting_stats]),
+    (5, "insertion order of the posts", [add_insert_seq]),
+]
+
+def current_version(db_connection):
+    """
+    Returns the version of the schema of the database, 0 if no migration was applied.
+
+    Parameters:
+    - db_connection (MySQL Connection): The connection object to interact with the MySQL database.
+    """
+    cursor = db_connection.cursor()
+    cursor.execute(CREATE_VERSION_TABLE_QUERY)
+    cursor.execute("SELECT COALESCE(MAX(version), 0) FROM schema_version")
+    version = cursor.fetchone()[0]
+    cursor.close()
+    return version
+
+def migrate(db_connection, target=None):
+    """
+    Function Purpose:
+    Brings the schema of the database to the latest version (or to `target`), applying the missing
+    migrations in order. Each applied migration is recorded in 'schema_version', so running it again
+    does nothing. The DDL statements of MySQL commit implicitly, so a failed migration is not rolled back:
+    its steps are idempotent and it is applied again at the next run.
+
+    Parameters:
+    - db_connection (MySQL Connection): The connection object to interact with the MySQL database.
+    - target (int): The version to reach; the latest by default.
+
+    Returns:
+    - int: The version of the schema after the migrations.
+    """
+    version = current_version(db_connection)
+    target = MIGRATIONS[-1][0] if target is None else target
+    for migration_version, description, steps in MIGRATIONS:
+        if migration_version <= version or migration_version > target:
+            continue
+        logging.info(f"Applying schema migration {migration_version}: {description}")
+        for step in steps:
+            if callable(step):
+                step(db_connection)
+            else:
+                cursor = db_connection.cursor()
+                cursor.execute(step)
+                cursor.close()
+        cursor = db_connection.cursor()
+        cursor.execute("INSERT INTO schema_version (version, description) VALUES (%s, %s)", (migration_version, description))
+        db_connection.commit()
+        cursor.close()
+        version = migration_version
+    return version
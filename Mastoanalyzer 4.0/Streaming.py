@@ -0,0 +1,232 @@
+# Contains the streaming collector: receives new posts from the Mastodon streaming API instead of polling the timelines
+import logging
+import sys
+import os
+import re
+import json
+import time
+import asyncio
+import httpx
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+from credentials import access_token, instance_url
+from FetchAll import parse_user, parse_post
+import AsyncMySQL
+
+def parse_sse(lines):
+    """
+    Groups the lines of a Server-Sent Events stream into events.
+
+    Parameters:
+    - lines (list): The lines received since the last event, without the blank line that ends the event.
+
+    Returns:
+    - tuple: (event, data), where data joins the 'data:' lines with a newline. Comments (':thump') are ignored.
+    """
+    event = 'message'
+    data = []
+    for line in lines:
+        if line.startswith(':'):
+            continue  # Heartbeat
+        field, _, value = line.partition(':')
+        value = value[1:] if value.startswith(' ') else value
+        if field == 'event':
+            event = value
+        elif field == 'data':
+            data.append(value)
+    return event, '\n'.join(data)
+
+class StreamBuffer:
+    """
+    Micro-batch buffer shared by the hashtag streams: users are deduplicated by user_id (the newest
+    counters win), posts by post_id. It is flushed to the database by size or by time.
+    """
+
+    def __init__(self, db_pool, batch_size, flush_interval):
+        self.db_pool = db_pool
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.users = {}
+        self.posts = {}
+        self.lock = asyncio.Lock()  # The streams and the flusher may flush at the same time.
+        self.last_flush = time.time()
+        self.users_written = 0
+        self.posts_written = 0
+
+    def add(self, status):
+        """
+        Converts a status received from the stream into the same user and post tuples as the polling path.
+        """
+        account = status.get('account')
+        if not account or 'bsky.brid.gy' in account.get('url', ''):  # An ambiguous instance returning incorrect info.
+            return
+        user_tuple = parse_user(account)
+        self.users[user_tuple[0]] = user_tuple
+        post_tuple = parse_post(status)
+        self.posts[post_tuple[0]] = post_tuple
+
+    def due(self):
+        """
+        Returns True when the buffer should be flushed.
+        """
+        if not self.posts:
+            return False
+        return len(self.posts) >= self.batch_size or time.time() - self.last_flush >= self.flush_interval
+
+    async def flush(self):
+        """
+        Writes the buffered users, then their posts, with the multi-row writers.
+        The batch leaves the buffer only after both writes succeed, so a failed flush loses nothing:
+        the next flush writes it again, with the events received meanwhile.
+        """
+        async with self.lock:
+            users, posts = dict(self.users), dict(self.posts)
+            if not posts:
+                self.last_flush = time.time()
+                return
+            await AsyncMySQL.create_bots_users_table_bulk(list(users.values()), self.db_pool)
+            await AsyncMySQL.create_post_per_user_bulk(self.db_pool, list(posts.values()))
+            # Drop what was written, keeping the entries added or changed during the writes.
+            for buffered, written in ((self.users, users), (self.posts, posts)):
+                for key, value in written.items():
+                    if buffered.get(key) is value:
+                        del buffered[key]
+            self.last_flush = time.time()
+            self.users_written += len(users)
+            self.posts_written += len(posts)
+            logging.info(f"Stream flush: {len(users)} users, {len(posts)} posts")
+
+async def get_streaming_url(instance):
+    """
+    Returns the base URL of the streaming API of an instance. Large instances serve it from a separate
+    host (mastodon.social answers its /api/v1/streaming with a redirect to streaming.mastodon.social),
+    advertised as urls.streaming_api by /api/v1/instance; without it, the instance itself is used.
+
+    Parameters:
+    - instance (str): The URL of the instance, e.g. "https://mastodon.social".
+
+    Returns:
+    - str: The base URL of the streaming API, e.g. "https://streaming.mastodon.social/api/v1/streaming".
+    """
+    try:
+        async with httpx.AsyncClient(timeout=15, follow_redirects=True) as client:
+            response = await client.get(f"{instance}/api/v1/instance")
+            response.raise_for_status()
+            streaming_api = response.json()['urls']['streaming_api']
+    except (httpx.HTTPError, ValueError, KeyError, TypeError) as e:
+        logging.warning(f"Streaming host of {instance} unknown ({e}), using the instance itself.")
+        return f"{instance}/api/v1/streaming"
+    return re.sub(r'^ws', 'http', streaming_api.rstrip('/')) + '/api/v1/streaming'  # wss:// -> https://
+
+async def stream_hashtag(tag, buffer, streaming_url, headers, max_backoff=300):
+    """
+    Function Purpose:
+    Subscribes to the stream of a hashtag and feeds every new status to the buffer.
+    When the connection drops, it reconnects with exponential backoff (1, 2, 4... up to `max_backoff`
+    seconds); the backoff restarts after a connection that delivered at least one event.
+
+    Parameters:
+    - tag (str): The hashtag, without '#'.
+    - buffer (StreamBuffer): The micro-batch buffer shared by all the streams.
+    - streaming_url (str): The base URL of the streaming API, e.g. "https://mastodon.social/api/v1/streaming".
+    - headers (dict): HTTP headers for the requests (authentication token).
+    - max_backoff (int): Maximum number of seconds between two reconnections.
+    """
+    backoff = 1
+    async with httpx.AsyncClient(timeout=httpx.Timeout(15, read=None), follow_redirects=True) as client:
+        while True:
+            received = 0
+            try:
+                async with client.stream('GET', f"{streaming_url}/hashtag", params={'tag': tag}, headers=headers) as response:
+                    response.raise_for_status()
+                    logging.info(f"Connected to the stream of #{tag}")
+                    lines = []
+                    async for line in response.aiter_lines():
+                        if line:
+                            lines.append(line)
+                            continue
+                        # A blank line ends the event.
+                        event, data = parse_sse(lines)
+                        lines = []
+                        if event != 'update' or not data:
+                            continue
+                        try:
+                            buffer.add(json.loads(data))
+                            received += 1
+                        except (json.JSONDecodeError, TypeError, AttributeError) as e:
+                            logging.error(f"Unreadable event from #{tag}: {e}")
+                            continue
+                        if buffer.due():
+                            await buffer.flush()
+                logging.warning(f"The stream of #{tag} was closed by the server.")
+            except (httpx.HTTPError, httpx.StreamError) as e:
+                logging.error(f"Stream error for #{tag}: {e}")
+
+            if received:
+                backoff = 1  # The connection worked, start again from the shortest wait.
+            logging.info(f"Reconnecting to #{tag} in {backoff} seconds.")
+            await asyncio.sleep(backoff)
+            backoff = min(backoff * 2, max_backoff)
+
+async def stream_hashtags(tags, db_pool, streaming_url=None, batch_size=100, flush_interval=5, duration=None):
+    """
+    Function Purpose:
+    Streaming collector, an alternative to `get_timeline_posts`: subscribes to the streams of several
+    hashtags at once and writes the users and posts they deliver in micro-batches.
+
+    Parameters:
+    - tags (list): The hashtags to follow.
+    - db_pool (aiomysql.Pool): The pool of connections to the MySQL database.
+    - streaming_url (str): The base URL of the streaming API; by default the one advertised by `instance_url`
+      (see `get_streaming_url`).
+      Point it at `fake_mastodon.py` to test without the real instance.
+    - batch_size (int): Number of posts that triggers a write to the database.
+    - flush_interval (int): Maximum number of seconds between two writes to the database.
+    - duration (int): Seconds after which the collector stops; None to run until interrupted.
+
+    Returns:
+    - tuple: The number of user rows and post rows written.
+
+    Raises:
+    - Exception: The error that stopped a stream or the flusher, after the buffer is written.
+    """
+    if streaming_url is None:
+        streaming_url = await get_streaming_url(instance_url)
+    headers = {
+        'Authorization': f'Bearer {access_token}'
+    }
+    buffer = StreamBuffer(db_pool, batch_size, flush_interval)
+
+    async def flusher():
+        # Flushes by time even when no event arrives.
+        while True:
+            await asyncio.sleep(flush_interval)
+            if buffer.due():
+                try:
+                    await buffer.flush()
+                except Exception:
+                    logging.exception("Stream flush failed, stopping the collector.")
+                    raise
+
+    tasks = [asyncio.create_task(stream_hashtag(tag, buffer, streaming_url, headers)) for tag in tags]
+    tasks.append(asyncio.create_task(flusher()))
+    error = None
+    try:
+        done, pending = await asyncio.wait(tasks, timeout=duration, return_when=asyncio.FIRST_EXCEPTION)
+        for task in done:
+            error = task.exception()
+            logging.error(f"Stream collector stopped by an error: {error!r}")
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        try:
+            await buffer.flush()  # Write what is left, the batch of a failed flush included.
+        except Exception as e:
+            logging.error(f"Final stream flush failed: {e!r}")
+            if error is None:
+                error = e  # Otherwise the first error is the one raised.
+        logging.info(f"Stream collector: {buffer.users_written} user rows and {buffer.posts_written} post rows written")
+    if error is not None:
+        raise error
+    return buffer.users_written, buffer.posts_written
@@ -0,0 +1,120 @@
+# Contains the pool of access tokens used by the fetch functions, each token with its own rate-limit bucket
+import logging
+import time
+from urllib.parse import urlsplit
+from RateLimit import RateLimitGovernor
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+def instance_of(url):
+    """
+    Returns the instance of a URL, e.g. "https://mastodon.social" for "https://mastodon.social/api/v1/timelines/tag/politics".
+    """
+    parts = urlsplit(url)
+    return f"{parts.scheme}://{parts.netloc}"
+
+class TokenPool:
+    """
+    Spreads the requests over several access tokens, possibly of different instances. Mastodon limits
+    the authenticated requests per token (300 every 5 minutes), so every token has its own bucket
+    in the governor, updated from the X-RateLimit-* headers of its responses, and the throughput
+    grows with the number of tokens.
+
+    For each request, `acquire` picks, among the tokens of the instance of the URL (the ids of
+    accounts and posts, and so the pagination cursors, are local to an instance), the one with the
+    most requests left in its window. The tokens are referred to by a key, "instance#n", so they never
+    end up in the logs; a URL of an instance without tokens gets the key of the instance: its own
+    bucket, with no Authorization header.
+    """
+
+    def __init__(self, credentials, governor=None, default_limit=300):
+        """
+        Parameters:
+        - credentials (list): (instance_url, access_token) pairs.
+        - governor (RateLimitGovernor): The governor holding the buckets; a new one is created if None.
+        - default_limit (int): Requests assumed left for a token that has not received a response yet.
+        """
+        self.tokens = {}  # key -> access token
+        for n, (instance, token) in enumerate(credentials):
+            self.tokens[f"{instance_of(instance)}#{n}"] = token
+        self.governor = governor if governor is not None else RateLimitGovernor()
+        self.default_limit = default_limit
+        self.sent = {}  # key -> requests sent
+
+    def budget(self, key):
+        """
+        Returns the requests left in the current window of a token.
+        """
+        remaining = self.governor.remaining(key)
+        if remaining is None:
+            return self.default_limit - self.sent.get(key, 0)  # No response yet.
+        return remaining
+
+    def pick(self, url):
+        """
+        Returns the key of the token a request to `url` should use: the token of its instance with
+        the most budget left or, when all are exhausted, the one that resets first.
+        """
+        instance = instance_of(url)
+        candidates = [key for key in self.tokens if key.rsplit('#', 1)[0] == instance]
+        if not candidates:
+            return instance
+        now = time.time()
+
+        def priority(key):
+            budget = self.budget(key)
+            if budget > self.governor.reserve:
+                return (1, budget)
+            return (0, -self.governor.buckets.get(key, {}).get('reset', now))
+        return max(candidates, key=priority)
+
+    async def acquire(self, url):
+        """
+        Picks the token of a request and waits (without blocking the event loop) for a slot of its bucket.
+
+        Returns:
+        - str: The key of the token, for `headers`, `update` and `block`.
+        """
+        key = self.pick(url)
+        self.sent[key] = self.sent.get(key, 0) + 1
+        await self.governor.acquire(key)
+        return key
+
+    def acquire_blocking(self, url):
+        """
+        Same as `acquire`, for synchronous code.
+        """
+        key = self.pick(url)
+        self.sent[key] = self.sent.get(key, 0) + 1
+        self.governor.acquire_blocking(key)
+        return key
+
+    def token(self, key):
+        """
+        Returns the access token of a key, None for an instance without tokens.
+        """
+        return self.tokens.get(key)
+
+    def headers(self, key):
+        """
+        Returns the Authorization header of a token (empty for an instance without tokens).
+        """
+        token = self.tokens.get(key)
+        return {'Authorization': f'Bearer {token}'} if token else {}
+
+    def update(self, key, headers):
+        """
+        Updates the bucket of a token from the headers of its response.
+        """
+        self.governor.update(key, headers)
+
+    def block(self, key, headers=None):
+        """
+        Marks the bucket of a token as exhausted after a 429; the next requests go to the other tokens.
+        """
+        self.governor.block(key, headers)
+
+    def summary(self):
+        """
+        Returns the requests sent and the budget left of every token.
+        """
+        return [{'token': key, 'requests': self.sent.get(key, 0), 'remaining': self.budget(key)} for key in self.tokens]
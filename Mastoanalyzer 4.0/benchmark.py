@@ -0,0 +1,487 @@
+# Contains the benchmarks used to measure the performance of the tool
+import logging
+import sys
+import os
+import time
+import json
+import asyncio
+import requests
+from statistics import quantiles
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+from main import connect_to_db
+from MySQL import KEYSET_FIRST_PAGE_QUERY, KEYSET_NEXT_PAGE_QUERY
+from MySQL import create_post_per_user, create_post_per_user_bulk, create_bots_users_table, create_bots_users_table_bulk, get_utenti_pubblicazione
+from FindBot import find_bot, find_bot_vectorized
+from Ausiliario import format_content, format_content_bs
+from credentials import instance_url
+from FetchAll import get_timeline_posts, async_worker_pool, parse_user
+from AsyncMySQL import create_pool
+import fake_mastodon
+from Schema import migrate, HOT_PATH_INDEXES
+from BotProfile import create_bot_profile_tables
+
+BENCHMARK_ID = 9100000000000000000  # Synthetic IDs start here, far from the real Mastodon ones
+BENCHMARK_USERNAME = 'benchmark_user'
+
+def fake_users(n):
+    """
+    Generates `n` synthetic user tuples, in the format of the 'users' table.
+    """
+    return [
+        (str(BENCHMARK_ID + i), f"{BENCHMARK_USERNAME}_{i}", i % 10 == 0, f"https://example.org/@{BENCHMARK_USERNAME}_{i}",
+         i % 1000, i % 500, 200 + i, "A synthetic user, written by the benchmark.")
+        for i in range(n)
+    ]
+
+def fake_posts(n):
+    """
+    Generates `n` synthetic post tuples, in the format of the 'posts' table, all from one synthetic account.
+    """
+    posts = []
+    for i in range(n):
+        post_id = str(BENCHMARK_ID + i)
+        posts.append((
+            post_id, time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(1700000000 + 60 * i)), None, None, False, '',
+            'public', 'en', f"https://example.org/statuses/{post_id}", f"https://example.org/@{BENCHMARK_USERNAME}/{post_id}",
+            i % 7, i % 5, i % 11, False, False, False, False, False, "Synthetic post content " * 10, json.dumps([]),
+            str(BENCHMARK_ID), BENCHMARK_USERNAME, "Benchmark", f"https://example.org/@{BENCHMARK_USERNAME}",
+            None, None, None
+        ))
+    return posts
+
+def clean_benchmark_rows(db_connection):
+    """
+    Deletes the synthetic rows written by the benchmarks.
+    """
+    cursor = db_connection.cursor()
+    cursor.execute("DELETE FROM posts WHERE account_username = %s", (BENCHMARK_USERNAME,))
+    cursor.execute("DELETE FROM posting_stats WHERE account_username = %s", (BENCHMARK_USERNAME,))
+    cursor.execute("DELETE FROM users WHERE username LIKE %s", (f"{BENCHMARK_USERNAME}_%",))
+    db_connection.commit()
+    cursor.close()
+
+# The tables of the bot profile: the bulk writers add the synthetic bots (every tenth user) to them.
+BOT_PROFILE_TABLES = ('bot_profile', 'bot_profile_members')
+
+def save_bot_profile(db_connection):
+    """
+    Reads the bot profile and its members, so `restore_bot_profile` can undo what the benchmarks add to them.
+
+    Returns:
+    - dict: table -> (columns, rows).
+    """
+    create_bot_profile_tables(db_connection)
+    cursor = db_connection.cursor()
+    saved = {}
+    for table in BOT_PROFILE_TABLES:
+        cursor.execute(f"SELECT * FROM {table}")
+        rows = cursor.fetchall()
+        saved[table] = ([column[0] for column in cursor.description], rows)
+    db_connection.commit()
+    cursor.close()
+    return saved
+
+def restore_bot_profile(db_connection, saved):
+    """
+    Puts back the bot profile and its members read by `save_bot_profile`, dropping the synthetic bots.
+    """
+    cursor = db_connection.cursor()
+    for table, (columns, rows) in saved.items():
+        cursor.execute(f"DELETE FROM {table}")
+        if rows:
+            query = f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join(['%s'] * len(columns))})"
+            cursor.executemany(query, rows)
+    db_connection.commit()
+    cursor.close()
+
+def measure(function, *args):
+    """
+    Runs `function(*args)` and returns the elapsed time in seconds.
+    """
+    start = time.time()
+    function(*args)
+    return time.time() - start
+
+def benchmark_ingest(db_connection, n_rows=5000, chunk_size=200):
+    """
+    Measures the ingest throughput (rows/sec) of the row-by-row and of the multi-row INSERT paths,
+    for both posts and users. Every path writes the same synthetic rows into an empty range, so
+    all of them measure inserts and not updates.
+
+    Parameters:
+    - db_connection (MySQL Connection): The connection object to interact with the MySQL database.
+    - n_rows (int): The number of rows written by each path.
+    - chunk_size (int): The number of rows in each multi-row statement.
+
+    Returns:
+    - dict: The throughput in rows/sec of each path.
+    """
+    posts = fake_posts(n_rows)
+    users = fake_users(n_rows)
+    results = {}
+
+    clean_benchmark_rows(db_connection)
+    results['posts, row by row'] = n_rows / measure(create_post_per_user, db_connection, posts)
+    clean_benchmark_rows(db_connection)
+    results[f'posts, chunks of {chunk_size}'] = n_rows / measure(create_post_per_user_bulk, db_connection, posts, chunk_size)
+    clean_benchmark_rows(db_connection)
+    results['users, row by row'] = n_rows / measure(create_bots_users_table, users, db_connection)
+    clean_benchmark_rows(db_connection)
+    results[f'users, chunks of {chunk_size}'] = n_rows / measure(create_bots_users_table_bulk, users, db_connection, chunk_size)
+    clean_benchmark_rows(db_connection)
+
+    for path, rows_per_sec in results.items():
+        logging.info(f"Ingest {path}: {round(rows_per_sec)} rows/sec")
+    return results
+
+def benchmark_find_bot(db_connection):
+    """
+    Compares the duration of `find_bot` with one interval query per user and with all the
+    intervals loaded by a single grouped query, on the data already in the database.
+
+    Parameters:
+    - db_connection (MySQL Connection): The connection object to interact with the MySQL database.
+
+    Returns:
+    - dict: The duration in seconds of each mode.
+    """
+    results = {}
+    start = time.time()
+    per_user = find_bot(db_connection, preload_intervals=False)
+    results['one query per user'] = time.time() - start
+    start = time.time()
+    preloaded = find_bot(db_connection, preload_intervals=True)
+    results['one grouped query'] = time.time() - start
+
+    if set(per_user[0]) != set(preloaded[0]):
+        logging.warning("The two modes found different suspicious users.")
+    for mode, seconds in results.items():
+        logging.info(f"find_bot, {mode}: {round(seconds, 2)} seconds for {per_user[1]} suspicious users")
+    return results
+
+def benchmark_scoring(db_connection):
+    """
+    Compares `find_bot` with the vectorized `find_bot_vectorized`: duration and suspicious users,
+    which must be the same.
+
+    Parameters:
+    - db_connection (MySQL Connection): The connection object to interact with the MySQL database.
+
+    Returns:
+    - dict: The duration in seconds of each mode.
+    """
+    results = {}
+    start = time.time()
+    per_user = find_bot(db_connection)
+    results['per user'] = time.time() - start
+    start = time.time()
+    vectorized = find_bot_vectorized(db_connection)
+    results['vectorized'] = time.time() - start
+
+    if sorted(per_user[0]) != sorted(vectorized[0]):
+        logging.warning("The vectorized scoring found different suspicious users.")
+    for mode, seconds in results.items():
+        logging.info(f"Scoring {mode}: {round(seconds, 2)} seconds")
+    return results
+
+# The hot queries, with a place for the index hints of each table
+PLAN_QUERIES = {
+    'intervals of the users': ("""
+        WITH differenze_temporali AS (
+        SELECT account_username, created_at,
+            LAG(created_at) OVER (PARTITION BY account_username ORDER BY created_at) AS post_precedente
+        FROM posts AS p {posts_hint}
+        JOIN users AS u {users_hint} ON p.account_id = u.user_id
+        WHERE u.bot = 0
+        )
+        SELECT account_username, AVG(TIMESTAMPDIFF(SECOND, post_precedente, created_at)) AS intervallo_medio_secondi
+        FROM differenze_temporali
+        WHERE post_precedente IS NOT NULL
+        GROUP BY account_username
+        """, ()),
+    'selection of the users': ("""
+        SELECT * FROM users {users_hint}
+        WHERE bot = 0 AND statuses > 200
+        ORDER BY statuses DESC
+        """, ()),
+    'posts of a user': ("SELECT * FROM posts {posts_hint} WHERE account_username = %s", ('username',)),
+    'latest post of an account': ("SELECT MAX(CAST(post_id AS UNSIGNED)) FROM posts {posts_hint} WHERE account_id = %s", ('account_id',)),
+    # The pages of `iter_users_keyset`: no filesort, and every page costs the same
+    'first page of the users': (KEYSET_FIRST_PAGE_QUERY.replace('FROM users', 'FROM users {users_hint}'),
+                                ('min_statuses', 'batch_size')),
+    'next page of the users': (KEYSET_NEXT_PAGE_QUERY.replace('FROM users', 'FROM users {users_hint}'),
+                               ('min_statuses', 'last_statuses', 'last_statuses', 'last_user_id', 'batch_size')),
+}
+
+def benchmark_posting_stats(db_connection, repeat=3):
+    """
+    Compares the posting intervals of the users computed by the window query over all the posts
+    with the lookup in 'posting_stats' of `get_utenti_pubblicazione`: duration and values, which must be the same.
+
+    Parameters:
+    - db_connection (MySQL Connection): The connection object to interact with the MySQL database.
+    - repeat (int): Runs of each query; the fastest one is kept.
+
+    Returns:
+    - dict: The duration in seconds of each mode.
+    """
+    migrate(db_connection)
+    window_query = PLAN_QUERIES['intervals of the users'][0].format(posts_hint='', users_hint='')
+    results = {}
+    for mode in ('window over the posts', 'posting_stats lookup'):
+        durations = []
+        for _ in range(repeat):
+            start = time.time()
+            if mode == 'posting_stats lookup':
+                rows = get_utenti_pubblicazione(db_connection)
+            else:
+                cursor = db_connection.cursor(dictionary=True)
+                cursor.execute(window_query)
+                rows = cursor.fetchall()
+                cursor.close()
+            durations.append(time.time() - start)
+        results[mode] = min(durations)
+        intervals = {row['account_username']: round(float(row['intervallo_medio_secondi']), 3) for row in rows}
+        if mode == 'window over the posts':
+            expected = intervals
+        elif intervals != expected:
+            logging.warning("The posting statistics differ from the window query: rebuild them with PostingStats.rebuild_posting_stats.")
+    for mode, seconds in results.items():
+        logging.info(f"Posting intervals, {mode}: {round(seconds, 4)} seconds")
+    return results
+
+def query_plan(db_connection, query, params):
+    """
+    Returns the plan of a query: one (table, access type, index, estimated rows, extra) tuple for each step of EXPLAIN.
+    """
+    cursor = db_connection.cursor(dictionary=True)
+    cursor.execute("EXPLAIN " + query, params)
+    plan = [(row['table'], row['type'], row['key'], row['rows'], row['Extra']) for row in cursor.fetchall()]
+    cursor.close()
+    return plan
+
+def benchmark_query_plans(db_connection, repeat=3):
+    """
+    Shows the plan and the duration of the hot queries before and after the indexes of the schema
+    (Schema.HOT_PATH_INDEXES): "before" runs the same query with IGNORE INDEX on them.
+
+    Parameters:
+    - db_connection (MySQL Connection): The connection object to interact with the MySQL database.
+    - repeat (int): Runs of each query; the fastest one is kept.
+
+    Returns:
+    - dict: For each query, the plan and the duration in seconds before and after the indexes.
+    """
+    migrate(db_connection)
+    hints = {}
+    for table in ('posts', 'users'):
+        names = [name for index_table, name, columns in HOT_PATH_INDEXES if index_table == table]
+        hints[table] = f"IGNORE INDEX ({', '.join(names)})"
+
+    # A real account for the queries of a single user
+    cursor = db_connection.cursor(dictionary=True)
+    cursor.execute("SELECT account_username AS username, account_id FROM posts LIMIT 1")
+    sample = cursor.fetchone()
+    cursor.close()
+    if sample is None:
+        logging.warning("No posts in the database, nothing to measure.")
+        return {}
+    # The last user of the first keyset page, the cursor of the next one
+    sample.update({'min_statuses': 200, 'batch_size': 100, 'last_statuses': 0, 'last_user_id': ''})
+    cursor = db_connection.cursor(dictionary=True)
+    cursor.execute("SELECT statuses AS last_statuses, user_id AS last_user_id FROM users WHERE statuses > 200 "
+                   "ORDER BY statuses DESC, user_id DESC LIMIT 1 OFFSET 99")
+    sample.update(cursor.fetchone() or {})
+    cursor.close()
+
+    results = {}
+    for name, (template, param_names) in PLAN_QUERIES.items():
+        params = tuple(sample[param] for param in param_names)
+        results[name] = {}
+        for mode in ('before', 'after'):
+            query = template.format(posts_hint=hints['posts'] if mode == 'before' else '',
+                                    users_hint=hints['users'] if mode == 'before' else '')
+            plan = query_plan(db_connection, query, params)
+            durations = []
+            for _ in range(repeat):
+                cursor = db_connection.cursor()
+                start = time.time()
+                cursor.execute(query, params)
+                cursor.fetchall()
+                durations.append(time.time() - start)
+                cursor.close()
+            results[name][mode] = {'plan': plan, 'seconds': min(durations)}
+            logging.info(f"{name}, {mode} the indexes: {round(min(durations), 4)} seconds")
+            for table, access, key, rows, extra in plan:
+                logging.info(f"    {table}: {access}, index {key}, ~{rows} rows, {extra}")
+    return results
+
+def fetch_public_contents(pages=10):
+    """
+    Downloads the HTML of real posts and account notes from the public timeline of the instance.
+
+    Parameters:
+    - pages (int): The number of timeline pages (40 posts each) to download.
+
+    Returns:
+    - list: The HTML strings, empty if the instance cannot be reached.
+    """
+    contents = []
+    params = {'limit': 40}
+    for _ in range(pages):
+        try:
+            response = requests.get(f"{instance_url}/api/v1/timelines/public", params=params, timeout=15)
+            response.raise_for_status()
+        except requests.exceptions.RequestException as e:
+            logging.warning(f"Cannot download the public timeline: {e}")
+            break
+        posts = response.json()
+        if not posts:
+            break
+        for post in posts:
+            contents.append(post.get('content', ''))
+            contents.append(post.get('account', {}).get('note', ''))
+        params['max_id'] = posts[-1]['id']
+    return contents
+
+def benchmark_format_content(contents, repeat=5):
+    """
+    Compares the regular expression `format_content` with the BeautifulSoup one: the text must be
+    identical for every content, then the duration of both is measured on the whole corpus.
+
+    Parameters:
+    - contents (list): The HTML strings, e.g. from `fetch_public_contents`.
+    - repeat (int): How many times the corpus is processed by each version.
+
+    Returns:
+    - dict: The number of contents processed per second by each version.
+    """
+    different = [content for content in contents if format_content(content) != format_content_bs(content)]
+    if different:
+        logging.warning(f"format_content differs from BeautifulSoup on {len(different)} of {len(contents)} contents.")
+
+    results = {}
+    for name, function in (('BeautifulSoup', format_content_bs), ('regular expression', format_content)):
+        start = time.time()
+        for _ in range(repeat):
+            for content in contents:
+                function(content)
+        results[name] = repeat * len(contents) / (time.time() - start)
+
+    for name, per_sec in results.items():
+        logging.info(f"format_content, {name}: {round(per_sec)} contents/sec")
+    logging.info(f"Speedup: {round(results['regular expression'] / results['BeautifulSoup'], 1)}x on {len(contents)} contents")
+    return results
+
+# Configurations of `benchmark_pipelines`: the pipeline, its options and the settings of the fake instance.
+PIPELINE_CONFIGURATIONS = [
+    {'name': 'timeline, sync', 'pipeline': 'timeline', 'settings': {}},
+    {'name': 'workers, direct, concurrency 10', 'pipeline': 'workers', 'proxies': 0, 'concurrency': 10, 'settings': {}},
+    {'name': 'workers, 4 proxies, concurrency 20', 'pipeline': 'workers', 'proxies': 4, 'concurrency': 20, 'settings': {}},
+    {'name': 'workers, 4 proxies, concurrency 20, faults', 'pipeline': 'workers', 'proxies': 4, 'concurrency': 20,
+     'settings': {'error_429': 0.02, 'error_503': 0.02, 'error_timeout': 0.01, 'timeout_delay': 16}},
+]
+
+def clean_fake_rows(db_connection):
+    """
+    Deletes the rows written from the fake instance.
+    """
+    cursor = db_connection.cursor()
+    cursor.execute("DELETE FROM posts WHERE account_username LIKE %s", ("fake\\_user\\_%",))
+    cursor.execute("DELETE FROM posting_stats WHERE account_username LIKE %s", ("fake\\_user\\_%",))
+    cursor.execute("DELETE FROM users WHERE username LIKE %s", ("fake\\_user\\_%",))
+    db_connection.commit()
+    cursor.close()
+
+def latency_percentiles(latencies):
+    """
+    Returns the p50, p95 and p99 of a list of latencies, in seconds.
+    """
+    if not latencies:
+        return {'p50': 0, 'p95': 0, 'p99': 0}
+    if len(latencies) == 1:
+        latencies = latencies * 2
+    cuts = quantiles(latencies, n=100, method='inclusive')
+    return {'p50': round(cuts[49], 3), 'p95': round(cuts[94], 3), 'p99': round(cuts[98], 3)}
+
+async def run_workers(users, configuration, port):
+    # The users are queried through the fake proxies (or directly), writing their posts with the async writers.
+    db_pool = await create_pool(maxsize=configuration['concurrency'] + 1)
+    proxy_list = [f"http://localhost:{port + i}" for i in range(1, configuration['proxies'] + 1)]
+    try:
+        return await async_worker_pool(users, db_pool, proxy_list, configuration['concurrency'],
+                                       statuses_url=f"http://localhost:{port}/api/v1/accounts/{{user_id}}/statuses")
+    finally:
+        db_pool.close()
+        await db_pool.wait_closed()
+
+def benchmark_pipelines(db_connection, configurations=PIPELINE_CONFIGURATIONS, port=8950, n_users=200, timeline_length=4000,
+                        rate_limit=300, rate_window=10):
+    """
+    Measures the fetch pipelines end to end against the local fake instance (`fake_mastodon.py`),
+    including parsing and the database writers: requests/sec, posts/sec ingested and tail latency.
+
+    Parameters:
+    - db_connection (MySQL Connection): The connection object to interact with the MySQL database.
+    - configurations (list): The configurations to measure, see `PIPELINE_CONFIGURATIONS`.
+    - port (int): The port of the fake instance; the fake proxies use the following ones.
+    - n_users (int): The users queried by the worker pipelines (up to `fake_mastodon.N_ACCOUNTS`).
+    - timeline_length (int): The posts of the timeline read by the timeline pipeline.
+    - rate_limit (int): Requests per window allowed on each port of the fake instance.
+    - rate_window (int): Seconds of each rate-limit window, shorter than the real 300 to keep the benchmark short.
+
+    Returns:
+    - dict: For each configuration, requests/sec, posts/sec, p50/p95/p99 latency (of a request for the timeline,
+      of a whole user for the workers) and the responses by status.
+    """
+    max_proxies = max(configuration.get('proxies', 0) for configuration in configurations)
+    servers = fake_mastodon.start(port, max_proxies)
+    users = [parse_user(fake_mastodon.fake_account(n)) for n in range(n_users)]
+    results = {}
+    try:
+        for configuration in configurations:
+            clean_fake_rows(db_connection)
+            settings = {'timeline_length': timeline_length, 'rate_limit': rate_limit, 'rate_window': rate_window,
+                        'error_429': 0.0, 'error_503': 0.0, 'error_timeout': 0.0}
+            settings.update(configuration['settings'])
+            fake_mastodon.configure(**settings)
+
+            start = time.time()
+            if configuration['pipeline'] == 'timeline':
+                url = f"http://localhost:{port}/api/v1/timelines/tag/benchmark"
+                _, latencies = get_timeline_posts(url, {}, {}, db_connection, resume=False)
+            else:
+                latencies = asyncio.run(run_workers(users, configuration, port))
+            elapsed = time.time() - start
+
+            stats = fake_mastodon.FakeMastodonHandler.stats
+            results[configuration['name']] = {
+                'requests/sec': round(stats['requests'] / elapsed, 1),
+                'posts/sec': round(stats['posts'] / elapsed, 1),
+                **latency_percentiles(latencies),
+                'statuses': dict(stats['statuses']),
+            }
+            logging.info(f"Pipeline {configuration['name']}: {results[configuration['name']]}")
+    finally:
+        fake_mastodon.stop(servers)
+        clean_fake_rows(db_connection)
+    return results
+
+if __name__ == "__main__":
+    benchmark_format_content(fetch_public_contents())
+    db_connection = connect_to_db()
+    if not db_connection:
+        logging.error("Database connection failed. Exiting...")
+        sys.exit(1)
+    saved_profile = save_bot_profile(db_connection)  # The synthetic bots must not stay in the profile used by find_bot.
+    try:
+        benchmark_ingest(db_connection)
+        benchmark_find_bot(db_connection)
+        benchmark_scoring(db_connection)
+        benchmark_pipelines(db_connection)
+        benchmark_query_plans(db_connection)
+        benchmark_posting_stats(db_connection)
+    finally:
+        restore_bot_profile(db_connection, saved_profile)
+        db_connection.close()
@@ -3,7 +3,10 @@ endpoint_url = "ENDPOINT_URL"
 client_key = 'CLIENT_KEY'
 client_secret = 'CLIENT SECRET'
 instance_url = "INSTANCE_URL"
+# (instance, token) pairs of the accounts used by the crawls; add more tokens to share the rate limit
+access_tokens = [(instance_url, access_token)]
 #for MySql
+host = 'HOST'
 user = 'USER'
 password = 'DB_PASSWORD'
 database = 'NAME_DATABASE'
\ No newline at end of file
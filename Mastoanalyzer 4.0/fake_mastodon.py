@@ -0,0 +1,319 @@
+# Local stand-in for a Mastodon instance, used to test the collectors without the real server
+import argparse
+import json
+import random
+import time
+import threading
+from datetime import datetime, timezone, timedelta
+from email.utils import formatdate
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit, parse_qs
+
+FAKE_ID = 110000000000000000  # Synthetic IDs start here
+N_ACCOUNTS = 500  # Accounts the synthetic posts are spread over
+TIMELINE_TOP_ID = 112000000000000000  # ID of the newest post of the timelines, the older ones count down from it
+ACCOUNT_POST_ID = 113000000000000000  # Post k of account n has ID ACCOUNT_POST_ID + n * ACCOUNT_POST_SPAN + k
+ACCOUNT_POST_SPAN = 1000000
+EPOCH = datetime(2024, 1, 1, tzinfo=timezone.utc)  # Date of the oldest synthetic post
+
+_next_id = FAKE_ID
+_id_lock = threading.Lock()
+
+def new_id():
+    """
+    Returns a new, increasing, synthetic post ID (as a string, like the Mastodon ones).
+    """
+    global _next_id
+    with _id_lock:
+        _next_id += 1
+        return str(_next_id)
+
+def fake_account(account_number):
+    """
+    Builds a synthetic account, in the format of the Mastodon API.
+    """
+    return {
+        'id': str(FAKE_ID + account_number),
+        'username': f"fake_user_{account_number}",
+        'display_name': f"Fake user {account_number}",
+        'bot': account_number % 10 == 0,
+        'url': f"http://localhost/@fake_user_{account_number}",
+        'followers_count': (account_number * 37) % 5000,
+        'following_count': (account_number * 13) % 800,
+        'statuses_count': 200 + (account_number * 101) % 20000,
+        'note': f"<p>Fake account number {account_number}. More at <a href=\"https://example.org\">example.org</a></p>",
+    }
+
+def fake_status(post_id, tag, account_number=None, created_at=None, filler=0):
+    """
+    Builds a synthetic status, in the format of the Mastodon API.
+    `filler` adds that many characters of text to the content, to control the payload size.
+    """
+    if account_number is None:
+        account_number = random.randrange(N_ACCOUNTS)
+    if created_at is None:
+        created_at = datetime.now(timezone.utc)
+    return {
+        'id': post_id,
+        'created_at': created_at.strftime("%Y-%m-%dT%H:%M:%S.") + f"{created_at.microsecond // 1000:03d}Z",
+        'in_reply_to_id': None,
+        'in_reply_to_account_id': None,
+        'sensitive': False,
+        'spoiler_text': '',
+        'visibility': 'public',
+        'language': 'en',
+        'uri': f"http://localhost/statuses/{post_id}",
+        'url': f"http://localhost/@fake_user_{account_number}/{post_id}",
+        'replies_count': random.randrange(5),
+        'reblogs_count': random.randrange(10),
+        'favourites_count': random.randrange(20),
+        'favourited': False,
+        'reblogged': False,
+        'muted': False,
+        'bookmarked': False,
+        'pinned': False,
+        'content': f"<p>Synthetic post {post_id} about <a href=\"http://localhost/tags/{tag}\" class=\"mention hashtag\">#<span>{tag}</span></a></p>"
+                   + (f"<p>{('lorem ipsum ' * (filler // 12 + 1))[:filler]}</p>" if filler else ''),
+        'media_attachments': [],
+        'account': fake_account(account_number),
+        'reblog': None,
+    }
+
+def timeline_page(tag, max_id=None, min_id=None, limit=40, length=10000, filler=0):
+    """
+    Returns a page of a synthetic timeline of `length` posts, newest first, paginated like Mastodon.
+    """
+    first = 0 if max_id is None else max(TIMELINE_TOP_ID - int(max_id) + 1, 0)  # Index 0 is the newest post.
+    last = length if min_id is None else min(TIMELINE_TOP_ID - int(min_id), length)
+    if min_id is None:
+        last = min(first + limit, last)
+    else:
+        first = max(first, last - limit)  # The posts right after min_id, still newest first.
+    return [
+        fake_status(str(TIMELINE_TOP_ID - i), tag, i % N_ACCOUNTS, EPOCH + timedelta(minutes=length - i), filler)
+        for i in range(first, last)
+    ]
+
+def account_page(account_number, max_id=None, min_id=None, limit=40, filler=0):
+    """
+    Returns a page of the statuses of a synthetic account, newest first, paginated like Mastodon.
+    The account has exactly as many statuses as its 'statuses_count'.
+    """
+    base = ACCOUNT_POST_ID + account_number * ACCOUNT_POST_SPAN
+    statuses = fake_account(account_number)['statuses_count']
+    newest = statuses  # Number (1 = oldest) of the newest post of the page.
+    if max_id is not None:
+        newest = min(newest, int(max_id) - base - 1)
+    oldest = max(newest - limit + 1, 1)
+    if min_id is not None:
+        # The posts right after min_id, still newest first.
+        oldest = max(int(min_id) - base + 1, 1)
+        newest = min(oldest + limit - 1, newest)
+    # One post every 90 minutes, every 60 for the bot accounts.
+    step = 60 if account_number % 10 == 0 else 90
+    return [
+        fake_status(str(base + k), 'fake', account_number, EPOCH + timedelta(minutes=step * k), filler)
+        for k in range(newest, oldest - 1, -1)
+    ]
+
+class FakeMastodonHandler(BaseHTTPRequestHandler):
+    """
+    Serves the endpoints of the fake instance. The settings are class attributes, set by `configure`.
+
+    Every port (the instance and each fake proxy) has its own rate-limit bucket, like the per-IP limit
+    of the real instance. A fake proxy receives the absolute URI of the request ("GET http://... HTTP/1.1")
+    and answers it itself, so only plain-http URLs can go through it.
+    """
+    protocol_version = 'HTTP/1.1'
+    events_per_second = 20  # Statuses sent by each hashtag stream
+    events_per_connection = 500  # The stream is closed after this many events, to exercise reconnection
+    latency = 0.05  # Seconds added to every response
+    jitter = 0.05  # Random extra seconds, up to this value
+    timeline_length = 10000  # Posts of each timeline
+    filler = 500  # Characters of text added to each post, to control the payload size
+    rate_limit = 300  # Requests per window for each port
+    rate_window = 300  # Seconds of each rate-limit window
+    error_429 = 0.0  # Share of requests answered with an unexpected 429
+    error_503 = 0.0  # Share of requests answered with 503
+    error_timeout = 0.0  # Share of requests answered only after `timeout_delay` seconds
+    timeout_delay = 20
+
+    buckets = {}  # Port -> [start of the window, requests in the window]
+    stats = {'requests': 0, 'posts': 0, 'statuses': {}}
+    lock = threading.Lock()
+
+    def log_message(self, format, *args):
+        pass  # Keep the console quiet
+
+    def do_GET(self):
+        parts = urlsplit(self.path)  # Also works for the absolute URIs received by the fake proxies.
+        query = parse_qs(parts.query)
+        path = parts.path.rstrip('/').split('/')
+        if parts.path == '/api/v1/streaming/hashtag':
+            self.stream_hashtag(query.get('tag', ['fake'])[0])
+            return
+
+        headers = self.rate_limit_headers()
+        if headers is None:
+            self.send_json(429, {'error': 'Too many requests'}, self.rate_limit_headers(count=False))
+            return
+        roll = random.random()
+        if roll < self.error_429:
+            self.send_json(429, {'error': 'Too many requests'}, headers)
+            return
+        if roll < self.error_429 + self.error_503:
+            self.send_json(503, {'error': 'Service unavailable'}, headers)
+            return
+        if roll < self.error_429 + self.error_503 + self.error_timeout:
+            time.sleep(self.timeout_delay)
+        time.sleep(self.latency + random.uniform(0, self.jitter))
+
+        limit = min(int(query.get('limit', ['40'])[0]), 40)
+        max_id = query.get('max_id', [None])[0]
+        min_id = query.get('min_id', query.get('since_id', [None]))[0]
+        if path[:4] == ['', 'api', 'v1', 'timelines'] and len(path) in (5, 6):
+            tag = path[5] if len(path) == 6 else 'public'
+            posts = timeline_page(tag, max_id, min_id, limit, self.timeline_length, self.filler)
+        elif path[:4] == ['', 'api', 'v1', 'accounts'] and len(path) == 6 and path[5] == 'statuses':
+            account_number = int(path[4]) - FAKE_ID if path[4].isdigit() else -1
+            if not 0 <= account_number < N_ACCOUNTS:
+                self.send_json(404, {'error': 'Record not found'}, headers)
+                return
+            posts = account_page(account_number, max_id, min_id, limit, self.filler)
+        else:
+            self.send_json(404, {'error': 'Record not found'}, headers)
+            return
+        with self.lock:
+            self.stats['posts'] += len(posts)
+        self.send_json(200, posts, headers)
+
+    def rate_limit_headers(self, count=True):
+        """
+        Counts the request in the bucket of this port and returns the rate-limit headers,
+        or None if the bucket is exhausted.
+        """
+        port = self.server.server_address[1]
+        now = time.time()
+        with self.lock:
+            bucket = self.buckets.setdefault(port, [now, 0])
+            if now - bucket[0] >= self.rate_window:
+                bucket[0], bucket[1] = now, 0
+            exhausted = bucket[1] >= self.rate_limit
+            if count and not exhausted:
+                bucket[1] += 1
+            reset = datetime.fromtimestamp(bucket[0] + self.rate_window, timezone.utc)
+            headers = {
+                'Date': formatdate(now, usegmt=True),
+                'X-RateLimit-Limit': str(self.rate_limit),
+                'X-RateLimit-Remaining': str(self.rate_limit - bucket[1]),
+                'X-RateLimit-Reset': reset.strftime("%Y-%m-%dT%H:%M:%S.") + f"{reset.microsecond // 1000:03d}Z",
+            }
+        if count and exhausted:
+            return None
+        return headers
+
+    def send_json(self, status, body, headers=None):
+        with self.lock:
+            self.stats['requests'] += 1
+            self.stats['statuses'][status] = self.stats['statuses'].get(status, 0) + 1
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def stream_hashtag(self, tag):
+        """
+        Server-Sent Events stream of synthetic statuses, with a heartbeat every few events.
+        """
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Cache-Control', 'no-cache')
+        self.send_header('Connection', 'close')
+        self.end_headers()
+        try:
+            for i in range(self.events_per_connection):
+                if i % 10 == 0:
+                    self.wfile.write(b":thump\n\n")
+                status = fake_status(new_id(), tag)
+                self.wfile.write(f"event: update\ndata: {json.dumps(status)}\n\n".encode())
+                self.wfile.flush()
+                time.sleep(1 / self.events_per_second)
+        except (BrokenPipeError, ConnectionResetError):
+            pass  # The client went away
+        self.close_connection = True
+
+def configure(**settings):
+    """
+    Changes the settings of the fake instance (see the class attributes of `FakeMastodonHandler`)
+    and resets its rate-limit buckets and counters.
+    """
+    for name, value in settings.items():
+        if not hasattr(FakeMastodonHandler, name):
+            raise ValueError(f"Unknown setting: {name}")
+        setattr(FakeMastodonHandler, name, value)
+    with FakeMastodonHandler.lock:
+        FakeMastodonHandler.buckets.clear()
+        FakeMastodonHandler.stats.update(requests=0, posts=0, statuses={})
+
+def start(port=8900, proxies=0):
+    """
+    Starts the fake instance on localhost:`port`, and `proxies` fake proxies on the following ports,
+    in background threads.
+
+    Returns:
+    - list: The servers; stop them with `stop`.
+    """
+    servers = []
+    for server_port in range(port, port + proxies + 1):
+        server = ThreadingHTTPServer(('localhost', server_port), FakeMastodonHandler)
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+    return servers
+
+def stop(servers):
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+def serve(port=8900, proxies=0, **settings):
+    """
+    Starts the fake instance on localhost:`port` and serves until interrupted.
+    The collectors can use it as instance, e.g. streaming_url="http://localhost:8900/api/v1/streaming",
+    and the fake proxies as proxy list, e.g. ["http://localhost:8901", "http://localhost:8902"].
+    """
+    configure(**settings)
+    servers = start(port, proxies)
+    print(f"Fake Mastodon instance on http://localhost:{port}")
+    if proxies:
+        print(f"Fake proxies on ports {port + 1}-{port + proxies}")
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        stop(servers)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local fake Mastodon instance")
+    parser.add_argument('--port', type=int, default=8900)
+    parser.add_argument('--events-per-second', type=float, default=20)
+    parser.add_argument('--events-per-connection', type=int, default=500)
+    parser.add_argument('--proxies', type=int, default=0, help="Fake proxies on the following ports")
+    parser.add_argument('--latency', type=float, default=0.05)
+    parser.add_argument('--jitter', type=float, default=0.05)
+    parser.add_argument('--filler', type=int, default=500, help="Characters of text added to each post")
+    parser.add_argument('--rate-limit', type=int, default=300)
+    parser.add_argument('--rate-window', type=int, default=300)
+    parser.add_argument('--error-429', type=float, default=0.0)
+    parser.add_argument('--error-503', type=float, default=0.0)
+    parser.add_argument('--error-timeout', type=float, default=0.0)
+    args = parser.parse_args()
+    serve(args.port, args.proxies, events_per_second=args.events_per_second, events_per_connection=args.events_per_connection,
+          latency=args.latency, jitter=args.jitter, filler=args.filler, rate_limit=args.rate_limit, rate_window=args.rate_window,
+          error_429=args.error_429, error_503=args.error_503, error_timeout=args.error_timeout)
@@ -2,7 +2,9 @@
 import matplotlib.pyplot as plt
 import seaborn as sns
 from statistics import median, mean
-from MySQL import get_user, get_user_posts, get_utenti_pubblicazione, get_bot_pubblicazione, get_all_user
+from collections import Counter
+from MySQL import iter_user, iter_user_posts, get_utenti_pubblicazione, get_bot_pubblicazione, iter_all_user
+from Export import read_users
 import numpy as np
 from sklearn.linear_model import LinearRegression
 
@@ -33,6 +35,38 @@ def plot_metric_comparison(user_data, bot_data, metric_name, ax, user_color, bot
     ax.legend(fontsize=14)  # Legend
     ax.grid(True)  # Grid in the chart
 
+def counter_median(counts):
+    """
+    Exact median of the values counted in a Counter (value -> occurrences), same result as `statistics.median`.
+    """
+    n = sum(counts.values())
+    if n == 0:
+        raise ValueError("no median for empty data")
+    middle = [(n - 1) // 2, n // 2]  # Positions of the middle values in the sorted data.
+    found = []
+    seen = 0
+    for value in sorted(counts):
+        seen += counts[value]
+        while middle and middle[0] < seen:
+            found.append(value)
+            middle.pop(0)
+        if not middle:
+            break
+    return found[0] if n % 2 else (found[0] + found[1]) / 2
+
+def counter_mean(counts):
+    """
+    Exact mean of the values counted in a Counter (value -> occurrences).
+    """
+    return sum(value * count for value, count in counts.items()) / sum(counts.values())
+
+def counter_values(counts):
+    """
+    Expands a Counter into a NumPy array of its values, for the histograms.
+    """
+    values = np.fromiter(counts.keys(), dtype=float, count=len(counts))
+    return np.repeat(values, np.fromiter(counts.values(), dtype=np.int64, count=len(counts)))
+
 def main_graphix_user(db_connection): 
     """
     This function generates graphs comparing various user statistics (e.g., username length, followers) 
@@ -40,64 +74,61 @@ def main_graphix_user(db_connection):
     """
     print("Running main_graphix...")  
 
-    # Retrieve all users
-    all_users = get_user(db_connection)
+    # Distributions of every metric, one Counter for users (index 0) and one for bots (index 1):
+    # the users are streamed from the database, so memory depends on the distinct values only.
+    metrics = ['username', 'followers', 'following', 'statuses', 'description']
+    counts = {metric: (Counter(), Counter()) for metric in metrics}
+    columns = ['bot', 'username', 'followers', 'following', 'statuses', 'description']
+    for batch in iter_user(db_connection, columns=columns):
+        for bot, username, followers, following, statuses, description in batch:
+            if bot not in (0, 1):
+                continue
+            counts['username'][bot][len(username)] += 1
+            counts['followers'][bot][followers] += 1
+            counts['following'][bot][following] += 1
+            counts['statuses'][bot][statuses] += 1
+            counts['description'][bot][len(description)] += 1
 
     # If the database is empty
-    if not all_users:
+    if not counts['username'][0] and not counts['username'][1]:
         print("None data")
         return
 
-    # Lists to store data for graphs
-    usernameUser, usernameBot = [], []
-    followersUser, followersBot = [], []
-    followingUser, followingBot = [], []
-    statusesUser, statusesBot = [], []
-    descriptionUser, descriptionBot = [], [] 
-    
-    for user in all_users:
-        if user['bot'] == 0:  # Real user
-            usernameUser.append(len(user['username']))
-            followersUser.append(user['followers'])
-            followingUser.append(user['following'])
-            statusesUser.append(user['statuses'])
-            descriptionUser.append(len(user['description']))  
-        elif user['bot'] == 1:  # Bot
-            usernameBot.append(len(user['username']))
-            followersBot.append(user['followers'])
-            followingBot.append(user['following'])
-            statusesBot.append(user['statuses'])
-            descriptionBot.append(len(user['description']))  # Added description length for bots
+    usernameUser, usernameBot = counts['username']
+    followersUser, followersBot = counts['followers']
+    followingUser, followingBot = counts['following']
+    statusesUser, statusesBot = counts['statuses']
+    descriptionUser, descriptionBot = counts['description']
 
     # Calculate median and mean for each parameter
-    median_len_user, median_len_bot = median(usernameUser), median(usernameBot)
-    mean_len_user, mean_len_bot = mean(usernameUser), mean(usernameBot)
+    median_len_user, median_len_bot = counter_median(usernameUser), counter_median(usernameBot)
+    mean_len_user, mean_len_bot = counter_mean(usernameUser), counter_mean(usernameBot)
 
-    median_followers_user, median_followers_bot = median(followersUser), median(followersBot)
-    mean_followers_user, mean_followers_bot = mean(followersUser), mean(followersBot)
+    median_followers_user, median_followers_bot = counter_median(followersUser), counter_median(followersBot)
+    mean_followers_user, mean_followers_bot = counter_mean(followersUser), counter_mean(followersBot)
 
-    median_following_user, median_following_bot = median(followingUser), median(followingBot)
-    mean_following_user, mean_following_bot = mean(followingUser), mean(followingBot)
+    median_following_user, median_following_bot = counter_median(followingUser), counter_median(followingBot)
+    mean_following_user, mean_following_bot = counter_mean(followingUser), counter_mean(followingBot)
 
-    median_statuses_user, median_statuses_bot = median(statusesUser), median(statusesBot)
-    mean_statuses_user, mean_statuses_bot = mean(statusesUser), mean(statusesBot)
+    median_statuses_user, median_statuses_bot = counter_median(statusesUser), counter_median(statusesBot)
+    mean_statuses_user, mean_statuses_bot = counter_mean(statusesUser), counter_mean(statusesBot)
 
-    median_description_user, median_description_bot = median(descriptionUser), median(descriptionBot)
-    mean_description_user, mean_description_bot = mean(descriptionUser), mean(descriptionBot)
+    median_description_user, median_description_bot = counter_median(descriptionUser), counter_median(descriptionBot)
+    mean_description_user, mean_description_bot = counter_mean(descriptionUser), counter_mean(descriptionBot)
 
     # Subplot, i.e., 5 graphs (5 rows and 1 column) with size 10x25
     fig, axes = plt.subplots(1, 1, figsize=(10, 25))  # Added the fifth graph
     user_color = '#1f77b4'  
     bot_color = '#ff7f0e'
     
-    stampa_cose(usernameUser, usernameBot, followersUser, followersBot, followingUser, followingBot, statusesUser, statusesBot, descriptionUser, descriptionBot)
+    stampa_cose(counts)
     
     # Generate the plots, one at a time. To plot multiple graphs, change the number in line 81 to (x, 1)
-    plot_metric_comparison(usernameUser, usernameBot, "Username length", axes, user_color, bot_color,'Users', "Length", median_len_user, median_len_bot, mean_len_user, mean_len_bot)
-    #plot_metric_comparison(followersUser, followersBot, "Number of Followers", axes, user_color, bot_color, 'Users',"Followers", median_followers_user, median_followers_bot, mean_followers_user, mean_followers_bot)
-    #plot_metric_comparison(followingUser, followingBot, "Number of Following", axes, user_color, bot_color, 'Users', "Following", median_following_user, median_following_bot, mean_following_user, mean_following_bot)
-    #plot_metric_comparison(statusesUser, statusesBot, "Number of Statuses", axes, user_color, bot_color, 'Users',"Statuses", median_statuses_user, median_statuses_bot, mean_statuses_user, mean_statuses_bot)
-    #plot_metric_comparison(descriptionUser, descriptionBot, "Description Length", axes, user_color, bot_color, 'Users',"Description Length", median_description_user, median_description_bot, mean_description_user, mean_description_bot)
+    plot_metric_comparison(counter_values(usernameUser), counter_values(usernameBot), "Username length", axes, user_color, bot_color,'Users', "Length", median_len_user, median_len_bot, mean_len_user, mean_len_bot)
+    #plot_metric_comparison(counter_values(followersUser), counter_values(followersBot), "Number of Followers", axes, user_color, bot_color, 'Users',"Followers", median_followers_user, median_followers_bot, mean_followers_user, mean_followers_bot)
+    #plot_metric_comparison(counter_values(followingUser), counter_values(followingBot), "Number of Following", axes, user_color, bot_color, 'Users', "Following", median_following_user, median_following_bot, mean_following_user, mean_following_bot)
+    #plot_metric_comparison(counter_values(statusesUser), counter_values(statusesBot), "Number of Statuses", axes, user_color, bot_color, 'Users',"Statuses", median_statuses_user, median_statuses_bot, mean_statuses_user, mean_statuses_bot)
+    #plot_metric_comparison(counter_values(descriptionUser), counter_values(descriptionBot), "Description Length", axes, user_color, bot_color, 'Users',"Description Length", median_description_user, median_description_bot, mean_description_user, mean_description_bot)
 
     plt.xticks(fontsize=12)  
     plt.yticks(fontsize=12) 
@@ -112,19 +143,9 @@ def main_graphix_post(db_connection):
     """
     print("Running main_graphix...")  
 
-    # Retrieve all posts
-    all_posts = get_user_posts(db_connection)
-
-    # If the database is empty
-    if not all_posts:
-        print("None")
-        return
-
     timePubUser, timePubBot = [], []
-    replyUser, replyBot = [], []
-    reblogUser, reblogBot = [], []
-    favCountUser, favCountBot = [], []
     
+    # The interval queries run before the posts are streamed: an unbuffered cursor keeps the connection busy until it is exhausted.
     timePubUserQuery = get_utenti_pubblicazione(db_connection)
     timePubBotQuery = get_bot_pubblicazione(db_connection)
 
@@ -134,27 +155,36 @@ def main_graphix_post(db_connection):
     for x in timePubBotQuery:
         timePubBot.append(x['intervallo_medio_secondi'])
 
-    for post in all_posts:
-        if post['bot'] == 0:
-            replyUser.append(post['replies_count'])
-            reblogUser.append(post['reblogs_count'])
-            favCountUser.append(post['favourites_count'])
-        elif post['bot'] == 1:
-            replyBot.append(post['replies_count'])
-            reblogBot.append(post['reblogs_count'])
-            favCountBot.append(post['favourites_count'])
-    
+    # Distributions of the post counters, one Counter for users (index 0) and one for bots (index 1)
+    replyCounts, reblogCounts, favCounts = (Counter(), Counter()), (Counter(), Counter()), (Counter(), Counter())
+    for batch in iter_user_posts(db_connection, columns=['bot', 'replies_count', 'reblogs_count', 'favourites_count']):
+        for bot, replies, reblogs, favourites in batch:
+            if bot not in (0, 1):
+                continue
+            replyCounts[bot][replies] += 1
+            reblogCounts[bot][reblogs] += 1
+            favCounts[bot][favourites] += 1
+
+    # If the database is empty
+    if not replyCounts[0] and not replyCounts[1]:
+        print("None")
+        return
+
+    replyUser, replyBot = replyCounts
+    reblogUser, reblogBot = reblogCounts
+    favCountUser, favCountBot = favCounts
+
     median_timePubUser, median_timePubBot = median(timePubUser), median(timePubBot)
     mean_timePubUser, mean_timePubBot = mean(timePubUser), mean(timePubBot)
 
-    median_replyUser, median_replyBot = median(replyUser), median(replyBot)
-    mean_replyUser, mean_replyBot = mean(replyUser), mean(replyBot)
+    median_replyUser, median_replyBot = counter_median(replyUser), counter_median(replyBot)
+    mean_replyUser, mean_replyBot = counter_mean(replyUser), counter_mean(replyBot)
 
-    median_reblogUser, median_reblogBot = median(reblogUser), median(reblogBot)
-    mean_reblogUser, mean_reblogBot = mean(reblogUser), mean(reblogBot)
+    median_reblogUser, median_reblogBot = counter_median(reblogUser), counter_median(reblogBot)
+    mean_reblogUser, mean_reblogBot = counter_mean(reblogUser), counter_mean(reblogBot)
     
-    median_favCountUser, median_favCountBot = median(favCountUser), median(favCountBot)
-    mean_favCountUser, mean_favCountBot = mean(favCountUser), mean(favCountBot)
+    median_favCountUser, median_favCountBot = counter_median(favCountUser), counter_median(favCountBot)
+    mean_favCountUser, mean_favCountBot = counter_mean(favCountUser), counter_mean(favCountBot)
 
     # Subplot, i.e., 4 graphs (4 rows and 1 column) with size 10x25
     fig, axes = plt.subplots(1, 1, figsize=(10, 25))  # Added the fifth graph
@@ -163,9 +193,9 @@ def main_graphix_post(db_connection):
 
     # Generate the plots, one at a time. To plot multiple graphs, change the number in line 150 to (x)
     plot_metric_comparison(timePubUser, timePubBot, "Posting Interval", axes, user_color, bot_color, "Users", "Seconds", median_timePubUser, median_timePubBot, mean_timePubUser, mean_timePubBot)
-    #plot_metric_comparison(replyUser, replyBot, "Replies Count", axes[1], user_color, bot_color, "Replies", median_replyUser, median_replyBot, mean_replyUser, mean_replyBot)
-    #plot_metric_comparison(reblogUser, reblogBot, "Reblogs Count", axes[2], user_color, bot_color, "Reblogs", median_reblogUser, median_reblogBot, mean_reblogUser, mean_reblogBot)
-    #plot_metric_comparison(favCountUser, favCountBot, "Favorites Count", axes[3], user_color, bot_color, "Favorites", median_favCountUser, median_favCountBot, mean_favCountUser, mean_favCountBot)
+    #plot_metric_comparison(counter_values(replyUser), counter_values(replyBot), "Replies Count", axes[1], user_color, bot_color, "Replies", median_replyUser, median_replyBot, mean_replyUser, mean_replyBot)
+    #plot_metric_comparison(counter_values(reblogUser), counter_values(reblogBot), "Reblogs Count", axes[2], user_color, bot_color, "Reblogs", median_reblogUser, median_reblogBot, mean_reblogUser, mean_reblogBot)
+    #plot_metric_comparison(counter_values(favCountUser), counter_values(favCountBot), "Favorites Count", axes[3], user_color, bot_color, "Favorites", median_favCountUser, median_favCountBot, mean_favCountUser, mean_favCountBot)
 
     plt.xticks(fontsize=12)  
     plt.yticks(fontsize=12) 
@@ -174,54 +204,30 @@ def main_graphix_post(db_connection):
     print("Done")
 
 # Function to print median and mean values for various user and bot statistics
-def stampa_cose(usernameUser, usernameBot, followersUser, followersBot, followingUser, followingBot, statusesUser, statusesBot, descriptionUser, descriptionBot):
+def stampa_cose(counts):
     """
     This function prints the median and mean values for various metrics (username length, followers count, etc.) 
     for both real users and bots.
+
+    Parameters:
+    - counts (dict): For each metric, the Counters of the real users and of the bots.
     """
-    # Print median and mean for username lengths
-    print('Median username length')
-    print(median(usernameUser))
-    print(median(usernameBot))
-    print('Mean username length')
-    print(mean(usernameUser))
-    print(mean(usernameBot))
-    print()
-
-    # Print median and mean for followers count
-    print('Median followers')
-    print(median(followersUser))
-    print(median(followersBot))
-    print('Mean followers')
-    print(mean(followersUser))
-    print(mean(followersBot))
-    print()
-    
-    # Print median and mean for following count
-    print('Median following')
-    print(median(followingUser))
-    print(median(followingBot))
-    print('Mean following')
-    print(mean(followingUser))
-    print(mean(followingBot))
-    print()
-
-    # Print median and mean for statuses count
-    print('Median statuses')
-    print(median(statusesUser))
-    print(median(statusesBot))
-    print('Mean statuses')
-    print(mean(statusesUser))
-    print(mean(statusesBot))
-    print()
-
-    # Print median and mean for description length
-    print('Median description length')
-    print(median(descriptionUser))
-    print(median(descriptionBot))
-    print('Mean description length')
-    print(mean(descriptionUser))
-    print(mean(descriptionBot))
+    titles = [
+        ('username', 'username length'),
+        ('followers', 'followers'),
+        ('following', 'following'),
+        ('statuses', 'statuses'),
+        ('description', 'description length'),
+    ]
+    for metric, title in titles:
+        user_counts, bot_counts = counts[metric]
+        print(f'Median {title}')
+        print(counter_median(user_counts))
+        print(counter_median(bot_counts))
+        print(f'Mean {title}')
+        print(counter_mean(user_counts))
+        print(counter_mean(bot_counts))
+        print()
 
 # Function to plot the response time over iterations
 def tempo_di_risposta(array):
@@ -250,15 +256,19 @@ def tempo_di_risposta(array):
     # Display the plot
     plt.show()
 
-def plot_user_stats(db_connection):
-    #prendo gli utenti
-    real_users = get_all_user(db_connection)
-    sorted_users = sorted(real_users, key=lambda user: user['statuses'], reverse=True)
-    statuses = [user['statuses'] for user in sorted_users]
-    num_users = list(range(1, len(sorted_users) + 1))
-
-    followers = [user['followers'] for user in real_users]
-    following = [user['following'] for user in real_users]
+def plot_user_stats(db_connection, parquet_dir=None):
+    #prendo gli utenti: dall'export Parquet se c'è (vedi Export.py), altrimenti dal database a blocchi;
+    #solo le tre colonne servono, in array NumPy
+    if parquet_dir:
+        real_users = read_users(parquet_dir, ['statuses', 'followers', 'following'], bot=0)
+        statuses, followers, following = real_users['statuses'], real_users['followers'], real_users['following']
+    else:
+        batches = [np.array(batch, dtype=np.int64) for batch in iter_all_user(db_connection, columns=['statuses', 'followers', 'following'])]
+        real_users = np.concatenate(batches) if batches else np.empty((0, 3), dtype=np.int64)
+        statuses, followers, following = real_users[:, 0], real_users[:, 1], real_users[:, 2]
+    if len(statuses) == 0:
+        print("None data")
+        return
     
 
     #media e mediana per tutti e 3 i grafici
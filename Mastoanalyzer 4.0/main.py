@@ -11,10 +11,17 @@ sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 httpx_logger = logging.getLogger("httpx")
 httpx_logger.setLevel(logging.WARNING)
 from graphix import main_graphix_user, main_graphix_post, tempo_di_risposta, plot_user_stats
-from credentials import access_token, instance_url, host, user, password, database
-from FetchAll import get_timeline_posts, async_debug
-from MySQL import create_bots_users_table, get_data_from_table
-from FindBot import find_bot
+from credentials import access_token, access_tokens, instance_url, host, user, password, database
+from FetchAll import get_timeline_posts, async_debug, async_worker_pool, crawl_tags
+from TokenPool import TokenPool
+from MySQL import create_bots_users_table
+from AsyncMySQL import create_pool, iter_users_keyset
+from FindBot import find_bot, find_bot_vectorized, find_bot_parquet
+from Streaming import stream_hashtags
+from valid_proxy import load_valid_proxies
+from Archive import ResponseArchive, ArchiveReplay
+from Export import export_tables
+from Schema import migrate
 
 def connect_to_db(): 
     """
@@ -50,16 +57,42 @@ async def async_main():
         'Content-Type': 'application/json'
     }
    
+    # The requests of options 1, 2 and 8 are spread over the tokens of `access_tokens`, each with its own rate limit
+    token_pool = TokenPool(access_tokens)
+    # Option 2 is anonymous by default: each proxy has its own limit, while a token is limited whatever the IP
+    authenticate_account_fetch = False
+
     db_connection = connect_to_db()
     if not db_connection:
         logging.error("Database connection failed. Exiting...")
         return
+    migrate(db_connection)  # Create the tables and indexes missing from the database
     
     # Define proxy lists to handle requests, fill them
-    proxy_list_1 = []
+    # (the first one starts with the proxies pre-validated by valid_proxy.py, best first)
+    proxy_list_1 = load_valid_proxies()
     proxy_list_2 = []
     proxy_list_3 = []
     proxy_lists = [proxy_list_1, proxy_list_2, proxy_list_3]
+    # Option 2: users in flight at the same time (all proxies are shared) and users read per page
+    concurrency = 10
+    batch_size = 100
+    incremental = True  # Request only the posts newer than the ones already stored
+    # Option 3: evaluate the rules on NumPy arrays instead of user by user
+    vectorized_scoring = True
+    rebuild_profile = False  # Compute the bot medians again from all the bots instead of reading the stored profile
+    # Options 1 and 2: record every raw response, or replay a recorded crawl offline
+    # (a replay requests the same pages only with the options of the recording, e.g. incremental)
+    archive_dir = None  # e.g. 'archive'
+    replay_archive = False  # If True, the responses are read from archive_dir instead of the server
+    archive, replay = None, None
+    # Option 9 exports users and posts to Parquet files; with analyze_from_parquet options 3 and 6 read them instead of MySQL
+    parquet_dir = 'parquet'
+    analyze_from_parquet = False
+    if archive_dir and replay_archive:
+        replay = ArchiveReplay(ResponseArchive(archive_dir))
+    elif archive_dir:
+        archive = ResponseArchive(archive_dir)
     
     try:
         while True:
@@ -71,34 +104,37 @@ async def async_main():
             print("4. Generate user graphs")
             print("5. Generate post graphs")
             print("6. Show data for users")
+            print("7. Stream new posts from the hashtags")
+            print("8. Fetch users from each hashtag concurrently")
+            print("9. Export users and posts to Parquet")
             print("q. Exit")
 
-            choice = input("Pick an option (1/2/3/4/5/6/q): ").strip().lower()
+            choice = input("Pick an option (1/2/3/4/5/6/7/8/9/q): ").strip().lower()
 
             match choice:
                 case '1':
                     start = time.time()
-                    all_users, array_tempo_di_risposta = get_timeline_posts(public_timeline_url, params, headers, db_connection)
+                    all_users, array_tempo_di_risposta = get_timeline_posts(public_timeline_url, params, headers, db_connection,
+                                                                          resume=replay is None, archive=archive, replay=replay,
+                                                                          token_pool=token_pool)
                     end = time.time()
                     diff = end - start
                     logging.info(f"Time for requests: {diff}")
                     tempo_di_risposta(array_tempo_di_risposta)
                     break
                 case '2':
-                    # Fetch data for different user groups
-                    users_group_1 = get_data_from_table(db_connection, "users", 0, 100)
-                    users_group_2 = get_data_from_table(db_connection, "users", 100, 100)
-                    users_group_3 = get_data_from_table(db_connection, "users", 200, 100)
-                    
-                    array_tempo_di_risposta = await handle_case_2(db_connection, proxy_lists, users_group_1, users_group_2, users_group_3)
-                    
-                    # Display response times for each group
-                    tempo_di_risposta(array_tempo_di_risposta[0])
-                    tempo_di_risposta(array_tempo_di_risposta[1])
-                    tempo_di_risposta(array_tempo_di_risposta[2])
+                    # Stream the whole users table to a bounded pool of workers
+                    array_tempo_di_risposta = await handle_case_2(proxy_lists, concurrency, batch_size, incremental, archive, replay,
+                                                                token_pool if authenticate_account_fetch else None)
+                    tempo_di_risposta(array_tempo_di_risposta)
                 case '3':
                     # Find suspicious accounts
-                    sos, num = find_bot(db_connection)
+                    if analyze_from_parquet:
+                        sos, num, masks = find_bot_parquet(parquet_dir, db_connection, rebuild_profile)
+                    elif vectorized_scoring:
+                        sos, num, masks = find_bot_vectorized(db_connection, rebuild_profile)
+                    else:
+                        sos, num = find_bot(db_connection, rebuild_profile=rebuild_profile)
                     logging.info(f"Number of suspicious users: {num}, these are: {sos}")
                     break
                 case '4':
@@ -110,48 +146,67 @@ async def async_main():
                     main_graphix_post(db_connection)
                 case '6':
                     # Show statistics for real users
-                    plot_user_stats(db_connection)
+                    plot_user_stats(db_connection, parquet_dir if analyze_from_parquet else None)
+                case '7':
+                    # Receive new posts from the streaming API instead of polling the timeline
+                    db_pool = await create_pool()
+                    try:
+                        await stream_hashtags([primary_tag] + additional_tags, db_pool)
+                    finally:
+                        db_pool.close()
+                        await db_pool.wait_closed()
+                case '8':
+                    # One cursor for each tag, users deduplicated across the tags
+                    db_pool = await create_pool()
+                    start = time.time()
+                    try:
+                        all_users, tag_stats = await crawl_tags([primary_tag] + additional_tags, headers, db_pool,
+                                                                  token_pool=token_pool)
+                    finally:
+                        db_pool.close()
+                        await db_pool.wait_closed()
+                    logging.info(f"Time for requests: {time.time() - start}")
+                case '9':
+                    # Snapshot of the users and the posts added since the last export
+                    users, posts = export_tables(db_connection, parquet_dir)
+                    logging.info(f"Exported {users} users and {posts} new posts to {parquet_dir}")
                 case 'q':
                     print("Exiting the program.")
                     break
                 case _:
-                    print("Invalid option. Please choose 1/2/3/4/5/6 or q.")
+                    print("Invalid option. Please choose 1/2/3/4/5/6/7/8/9 or q.")
     finally:
         db_connection.close()
+        if archive is not None:
+            archive.close()
 
-async def handle_case_2(db_connection, proxy_lists, users_group_1, users_group_2, users_group_3):
+async def handle_case_2(proxy_lists, concurrency, batch_size, incremental, archive=None, replay=None, token_pool=None):
     """
-    Handle case 2: Fetch data for users using multiple proxies and measure response times.
+    Handle case 2: Fetch posts for every user of the table and measure response times.
+    Users are read lazily with keyset pagination and fed to the worker pool, so memory stays constant.
+    Database access goes through a pool of aiomysql connections, one for each worker at most.
+    With a token_pool the requests are authenticated and spread over its tokens.
     """
+    db_pool = await create_pool(maxsize=concurrency + 1)  # One more connection for the users stream
+
+    async def users():
+        async for batch in iter_users_keyset(db_pool, batch_size):
+            for user in batch:
+                yield user
+
+    proxy_list = [proxy for proxy_list in proxy_lists for proxy in proxy_list]
     start = time.time()
-    array_tempo_di_risposta = await run_debug_tasks(users_group_1, users_group_2, users_group_3, db_connection, proxy_lists)
+    try:
+        array_tempo_di_risposta = await async_worker_pool(users(), db_pool, proxy_list, concurrency, incremental,
+                                                    archive=archive, replay=replay, token_pool=token_pool)
+    finally:
+        db_pool.close()
+        await db_pool.wait_closed()
     end = time.time()
     diff = end - start
-    print(array_tempo_di_risposta[0]) # Each numeric value represents the time to query one user, i.e., the time for 5 requests.
-    print()
-    print(array_tempo_di_risposta[1])
-    print()
-    print(array_tempo_di_risposta[2])
+    print(array_tempo_di_risposta) # Each numeric value represents the time to query one user, i.e., the time for 5 requests.
     logging.info(f"Time for requests (handle_case_2): {diff}")
     return array_tempo_di_risposta
 
-async def run_debug_tasks(users_group_1, users_group_2, users_group_3, db_connection, proxy_lists):
-    """
-    Create asynchronous tasks to debug user groups using proxies.
-    """
-    tasks = []
-    users_groups = [users_group_1, users_group_2, users_group_3]
-    
-    # For each proxy list and user group, create a task
-    for idx, proxy_list in enumerate(proxy_lists):
-        # Pass the correct user group for each iteration
-        users = users_groups[idx]
-        task = asyncio.create_task(async_debug(users, db_connection, proxy_list))
-        tasks.append(task)
-    
-    # Gather all task results, which are response time arrays [[], [], []].
-    responses = await asyncio.gather(*tasks)
-    return responses
-
 if __name__ == "__main__":
     asyncio.run(async_main())
@@ -1,8 +1,14 @@
 import requests
 import sys
 import os
+import json
+import time
+import asyncio
+import httpx
+from datetime import datetime, timezone
+from statistics import median
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-from credentials import access_token
+from credentials import access_token, endpoint_url
 
 def validate_proxies(proxy_list, endpoint_url):
     """
@@ -53,3 +59,130 @@ def validate_proxies(proxy_list, endpoint_url):
 
     print(f"Valid proxies: {valid_proxies}")
     return valid_proxies
+
+VALID_PROXIES_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'valid_proxies.json')
+
+async def probe_proxy(proxy, endpoint_url, headers, probes, timeout, semaphore):
+    """
+    Probes a proxy `probes` times against the endpoint and measures the latency of each probe.
+    A failed probe does not stop the others, so the success rate is measured over all of them.
+
+    Parameters:
+    - proxy (str): The proxy server URL; a bare ip:port is taken as an HTTP proxy.
+    - endpoint_url (str): The API endpoint to test the proxy against.
+    - headers (dict): HTTP headers for the requests (authentication token).
+    - probes (int): Number of probes.
+    - timeout (int): Timeout of each probe, in seconds.
+    - semaphore (asyncio.Semaphore): Limits the number of proxies probed at the same time.
+
+    Returns:
+    - dict: The proxy, its successes over the probes, success rate and median latency (None if no probe succeeded).
+    """
+    if '://' not in proxy:
+        proxy = f"http://{proxy}"  # A bare ip:port, as the requests validator accepted.
+    latencies = []
+    async with semaphore:
+        try:
+            client = httpx.AsyncClient(proxy=proxy, timeout=timeout)
+        except Exception as e:  # E.g. an unknown scheme, or socks5:// without socksio: 0 successes.
+            print(f"Unusable proxy {proxy}: {e}")
+            client = None
+        if client is not None:
+            async with client:
+                for _ in range(probes):
+                    try:
+                        start = time.time()
+                        response = await client.get(endpoint_url, headers=headers)
+                        response.raise_for_status()
+                        latencies.append(round(time.time() - start, 3))
+                    except Exception as e:
+                        print(f"Error with proxy {proxy}: {e}")
+    return {
+        'proxy': proxy,
+        'successes': len(latencies),
+        'probes': probes,
+        'success_rate': round(len(latencies) / probes, 3),
+        'median_latency': median(latencies) if latencies else None,
+    }
+
+async def validate_proxies_async(proxy_list, endpoint_url, concurrency=50, probes=3, timeout=15, output_path=VALID_PROXIES_FILE):
+    """
+    Validates a list of proxy servers concurrently, ranks them and saves the results.
+
+    Parameters:
+    - proxy_list (list): A list of proxy server URLs to be validated.
+    - endpoint_url (str): The API endpoint to test the proxies against.
+    - concurrency (int): Maximum number of proxies probed at the same time.
+    - probes (int): Number of probes for each proxy.
+    - timeout (int): Timeout of each probe, in seconds.
+    - output_path (str): The JSON file the ranked results are written to, read by `load_valid_proxies`.
+
+    Returns:
+    - ranked (list): The results of the working proxies, best first (success rate, then median latency).
+
+    Functionality:
+    - Every proxy is probed several times, at most `concurrency` proxies at a time, so 500 candidates
+      take about (500 / concurrency) * probes * timeout seconds in the worst case instead of 500 * timeout.
+    - The results file is timestamped and replaced atomically, so the fetch pipeline never reads half of it.
+    """
+    headers = {
+        'Authorization': f'Bearer {access_token}',
+        'Content-Type': 'application/json'
+    }
+    print(f"Total proxies to validate: {len(proxy_list)}")
+    semaphore = asyncio.Semaphore(concurrency)
+    results = await asyncio.gather(*[
+        probe_proxy(proxy, endpoint_url, headers, probes, timeout, semaphore) for proxy in proxy_list
+    ])
+
+    ranked = [result for result in results if result['successes'] > 0]
+    ranked.sort(key=lambda result: (-result['success_rate'], result['median_latency']))
+
+    temporary_path = output_path + '.tmp'
+    with open(temporary_path, 'w') as f:
+        json.dump({
+            'validated_at': datetime.now(timezone.utc).isoformat(),
+            'endpoint_url': endpoint_url,
+            'proxies': ranked,
+        }, f, indent=2)
+    os.replace(temporary_path, output_path)
+
+    print(f"Valid proxies: {len(ranked)} of {len(proxy_list)}, saved to {output_path}")
+    return ranked
+
+def load_valid_proxies(path=VALID_PROXIES_FILE, max_age=24 * 3600, min_success_rate=0.8):
+    """
+    Loads the proxies saved by `validate_proxies_async`, best first.
+
+    Parameters:
+    - path (str): The JSON file written by `validate_proxies_async`.
+    - max_age (int): Results older than this many seconds are ignored.
+    - min_success_rate (float): Only proxies with at least this success rate are returned.
+
+    Returns:
+    - list: The proxy URLs, or an empty list if the file is missing, malformed or too old.
+    """
+    try:
+        with open(path) as f:
+            content = f.read()
+    except OSError:
+        return []
+    try:
+        results = json.loads(content)
+        validated_at = datetime.fromisoformat(results['validated_at'])
+        age = (datetime.now(timezone.utc) - validated_at).total_seconds()
+        proxies = [result['proxy'] for result in results['proxies'] if result['success_rate'] >= min_success_rate]
+    except (KeyError, TypeError, ValueError) as e:  # json.JSONDecodeError is a ValueError
+        print(f"Unreadable validated proxies in {path} ({e!r}), ignoring them.")
+        return []
+
+    if age > max_age:
+        print(f"The validated proxies in {path} are {round(age / 3600, 1)} hours old, ignoring them.")
+        return []
+    return proxies
+
+if __name__ == "__main__":
+    # Candidate proxies, one per line
+    with open(sys.argv[1] if len(sys.argv) > 1 else 'proxies.txt') as f:
+        candidates = [line.strip() for line in f if line.strip()]
+    asyncio.run(validate_proxies_async(candidates, endpoint_url))